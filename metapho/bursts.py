@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Put images in the order they were taken, and find bursts:
+runs of shots taken within a few seconds of each other,
+which usually all want the same tags.
+
+Times come from the EXIF DateTimeOriginal (with SubSecTimeOriginal,
+since a burst may be ten frames in one second) by way of the
+metadata cache, falling back to the file's mtime.
+"""
+
+import math
+import time
+import os
+
+from .metacache import MetadataCache, CACHEFILE
+from .dirwalk import natural_sort_key
+
+
+def taken_seconds(metadata):
+    """When the image was taken, in seconds since the epoch,
+       from metadata as returned by MetadataCache.get().
+    """
+    try:
+        secs = time.mktime(time.strptime(metadata['taken'],
+                                         "%Y:%m:%d %H:%M:%S"))
+    except (TypeError, ValueError, OverflowError):
+        # No date, or a camera that writes "0000:00:00 00:00:00"
+        return metadata['mtime'] / 1e9
+    subsec = metadata['exif'].get('SubsecTimeOriginal')
+    if subsec is not None:
+        try:
+            secs += float('0.' + str(subsec).strip())
+        except ValueError:
+            pass
+    return secs
+
+
+def capture_times(filenames, cachefile=CACHEFILE):
+    """Return { filename: seconds } for the filenames that exist,
+       reading metadata for any that aren't in the cache yet.
+    """
+    abspaths = { f: os.path.abspath(f) for f in filenames }
+    cache = MetadataCache(cachefile)
+    metadata = cache.populate(set(abspaths.values()))[0]
+    cache.close()
+    return { f: taken_seconds(metadata[path])
+             for f, path in abspaths.items() if path in metadata }
+
+
+def sort_by_taken(filenames, times):
+    """Sort filenames by the times from capture_times(),
+       then by name. Files with no time go at the end.
+    """
+    return sorted(filenames,
+                  key=lambda f: (times.get(f, math.inf), natural_sort_key(f)))
+
+
+def find_bursts(filenames, times, maxgap):
+    """Split filenames, in the order given, into bursts:
+       lists of consecutive images each taken no more than maxgap seconds
+       after the one before. Returns only the bursts of more than one image.
+    """
+    bursts = []
+    burst = []
+    lasttime = None
+    for f in filenames:
+        t = times.get(f)
+        if burst and (t is None or lasttime is None
+                      or abs(t - lasttime) > maxgap):
+            if len(burst) > 1:
+                bursts.append(burst)
+            burst = []
+        burst.append(f)
+        lasttime = t
+    if len(burst) > 1:
+        bursts.append(burst)
+    return bursts
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Tag categories: an ordered mapping from category names to the
+lists of tag numbers in them, as Tagger.categories.
+
+Each category also gets a number when it's created that stays the same
+when it's renamed or moved, so renaming or moving a category doesn't
+rebuild anything, and the tag numbers in each category are kept in a
+set as well as a list, so checking whether a tag is in a category
+doesn't search the list.
+"""
+
+import collections
+import collections.abc
+
+
+class CategoryTags(list):
+    """The tag numbers in one category, in order, that can tell
+       whether a tag is in the category without searching.
+       A tag is only in a category once.
+    """
+
+    def __init__(self, tagnos=()):
+        super().__init__(tagnos)
+        self.members = set(self)
+
+    def __contains__(self, tagno):
+        return tagno in self.members
+
+    def append(self, tagno):
+        super().append(tagno)
+        self.members.add(tagno)
+
+    def extend(self, tagnos):
+        for tagno in tagnos:
+            self.append(tagno)
+
+    def __iadd__(self, tagnos):
+        self.extend(tagnos)
+        return self
+
+    def insert(self, i, tagno):
+        super().insert(i, tagno)
+        self.members.add(tagno)
+
+    def remove(self, tagno):
+        super().remove(tagno)
+        self.members.discard(tagno)
+
+    def pop(self, i=-1):
+        tagno = super().pop(i)
+        self.members.discard(tagno)
+        return tagno
+
+    def __setitem__(self, i, tagnos):
+        super().__setitem__(i, tagnos)
+        self.members = set(self)
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.members = set(self)
+
+    def clear(self):
+        super().clear()
+        self.members = set()
+
+    def copy(self):
+        return CategoryTags(self)
+
+
+class Categories(collections.abc.MutableMapping):
+    """The categories, { name: CategoryTags }, in the order they were
+       added unless they've been moved since. Assigning a plain list
+       to a category makes it a CategoryTags.
+    """
+
+    def __init__(self, categories=()):
+        # { category number: CategoryTags }, in order
+        self._tags = collections.OrderedDict()
+
+        # { name: category number } and { category number: name }
+        self._ids = {}
+        self._names = {}
+
+        self._next_id = 0
+
+        # The names in the order format_tags() writes them,
+        # or None if a category has been added or renamed since
+        self._sorted = None
+
+        self.update(categories)
+
+    def __getitem__(self, name):
+        return self._tags[self._ids[name]]
+
+    def __setitem__(self, name, tagnos):
+        if not isinstance(tagnos, CategoryTags):
+            tagnos = CategoryTags(tagnos)
+        if name in self._ids:
+            self._tags[self._ids[name]] = tagnos
+            return
+        catid = self._next_id
+        self._next_id += 1
+        self._ids[name] = catid
+        self._names[catid] = name
+        self._tags[catid] = tagnos
+        self._sorted = None
+
+    def __delitem__(self, name):
+        catid = self._ids.pop(name)
+        del self._names[catid]
+        del self._tags[catid]
+        self._sorted = None
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def __iter__(self):
+        return (self._names[catid] for catid in self._tags)
+
+    def __len__(self):
+        return len(self._tags)
+
+    def __repr__(self):
+        return "Categories(%r)" % [ (name, list(self[name])) for name in self ]
+
+    def category_id(self, name):
+        """The number of a category, which doesn't change
+           when it's renamed or moved.
+        """
+        return self._ids[name]
+
+    def category_name(self, catid):
+        """The current name of the category numbered catid."""
+        return self._names[catid]
+
+    def rename(self, old, new):
+        """Rename a category, keeping its place and its number."""
+        if new == old:
+            return
+        if new in self._ids:
+            raise ValueError("There's already a category called %s" % new)
+        catid = self._ids.pop(old)
+        self._ids[new] = catid
+        self._names[catid] = new
+        self._sorted = None
+
+    def move_to_end(self, name, last=True):
+        """Move a category to the end, or the beginning if last is false,
+           like OrderedDict.move_to_end().
+        """
+        self._tags.move_to_end(self._ids[name], last)
+
+    def reorder(self, names):
+        """Put the categories in the order given. Any not named
+           keep their order, after those that are.
+        """
+        for name in reversed(names):
+            self.move_to_end(name, last=False)
+
+    def sorted_names(self):
+        """The category names in the order Tags files list them in,
+           which doesn't depend on how they've been moved around.
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self._ids)
+        return self._sorted
+
+    def copy(self):
+        """A copy, with the same category numbers, whose tag lists
+           can be changed without changing these.
+        """
+        copy = Categories()
+        for catid, tagnos in self._tags.items():
+            copy._tags[catid] = CategoryTags(tagnos)
+        copy._ids = dict(self._ids)
+        copy._names = dict(self._names)
+        copy._next_id = self._next_id
+        return copy
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+A persistent cache of directory state, so that notags can skip
+re-reading directories and Tags files that haven't changed since
+the last run.
+
+For each directory, the cache remembers its mtime and listing,
+which Tags files mention files in it, and the untagged result
+computed from all that. For each Tags file, it remembers its mtime
+and the files it tags. A directory's mtime changes whenever a file
+is added to it or removed from it, so if neither the directory
+nor any Tags file mentioning it has changed, its cached result
+can be used as is.
+"""
+
+import json
+import time
+import os
+
+from .tagger import Tagger, parse_tags_file, tags_lock
+
+
+CACHEFILE = os.path.expanduser('~/.cache/metapho/notags.json')
+
+# Bump this if the cache format changes.
+CACHE_VERSION = 1
+
+
+class DirStateCache:
+    """Cached per-directory and per-Tags-file state for notags.
+       If full is true, ignore anything previously cached
+       (but still save the new state).
+    """
+
+    def __init__(self, cachefile=CACHEFILE, full=False):
+        self.cachefile = cachefile
+
+        # { dirpath: { "mtime": ns, "files": [...], "subdirs": [...],
+        #              "state": [...], "nfiles": int,
+        #              "some_tagged": bool, "untagged": [basename, ...] } }
+        self.dirs = {}
+
+        # { tagfilepath: { "mtime": ns, "files": [abspath, ...] } }
+        self.tagfiles = {}
+
+        # Timing statistics from the last scan()
+        self.stats = {}
+
+        if not full:
+            self.load()
+
+    @staticmethod
+    def config():
+        """Settings that, if changed, invalidate everything cached."""
+        return { "version": CACHE_VERSION,
+                 "skip_extensions": list(Tagger.SKIP_EXTENSIONS),
+                 "ignore_dirnames": list(Tagger.IGNORE_DIRNAMES) }
+
+    def load(self):
+        try:
+            with open(self.cachefile) as fp:
+                cache = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return
+        if cache.get("config") != self.config():
+            return
+        self.dirs = cache["dirs"]
+        self.tagfiles = cache["tagfiles"]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+        tmpfile = self.cachefile + '.tmp'
+        with open(tmpfile, 'w') as fp:
+            json.dump({ "config": self.config(),
+                        "dirs": self.dirs,
+                        "tagfiles": self.tagfiles }, fp)
+        os.replace(tmpfile, self.cachefile)
+
+    def list_dir(self, dirpath):
+        """Return the cache entry for dirpath, re-reading its listing
+           if its mtime has changed. Also returns a flag saying
+           whether the listing had to be re-read.
+           Like os.walk, symlinks to directories aren't followed.
+        """
+        mtime = os.stat(dirpath).st_mtime_ns
+        entry = self.dirs.get(dirpath)
+        if entry and entry["mtime"] == mtime:
+            return entry, False
+
+        files = []
+        subdirs = []
+        with os.scandir(dirpath) as it:
+            for dirent in it:
+                try:
+                    if dirent.is_dir():
+                        if not dirent.is_symlink():
+                            subdirs.append(dirent.name)
+                    else:
+                        files.append(dirent.name)
+                except OSError:
+                    continue
+        entry = { "mtime": mtime,
+                  "files": sorted(files), "subdirs": sorted(subdirs) }
+        self.dirs[dirpath] = entry
+        return entry, True
+
+    def tagfile_entry(self, dirpath, files):
+        """Return (tagfilepath, cache entry) for the Tags (or Keywords)
+           file in dirpath, re-parsing it if its mtime has changed,
+           or (None, None) if there isn't one.
+        """
+        for tagfilename in ("Tags", "Keywords"):
+            if tagfilename in files:
+                break
+        else:
+            return None, None
+
+        tagfilepath = os.path.join(dirpath, tagfilename)
+        try:
+            mtime = os.stat(tagfilepath).st_mtime_ns
+        except FileNotFoundError:
+            return None, None
+        entry = self.tagfiles.get(tagfilepath)
+        if entry and entry["mtime"] == mtime:
+            return tagfilepath, entry
+
+        tagged = set()
+        with tags_lock(dirpath), open(tagfilepath) as fp:
+            for item in parse_tags_file(fp, tagfilepath):
+                if item[0] == 'tag':
+                    for o in item[2]:
+                        tagged.add(os.path.normpath(os.path.join(dirpath, o)))
+        entry = { "mtime": mtime, "files": sorted(tagged) }
+        self.tagfiles[tagfilepath] = entry
+        return tagfilepath, entry
+
+    def scan(self, topdir):
+        """Find what needs tagging under topdir, using cached state
+           for anything that hasn't changed.
+           Returns (nonexistent_files, untagged_files, untagged_dirs)
+           like MetaphoImage.find_nonexistent_files() and
+           Tagger.find_untagged_files(), with absolute paths.
+           Timing information is left in self.stats.
+        """
+        topdir = os.path.abspath(topdir)
+        elapsed = {}
+        reread = set()
+        seen = set()
+
+        # Walk the tree, top down, skipping ignored directories,
+        # and read (or re-read) Tags files.
+        walked = []
+        tagfiles = {}
+        stack = [ topdir ]
+        while stack:
+            dirpath = stack.pop()
+            t0 = time.perf_counter()
+            entry, changed = self.list_dir(dirpath)
+            seen.add(dirpath)
+            if changed:
+                reread.add(dirpath)
+            walked.append(dirpath)
+
+            tagfilepath, tagentry = self.tagfile_entry(dirpath,
+                                                       entry["files"])
+            if tagfilepath:
+                tagfiles[tagfilepath] = tagentry
+
+            for d in reversed(entry["subdirs"]):
+                if Tagger.ignore_directory(d):
+                    continue
+                subdir = os.path.join(dirpath, d)
+                subentry, subchanged = self.list_dir(subdir)
+                seen.add(subdir)
+                if subchanged:
+                    reread.add(subdir)
+                if "NoTags" in subentry["files"]:
+                    continue
+                stack.append(subdir)
+            elapsed[dirpath] = time.perf_counter() - t0
+
+        # Group everything tagged by directory,
+        # noting which Tags files mention each directory.
+        tagged_by_dir = {}
+        tagfiles_by_dir = {}
+        for tagfilepath, tagentry in tagfiles.items():
+            for f in tagentry["files"]:
+                dirpath, base = os.path.split(f)
+                tagged_by_dir.setdefault(dirpath, set()).add(base)
+                tagfiles_by_dir.setdefault(dirpath, set()).add(tagfilepath)
+
+        # Tagged files that don't exist on disk.
+        # Use the listings where we have them, rather than stat.
+        nonexistent = []
+        for dirpath, bases in tagged_by_dir.items():
+            entry = self.dirs.get(dirpath) if dirpath in elapsed else None
+            for base in bases:
+                if entry:
+                    exists = base in entry["files"]
+                else:
+                    exists = os.path.exists(os.path.join(dirpath, base))
+                if not exists:
+                    nonexistent.append(os.path.join(dirpath, base))
+        nonexistent.sort()
+
+        # Now find what's untagged, directory by directory.
+        untagged_files = []
+        untagged_dirs = []
+        ncached = nrecomputed = 0
+        cached_time = recomputed_time = 0.
+        for dirpath in walked:
+            t0 = time.perf_counter()
+            entry = self.dirs[dirpath]
+            state = [ entry["mtime"] ] + [
+                [ tf, tagfiles[tf]["mtime"] ]
+                for tf in sorted(tagfiles_by_dir.get(dirpath, ())) ]
+
+            if dirpath in reread or entry.get("state") != state:
+                tagged = tagged_by_dir.get(dirpath, set())
+                entry["nfiles"] = 0
+                entry["some_tagged"] = False
+                entry["untagged"] = []
+                for f in entry["files"]:
+                    if not Tagger.is_taggable(f):
+                        continue
+                    entry["nfiles"] += 1
+                    if f in tagged:
+                        entry["some_tagged"] = True
+                    else:
+                        entry["untagged"].append(f)
+                entry["state"] = state
+                recomputed = True
+            else:
+                recomputed = False
+
+            if entry["some_tagged"]:
+                untagged_files += [ os.path.join(dirpath, f)
+                                    for f in entry["untagged"] ]
+            elif entry["nfiles"]:
+                untagged_dirs.append(dirpath)
+
+            t = elapsed[dirpath] + time.perf_counter() - t0
+            if recomputed:
+                nrecomputed += 1
+                recomputed_time += t
+            else:
+                ncached += 1
+                cached_time += t
+
+        # Forget about directories and Tags files under topdir
+        # that weren't seen this time.
+        prefix = topdir.rstrip(os.sep) + os.sep
+        for d in list(self.dirs):
+            if d not in seen and (d == topdir or d.startswith(prefix)):
+                del self.dirs[d]
+        for tf in list(self.tagfiles):
+            if tf not in tagfiles and tf.startswith(prefix):
+                del self.tagfiles[tf]
+
+        self.stats = { "cached": ncached, "cached_time": cached_time,
+                       "recomputed": nrecomputed,
+                       "recomputed_time": recomputed_time }
+
+        return nonexistent, untagged_files, untagged_dirs
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Expand directory arguments into image filenames, as a generator,
+so a viewer can start showing images while a big tree is still
+being read, and so nobody has to pass 80,000 filenames through
+a shell glob.
+"""
+
+from functools import lru_cache
+import re
+import os
+
+from .tagger import Tagger
+
+
+@lru_cache(maxsize=None)
+def natural_sort_key(s):
+    """A sort key that puts IMG_9.jpg before IMG_10.jpg.
+       Keys are cached, since sorting asks for them over and over.
+    """
+    return tuple(int(part) if part.isdigit() else part.lower()
+                 for part in re.split(r'(\d+)', s))
+
+
+def iter_image_files(paths, recursive=False, natural=False):
+    """Generate image filenames from a list of paths.
+       Files are passed through as is; directories are expanded
+       into the taggable files they contain (see Tagger.is_taggable),
+       and if recursive is true, their subdirectories too, except
+       those Tagger.ignore_directory() says to skip. Like os.walk(),
+       symlinks to directories aren't followed, so a link back up
+       the tree can't loop.
+       Files in each directory are sorted by name, or naturally
+       (see natural_sort_key) if natural is true.
+    """
+    sortkey = natural_sort_key if natural else None
+    for path in paths:
+        if os.path.isdir(path):
+            yield from _iter_dir(path, recursive, sortkey)
+        else:
+            yield path
+
+
+def _iter_dir(dirpath, recursive, sortkey):
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_dir():
+                        # A symlink to a directory
+                        continue
+                    elif Tagger.is_taggable(entry.name):
+                        files.append(entry.name)
+                except OSError:
+                    continue
+    except OSError as e:
+        print("Can't read %s: %s" % (dirpath, e))
+        return
+
+    for f in sorted(files, key=sortkey):
+        yield os.path.join(dirpath, f)
+
+    if not recursive:
+        return
+    for d in sorted(subdirs, key=sortkey):
+        if not Tagger.ignore_directory(d, dirpath):
+            yield from _iter_dir(os.path.join(dirpath, d), recursive, sortkey)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Read EXIF straight from the headers of JPEG and TIFF-based files
+(which includes most camera raw formats), without opening the image
+the way PIL does. Only the pages holding the JPEG markers and the
+EXIF block are ever read from disk, so it's fast enough for sorting
+or exporting locations from tens of thousands of images.
+
+read_exif() returns the same dictionary as metacache.exif_dict(),
+GPS coordinates included. (For TIFFs, where PIL finds no EXIF at all,
+it returns the tags in the main TIFF directory.)
+
+Run it as a script to compare it with PIL on a set of files:
+    python -m metapho.exifreader [-r] dir_or_file ...
+"""
+
+import struct
+import mmap
+import math
+
+try:
+    from PIL.ExifTags import TAGS, GPSTAGS
+except ImportError:
+    # Without PIL, only name the tags metapho itself looks at.
+    TAGS = { 0x010f: 'Make', 0x0110: 'Model', 0x0112: 'Orientation',
+             0x0132: 'DateTime', 0x8769: 'ExifOffset', 0x8825: 'GPSInfo',
+             0x9003: 'DateTimeOriginal' }
+    GPSTAGS = { 1: 'GPSLatitudeRef', 2: 'GPSLatitude',
+                3: 'GPSLongitudeRef', 4: 'GPSLongitude',
+                5: 'GPSAltitudeRef', 6: 'GPSAltitude' }
+
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+IMAGE_WIDTH = 0x0100
+IMAGE_LENGTH = 0x0101
+
+# TIFF field types: (struct format, size of one value)
+BYTE, ASCII, SHORT, LONG, RATIONAL, SBYTE, UNDEFINED, \
+    SSHORT, SLONG, SRATIONAL, FLOAT, DOUBLE, IFD = range(1, 14)
+FIELD_TYPES = {
+    BYTE: ('B', 1), ASCII: ('s', 1), SHORT: ('H', 2), LONG: ('L', 4),
+    RATIONAL: ('LL', 8), SBYTE: ('b', 1), UNDEFINED: ('s', 1),
+    SSHORT: ('h', 2), SLONG: ('l', 4), SRATIONAL: ('ll', 8),
+    FLOAT: ('f', 4), DOUBLE: ('d', 8), IFD: ('L', 4),
+}
+
+# JPEG start-of-frame markers, which hold the image size.
+# 0xc4 (DHT), 0xc8 (JPG) and 0xcc (DAC) are in the range but aren't frames.
+SOF_MARKERS = set(range(0xc0, 0xd0)) - { 0xc4, 0xc8, 0xcc }
+SOS = 0xda
+
+# EXIF tags that are long unreadable binary data, not worth keeping
+SKIP_EXIF_TAGS = ( 'MakerNote', 'UserComment', 'PrintImageMatching' )
+
+
+def jsonable(val):
+    """Convert an EXIF value to something JSON can store:
+       rationals become floats, tuples lists, and bytes are decoded
+       if they're text or dropped if they're not.
+    """
+    if isinstance(val, (str, int, float)) or val is None:
+        return val
+    if isinstance(val, bytes):
+        try:
+            return val.decode().strip('\0')
+        except UnicodeDecodeError:
+            return None
+    if isinstance(val, (tuple, list)):
+        return [ jsonable(v) for v in val ]
+    try:
+        return float(val)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return str(val)
+
+
+def dms_to_degrees(dms, ref):
+    """Turn a (degrees, minutes, seconds) triple like (36.0, 16.0, 12.97)
+       and a ref like 'S' into signed decimal degrees.
+    """
+    degrees = (float(dms[0]) + float(dms[1]) / 60. + float(dms[2]) / 3600.)
+    if ref in ('S', 'W'):
+        degrees = -degrees
+    return degrees
+
+
+class _TiffReader:
+    """Reads IFDs from a TIFF block: the part of buf from base to end,
+       which starts with a TIFF header, "II*\\0" or "MM\\0*".
+       Offsets are relative to base, as they are in the file.
+    """
+
+    def __init__(self, buf, base=0, end=None):
+        self.buf = buf
+        self.base = base
+        self.end = len(buf) if end is None else end
+        self.order = '<' if buf[base:base + 2] == b'II' else '>'
+        self.first_ifd = self.unpack('L', 4)[0]
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from(self.order + fmt, self.buf,
+                                  self.base + offset)
+
+    def read_ifd(self, offset):
+        """Return { tag: value } for the IFD at offset, with values
+           converted the way PIL converts them.
+        """
+        entries = {}
+        count = self.unpack('H', offset)[0]
+        for i in range(count):
+            entry = offset + 2 + 12 * i
+            tag, typ, n = self.unpack('HHL', entry)
+            if typ not in FIELD_TYPES:
+                continue
+            fmt, size = FIELD_TYPES[typ]
+            datalen = size * n
+            if datalen <= 4:
+                data = entry + 8
+            else:
+                data = self.unpack('L', entry + 8)[0]
+            if self.base + data + datalen > self.end:
+                continue
+            entries[tag] = self.value(typ, fmt, n, data, datalen)
+        return entries
+
+    def value(self, typ, fmt, n, data, datalen):
+        start = self.base + data
+        if typ in (BYTE, UNDEFINED):
+            return self.buf[start:start + datalen]
+        if typ == ASCII:
+            s = self.buf[start:start + datalen]
+            if s.endswith(b'\0'):
+                s = s[:-1]
+            return s.decode('latin-1', 'replace')
+
+        vals = self.unpack('%d%s' % (n, fmt[0]) if len(fmt) == 1
+                           else fmt * n, data)
+        if typ in (RATIONAL, SRATIONAL):
+            vals = tuple(num / denom if denom else math.nan
+                         for num, denom in zip(vals[::2], vals[1::2]))
+        if len(vals) == 1:
+            return vals[0]
+        return vals
+
+    def read_exif(self):
+        """Return { tag: value } for IFD0 merged with the EXIF IFD,
+           and the GPS IFD as a dictionary under the GPSInfo tag,
+           like PIL's _getexif().
+        """
+        tags = self.read_ifd(self.first_ifd)
+        try:
+            if EXIF_IFD in tags:
+                tags.update(self.read_ifd(tags[EXIF_IFD]))
+        except (struct.error, TypeError):
+            pass
+        try:
+            if GPS_IFD in tags:
+                tags[GPS_IFD] = self.read_ifd(tags[GPS_IFD])
+        except (struct.error, TypeError):
+            del tags[GPS_IFD]
+        return tags
+
+
+def _jpeg_segments(buf):
+    """Generate (marker, start, end) for each segment in a JPEG
+       up to the image data, where buf[start:end] is its payload.
+    """
+    pos = 2
+    while pos + 4 <= len(buf):
+        if buf[pos] != 0xff:
+            return
+        marker = buf[pos + 1]
+        if marker == 0xff:
+            # Padding
+            pos += 1
+            continue
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            # Markers without a length
+            pos += 2
+            continue
+        length = struct.unpack_from('>H', buf, pos + 2)[0]
+        yield marker, pos + 4, pos + 2 + length
+        if marker == SOS:
+            return
+        pos += 2 + length
+
+
+def _read_header(buf):
+    """Return (size, tags) from an image's header, where tags is
+       { tag: value } as read by _TiffReader.read_exif().
+       Either may be None if it isn't there.
+       Raises ValueError if it's not a JPEG or TIFF-based file.
+    """
+    if buf[:2] == b'\xff\xd8':
+        size = None
+        tags = None
+        for marker, start, end in _jpeg_segments(buf):
+            if marker == 0xe1 and tags is None \
+               and buf[start:start + 6] == b'Exif\0\0':
+                try:
+                    tags = _TiffReader(buf, start + 6, end).read_exif()
+                except struct.error:
+                    tags = {}
+            elif marker in SOF_MARKERS:
+                height, width = struct.unpack_from('>HH', buf, start + 1)
+                size = (width, height)
+                break
+        return size, tags
+
+    if buf[:4] in (b'II*\0', b'MM\0*'):
+        tags = _TiffReader(buf).read_exif()
+        try:
+            size = (tags[IMAGE_WIDTH], tags[IMAGE_LENGTH])
+        except KeyError:
+            size = None
+        return size, tags
+
+    raise ValueError("Not a JPEG or TIFF")
+
+
+def exif_names(tags):
+    """Turn { tag: value }, as read by a _TiffReader or PIL's _getexif(),
+       into { tagname: value }, with the GPS tags named too and
+       'GPS coordinates' added as a readable string if there's a location.
+       Values are converted with jsonable(), so they can be cached.
+    """
+    exif = {}
+    for k, v in tags.items():
+        name = TAGS.get(k)
+        if not name or name in SKIP_EXIF_TAGS:
+            continue
+        if name == 'GPSInfo':
+            if not isinstance(v, dict):
+                continue
+            v = { GPSTAGS.get(gk, str(gk)): jsonable(gv)
+                  for gk, gv in v.items() }
+        else:
+            v = jsonable(v)
+        if v is not None:
+            exif[name] = v
+
+    gpsinfo = exif.get('GPSInfo', {})
+    try:
+        latitude = dms_to_degrees(gpsinfo['GPSLatitude'],
+                                  gpsinfo.get('GPSLatitudeRef'))
+        longitude = dms_to_degrees(gpsinfo['GPSLongitude'],
+                                   gpsinfo.get('GPSLongitudeRef'))
+        exif['GPS coordinates'] = '%.6f, %.6f' % (latitude, longitude)
+    except (KeyError, TypeError, ValueError, IndexError):
+        pass
+
+    return exif
+
+
+def read_header(path):
+    """Read the size and EXIF of a JPEG or TIFF-based image,
+       without reading any image data.
+       Returns ((width, height), exif) where exif is the dictionary
+       metacache.exif_dict() would give, or None if the file isn't
+       a JPEG or TIFF or can't be read. The size may be None
+       if a TIFF-based file doesn't say.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                size, tags = _read_header(buf)
+        return size, exif_names(tags) if tags else {}
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def read_exif(path):
+    """Return a dictionary of the EXIF in the image at path,
+       like metacache.exif_dict(), or None if it's not a format
+       this module can read.
+    """
+    header = read_header(path)
+    if header is None:
+        return None
+    return header[1]
+
+
+def main():
+    """Time read_header() against PIL on a set of files,
+       and report any whose results differ.
+    """
+    import argparse
+    import time
+
+    from PIL import Image as PILImage
+    from .metacache import exif_dict
+    from .dirwalk import iter_image_files
+
+    parser = argparse.ArgumentParser(
+        description="Compare EXIF reading speed with PIL")
+    parser.add_argument('-r', '--recursive', action="store_true",
+                        help="Include subdirectories")
+    parser.add_argument('paths', nargs='+', help="Image files or directories")
+    args = parser.parse_args()
+
+    paths = list(iter_image_files(args.paths, recursive=args.recursive))
+
+    t0 = time.perf_counter()
+    ours = [ read_header(path) for path in paths ]
+    t1 = time.perf_counter()
+    pils = []
+    for path in paths:
+        try:
+            with PILImage.open(path) as img:
+                pils.append((img.size, exif_dict(img)))
+        except Exception:
+            pils.append(None)
+    t2 = time.perf_counter()
+
+    print("%d files: exifreader %.3f sec, PIL %.3f sec"
+          % (len(paths), t1 - t0, t2 - t1))
+
+    nread = 0
+    for path, ourinfo, pilinfo in zip(paths, ours, pils):
+        if ourinfo is None:
+            continue
+        nread += 1
+        # PIL doesn't find EXIF in TIFFs, so only compare sizes there.
+        if pilinfo is None or ourinfo[0] != pilinfo[0] \
+           or (pilinfo[1] and ourinfo[1] != pilinfo[1]):
+            print("Differs from PIL:", path)
+    print("%d of them JPEG or TIFF" % nread)
+
+
+if __name__ == '__main__':
+    main()
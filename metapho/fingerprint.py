@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Content fingerprints for image files, so tagged files that have been
+renamed or moved can be found again even if their names changed,
+or if several files share a name (like IMG_0001.JPG).
+
+Fingerprints are remembered across runs in ~/.cache/metapho,
+keyed by path and checked against the file's size and mtime,
+so an unchanged file is only ever read once.
+
+By default a fingerprint is a quick hash of the file's size plus its
+first and last blocks, which is plenty to tell camera images apart.
+Set the environment variable METAPHO_FINGERPRINT to "full" to hash
+whole files instead (using several processes), or to "off"
+to disable fingerprinting.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import hashlib
+import json
+import sys, os
+
+
+FINGERPRINT_CACHE = os.path.expanduser('~/.cache/metapho/fingerprints.json')
+
+# How much of the beginning and end of a file goes into a quick fingerprint
+BLOCKSIZE = 64 * 1024
+
+FINGERPRINT_MODES = ( 'quick', 'full', 'off' )
+
+
+def fingerprint_mode():
+    """The fingerprint mode requested by $METAPHO_FINGERPRINT."""
+    mode = os.getenv('METAPHO_FINGERPRINT', 'quick').lower()
+    if mode not in FINGERPRINT_MODES:
+        print("Unknown METAPHO_FINGERPRINT '%s': using 'quick'" % mode,
+              file=sys.stderr)
+        return 'quick'
+    return mode
+
+
+def quick_fingerprint(path):
+    """Hash the size of the file plus its first and last blocks."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        h.update(b'%d:' % size)
+        h.update(fp.read(BLOCKSIZE))
+        if size > BLOCKSIZE:
+            fp.seek(max(BLOCKSIZE, size - BLOCKSIZE))
+            h.update(fp.read(BLOCKSIZE))
+    return h.hexdigest()
+
+
+def full_fingerprint(path):
+    """Hash the whole file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fp:
+        while True:
+            block = fp.read(1024 * 1024)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def _fingerprint_or_none(args):
+    """For the process pool: returns None rather than raising."""
+    path, full = args
+    try:
+        return full_fingerprint(path) if full else quick_fingerprint(path)
+    except OSError:
+        return None
+
+
+class FingerprintCache:
+    """Remembered fingerprints, { path: [size, mtime_ns, fingerprint] }.
+       The entries for files that no longer exist are the useful ones:
+       they say what a missing file looked like, so it can be found again.
+    """
+
+    def __init__(self, cachefile=None, mode=None):
+        self.cachefile = cachefile if cachefile else FINGERPRINT_CACHE
+        self.mode = mode if mode else fingerprint_mode()
+        self.paths = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cachefile) as fp:
+                cache = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return
+        # Quick and full fingerprints can't be compared with each other
+        if cache.get("mode") == self.mode:
+            self.paths = cache["paths"]
+
+    def save(self):
+        if not self.changed or self.mode == 'off':
+            return
+        os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+        tmpfile = self.cachefile + '.tmp'
+        with open(tmpfile, 'w') as fp:
+            json.dump({ "mode": self.mode, "paths": self.paths }, fp)
+        os.replace(tmpfile, self.cachefile)
+        self.changed = False
+
+    def lookup(self, path):
+        """Return (size, fingerprint) last recorded for path,
+           whether or not it still exists, or None.
+        """
+        try:
+            size, mtime, fingerprint = self.paths[path]
+            return size, fingerprint
+        except KeyError:
+            return None
+
+    def fingerprint(self, path, st=None):
+        """Return the fingerprint of path, using the cached one
+           if the file's size and mtime haven't changed.
+           st is the result of os.stat(path), if the caller has it.
+           Returns None if fingerprinting is off or the file can't be read.
+        """
+        if self.mode == 'off':
+            return None
+        try:
+            if not st:
+                st = os.stat(path)
+            cached = self.paths.get(path)
+            if cached and cached[:2] == [st.st_size, st.st_mtime_ns]:
+                return cached[2]
+            if self.mode == 'full':
+                fingerprint = full_fingerprint(path)
+            else:
+                fingerprint = quick_fingerprint(path)
+        except OSError:
+            return None
+        self.paths[path] = [st.st_size, st.st_mtime_ns, fingerprint]
+        self.changed = True
+        return fingerprint
+
+    def remember(self, paths, workers=None):
+        """Make sure fingerprints are cached for all the given paths
+           that exist. Full fingerprints are computed in a process pool
+           of the given number of workers (default: one per CPU).
+        """
+        if self.mode == 'off':
+            return
+
+        needed = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            cached = self.paths.get(path)
+            if not cached or cached[:2] != [st.st_size, st.st_mtime_ns]:
+                needed.append((path, st))
+        if not needed:
+            return
+
+        if self.mode == 'full' and len(needed) > 1 and workers != 1:
+            # Don't fork: this may run in a GUI's background save thread.
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn')) as pool:
+                fingerprints = list(pool.map(
+                    _fingerprint_or_none,
+                    [ (path, True) for path, st in needed ],
+                    chunksize=8))
+        else:
+            fingerprints = [ _fingerprint_or_none((path,
+                                                   self.mode == 'full'))
+                             for path, st in needed ]
+
+        for (path, st), fingerprint in zip(needed, fingerprints):
+            if fingerprint:
+                self.paths[path] = [st.st_size, st.st_mtime_ns, fingerprint]
+                self.changed = True
@@ -147,8 +147,8 @@ class MetaPhoWindow(object):
             # If we have an image, and it has no tags set yet,
             # clone the tags from the previous image:
             if oldtags and not imagelist.image_list()[self.imgno].tags:
-                imagelist.image_list()[self.imgno].tags = oldtags[:]
-                self.tagger.changed = True
+                self.tagger.set_tags(oldtags,
+                                     [ imagelist.image_list()[self.imgno] ])
 
             self.tagger.set_image(imagelist.image_list()[self.imgno])
 
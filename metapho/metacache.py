@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+A persistent cache of image metadata -- dimensions, orientation,
+date taken, camera, GPS location and the rest of the EXIF --
+shared by all the metapho programs, so nobody has to decode EXIF
+for the same image twice.
+
+It's an SQLite database in ~/.cache/metapho, keyed by path and
+checked against each file's size and mtime, so an entry is only
+used while the file is unchanged.
+
+JPEG and TIFF-based files are read with exifreader; anything else
+needs PIL. Without it, other formats only get sizes and mtimes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import sqlite3
+import json
+import time
+import os
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+from .exifreader import read_header, exif_names
+
+
+CACHEFILE = os.path.expanduser('~/.cache/metapho/metadata.sqlite')
+
+# Bump this if the database layout or what's stored in it changes.
+CACHE_VERSION = 2
+
+# Don't bother starting a process pool for fewer images than this
+MIN_POOL_IMAGES = 32
+
+# The columns that hold metadata, besides path, size and mtime
+FIELDS = ( 'width', 'height', 'orientation', 'taken',
+           'make', 'model', 'latitude', 'longitude', 'exif' )
+
+
+def exif_dict(pil_img):
+    """Return a dictionary { tagname: value } of the EXIF in pil_img,
+       including the GPS tags, and 'GPS coordinates' as a readable string
+       if there's a location: see exifreader.exif_names().
+    """
+    try:
+        items = pil_img._getexif().items()
+    except Exception:
+        # Somewhere I saw a recommendation to call _getexif() rather
+        # than getexif(). Tiff images have getexif() but not _getexif();
+        # but they don't have exif anyway, so I guess that doesn't matter.
+        return {}
+
+    return exif_names(dict(items))
+
+
+def metadata_from_exif(size, exif):
+    """Pick out the fields the cache indexes from an exif_dict()."""
+    metadata = dict.fromkeys(FIELDS)
+    if size:
+        metadata['width'], metadata['height'] = size
+    metadata['orientation'] = exif.get('Orientation')
+    metadata['taken'] = exif.get('DateTimeOriginal') or exif.get('DateTime')
+    metadata['make'] = exif.get('Make')
+    metadata['model'] = exif.get('Model')
+    if 'GPS coordinates' in exif:
+        metadata['latitude'], metadata['longitude'] = \
+            map(float, exif['GPS coordinates'].split(','))
+    metadata['exif'] = exif
+    return metadata
+
+
+def read_metadata(path):
+    """Read metadata for the image at path, without decoding the image:
+       straight from the header for JPEG and TIFF-based files
+       (see exifreader), otherwise with PIL.
+       Returns a dictionary with keys FIELDS, all None if the file
+       can't be read as an image.
+    """
+    header = read_header(path)
+    if header and header[0]:
+        return metadata_from_exif(*header)
+    if not PILImage:
+        return dict.fromkeys(FIELDS)
+    try:
+        with PILImage.open(path) as img:
+            return metadata_from_exif(img.size, exif_dict(img))
+    except Exception:
+        return dict.fromkeys(FIELDS)
+
+
+def _read_metadata_chunk(paths):
+    """For the process pool."""
+    return [ read_metadata(path) for path in paths ]
+
+
+def taken_or_mtime(metadata):
+    """The date an image was taken, as "YYYY:MM:DD HH:MM:SS",
+       or if the EXIF doesn't say, the file's mtime in the same format.
+       Useful as a sort key.
+    """
+    if metadata['taken']:
+        return metadata['taken']
+    return time.strftime("%Y:%m:%d %H:%M:%S",
+                         time.localtime(metadata['mtime'] / 1e9))
+
+
+class MetadataCache:
+    """The metadata cache database.
+       A MetadataCache can only be used from the thread that created it;
+       other threads should make their own.
+    """
+
+    def __init__(self, cachefile=CACHEFILE):
+        self.cachefile = cachefile
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        self.db = sqlite3.connect(cachefile, timeout=30)
+        self.db.row_factory = sqlite3.Row
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != CACHE_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS metadata')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS metadata (
+                               path TEXT PRIMARY KEY,
+                               size INTEGER, mtime INTEGER,
+                               width INTEGER, height INTEGER,
+                               orientation INTEGER, taken TEXT,
+                               make TEXT, model TEXT,
+                               latitude REAL, longitude REAL,
+                               exif TEXT)''')
+        self.db.execute('PRAGMA user_version = %d' % CACHE_VERSION)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, path, st):
+        """Return cached metadata for path if it's current for st,
+           the result of os.stat(path), else None.
+        """
+        row = self.db.execute('SELECT * FROM metadata WHERE path = ?',
+                              (path,)).fetchone()
+        if not row or row['size'] != st.st_size \
+           or row['mtime'] != st.st_mtime_ns:
+            return None
+        metadata = dict(row)
+        metadata['exif'] = json.loads(metadata['exif'] or '{}')
+        return metadata
+
+    def put(self, path, st, metadata, commit=True):
+        """Store metadata (as returned by read_metadata) for path,
+           whose os.stat() is st. Returns the metadata as lookup()
+           would return it.
+        """
+        metadata = dict(metadata, path=path,
+                        size=st.st_size, mtime=st.st_mtime_ns)
+        columns = ('path', 'size', 'mtime') + FIELDS
+        values = [ metadata[c] for c in columns ]
+        values[-1] = json.dumps(metadata['exif'] or {})
+        self.db.execute('INSERT OR REPLACE INTO metadata (%s) VALUES (%s)'
+                        % (', '.join(columns), ', '.join('?' * len(columns))),
+                        values)
+        if commit:
+            self.db.commit()
+        metadata['exif'] = metadata['exif'] or {}
+        return metadata
+
+    def get(self, path):
+        """Return metadata for path, reading it from the file
+           if what's cached isn't current. path should be absolute.
+           Returns None if path doesn't exist.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        metadata = self.lookup(path, st)
+        if metadata is None:
+            metadata = self.put(path, st, read_metadata(path))
+        return metadata
+
+    def populate(self, paths, workers=None):
+        """Make sure metadata for all the given (absolute) paths is
+           cached, reading the ones that aren't in a process pool
+           of the given number of workers (default: one per CPU).
+           Returns a dictionary { path: metadata } for the paths
+           that exist, and the number of files that had to be read.
+        """
+        results = {}
+        needed = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            metadata = self.lookup(path, st)
+            if metadata is None:
+                needed.append((path, st))
+            else:
+                results[path] = metadata
+
+        if len(needed) >= MIN_POOL_IMAGES and workers != 1:
+            chunks = [ [ path for path, st in needed[i:i+MIN_POOL_IMAGES] ]
+                       for i in range(0, len(needed), MIN_POOL_IMAGES) ]
+            # Don't fork: the caller might be a GUI with threads running.
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn')) as pool:
+                read = [ m for chunk in pool.map(_read_metadata_chunk, chunks)
+                         for m in chunk ]
+        else:
+            read = [ read_metadata(path) for path, st in needed ]
+
+        with self.db:
+            for (path, st), metadata in zip(needed, read):
+                results[path] = self.put(path, st, metadata, commit=False)
+
+        return results, len(needed)
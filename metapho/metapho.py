@@ -14,6 +14,11 @@ import sys, os
 from . import imagelist
 
 
+# When looking for files that have moved since they were tagged,
+# give up after searching this many directories.
+MAX_MOVED_SEARCH_DIRS = 5000
+
+
 # The image list has both displayed and nondisplayed images,
 # because it's possible to run metapho on a subset of images in a directory,
 # to change or add tags on only those images, but there may be an existing
@@ -43,6 +48,11 @@ class MetaphoImage:
     """An image, with additional info such as rotation and tags.
     """
 
+    # There may be one of these for every image in a huge archive,
+    # so don't give each one a __dict__.
+    __slots__ = ( 'filename', 'relpath', 'tags', 'displayed',
+                  'invalid', 'rot' )
+
     def __init__(self, filename, displayed=True):
         """Initialize an image filename.
            Pass displayed=False if this image isn't to be shown
@@ -175,48 +185,152 @@ class MetaphoImage:
         return not_on_disk
 
     @classmethod
-    def clean_up_nonexistent_files(cls, topdir):
+    def nonexistent_images(cls):
+        """Returns a dictionary { filename: image } of images
+           in the imagelist that don't exist on disk.
+        """
+        return { im.filename: im for im in imagelist.image_list()
+                 if not os.path.exists(im.filename) }
+
+    @staticmethod
+    def find_moved_files(missing, topdir, maxdirs=MAX_MOVED_SEARCH_DIRS,
+                         fingerprints=None):
+        """missing is a list of absolute paths that don't exist on disk.
+           Look for files with the same names under topdir, starting
+           in the directories where they used to be and widening the
+           search one parent directory at a time, so nearby moves
+           are found quickly even when topdir is something huge like /.
+           Visit at most maxdirs directories (None means no limit).
+
+           If fingerprints is a FingerprintCache that remembers what
+           a missing file looked like, it's matched by content instead,
+           so it will be found even if it was renamed, and won't be
+           confused with a different file of the same name.
+
+           Doesn't touch the imagelist, so it's safe to call from
+           a background thread.
+           Returns a dictionary { old_path: new_path }.
+        """
+        topdir = os.path.abspath(topdir)
+        prefix = os.path.join(topdir, '')
+
+        def in_topdir(d):
+            return d == topdir or d.startswith(prefix)
+
+        # Old paths indexed by basename. There may be several
+        # missing files with the same name in different directories.
+        wanted = defaultdict(list)
+
+        # Old paths indexed by fingerprint, and the file sizes
+        # they had, so most files can be ruled out without reading them.
+        fpwanted = defaultdict(list)
+        sizes = set()
+
+        roots = set()
+        for f in missing:
+            known = fingerprints.lookup(f) if fingerprints else None
+            if known:
+                sizes.add(known[0])
+                fpwanted[known[1]].append(f)
+            else:
+                wanted[os.path.basename(f)].append(f)
+            d = os.path.dirname(f)
+            while in_topdir(d) and not os.path.isdir(d):
+                d = os.path.dirname(d)
+            if in_topdir(d):
+                roots.add(d)
+
+        def claim(candidates, newpath):
+            """Of several old paths that could have become newpath,
+               pick the one that used to be closest.
+            """
+            oldpath = max(candidates, key=lambda p: len(
+                os.path.commonpath([p, newpath])))
+            moved[oldpath] = newpath
+            candidates.remove(oldpath)
+
+        moved = {}
+        visited = set()
+        while (wanted or fpwanted) and roots:
+            for root in sorted(roots):
+                for dirpath, dirs, files in os.walk(root):
+                    if dirpath in visited:
+                        dirs[:] = []
+                        continue
+                    visited.add(dirpath)
+                    # Don't descend again into subtrees already searched
+                    dirs[:] = [ d for d in dirs
+                                if os.path.join(dirpath, d) not in visited ]
+
+                    for f in files:
+                        newpath = os.path.join(dirpath, f)
+                        if fpwanted:
+                            try:
+                                st = os.stat(newpath)
+                            except OSError:
+                                continue
+                            if st.st_size in sizes:
+                                fp = fingerprints.fingerprint(newpath, st)
+                                if fp in fpwanted:
+                                    claim(fpwanted[fp], newpath)
+                                    if not fpwanted[fp]:
+                                        del fpwanted[fp]
+                                    continue
+
+                        if f in wanted:
+                            claim(wanted[f], newpath)
+                            if not wanted[f]:
+                                del wanted[f]
+
+                    if not (wanted or fpwanted) or \
+                       (maxdirs and len(visited) >= maxdirs):
+                        return moved
+
+            # Widen the search to the parents of what was just searched.
+            roots = { os.path.dirname(r) for r in roots if r != topdir }
+
+        return moved
+
+    @classmethod
+    def apply_moved_files(cls, missing, moved):
+        """missing is a dictionary { filename: image } as returned by
+           nonexistent_images(), moved a dictionary as returned by
+           find_moved_files(). Point the images that moved at their
+           new locations, and remove the rest from the imagelist.
+           Returns a set of the basenames of the removed images.
+        """
+        removed = set()
+        for filename, img in missing.items():
+            if filename in moved:
+                img.filename = moved[filename]
+                img.relpath = moved[filename]
+            else:
+                removed.add(os.path.basename(filename))
+                try:
+                    imagelist.remove_image(img)
+                except ValueError:
+                    pass
+        return removed
+
+    @classmethod
+    def clean_up_nonexistent_files(cls, topdir, maxdirs=MAX_MOVED_SEARCH_DIRS,
+                                   fingerprints=None):
         """For any file that was referenced in a tag file but doesn't
            exist on disk, see if perhaps it's been moved to a different
            subdirectory under topdir. If so, adjust file path appropriately.
+           See find_moved_files() for how the search is limited,
+           and how fingerprints, a FingerprintCache, is used.
 
            Return a set of filenames removed in case the caller wants
            to warn the user or take other action.
            XXX Maybe better to convert to a list before returning?
         """
-        nefbases = set()
-        nefdict = {}
-        for f in cls.find_nonexistent_files():
-            fbase = os.path.basename(f)
-            nefbases.add(fbase)
-            if fbase in nefdict:
-                print("Warning: multiple files named", fbase)
-            else:
-                nefdict[fbase] = f
-
-        for root, dirs, files in os.walk(topdir):
-            root = os.path.normpath(root)
-            for f in files:
-                if f in nefbases:
-                    try:
-                        i = cls.image_index(nefdict[f])
-                        imagelist.get_image(i).filename = os.path.join(root, f)
-                    except ValueError:
-                        print("Eek!", nefdict[f], \
-                            "has vanished from the global image list")
-
-                    nefbases.remove(f)
-
-        # Now we've adjusted paths for any file that's moved.
-        # But what about files that have simply been removed?
-        # Those are still in nefbases.
-        if nefbases:
-            # print("Removing missing files from Tags file:", \
-            #     ' '.join([nefdict[f] for f in nefbases]))
-            for f in nefbases:
-                imagelist.remove_image(nefdict[f])
-
-        return nefbases
+        missing = cls.nonexistent_images()
+        if not missing:
+            return set()
+        moved = cls.find_moved_files(list(missing), topdir, maxdirs,
+                                     fingerprints)
+        return cls.apply_moved_files(missing, moved)
 
 if __name__ == '__main__':
     main()
@@ -7,15 +7,23 @@
 # Copyright 2007,2009,2020,2021 by Akkana Peck:
 # share and enjoy under the GPLv2 or later.
 
-# Wish list: Boolean logic. Currently this can search only for one
-# term/phrase at a time.
+# Boolean logic: the classic +/- pattern arguments handle simple
+# AND/OR/NOT lists. For anything more complicated, -e takes an expression
+# like '(sunset or dawn) and not blurry and dir:2023*', which is
+# evaluated with set operations over an inverted tag -> files index,
+# or, with -S, as one SQL query against a tag store (see tagstore.py).
 
 from __future__ import print_function
 
+from collections import defaultdict
+import fnmatch
 import glob
 import re
 import sys, os
 
+from metapho.trigram import TrigramIndex, substring_edit_distance
+from metapho.tagger import tags_lock
+
 
 DEBUG = False
 
@@ -75,6 +83,26 @@ def search_for_keywords(grepdirs, orpats, andpats, notpats,
                         pass
 
 
+def parse_tag_lines(fp):
+    """Generator: read lines from an open Tags or Keywords file,
+       yielding (tagstring, [imgfile, imgfile...]) for each tag line.
+       tagstring may hold several comma-separated tags.
+    """
+    for line in fp:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("category "):
+            continue
+        if line.startswith("tag "):
+            line = line[4:]
+        # Now we know it's a tag line.
+        parts = line.split(':')
+        if len(parts) < 2:
+            continue
+        yield parts[0].strip(), parts[1].strip().split()
+
+
 def search_for_keywords_in(d, f, orpats, andpats, notpats,
                            ignorecase: bool, taglines: bool):
     """Generator:
@@ -95,20 +123,8 @@ def search_for_keywords_in(d, f, orpats, andpats, notpats,
     if DEBUG:
         print("Reading tag file", f)
 
-    with open(f) as fp:
-        for line in fp:
-            line = line.strip()
-            if not line:
-                continue
-            if line.startswith("category "):
-                continue
-            if line.startswith("tag "):
-                line = line[4:]
-            # Now we know it's a tag line.
-            parts = line.split(':')
-            if len(parts) < 2:
-                continue
-            tags = parts[0].strip()
+    with tags_lock(os.path.dirname(f)), open(f) as fp:
+        for tags, imgfiles in parse_tag_lines(fp):
             if ignorecase:
                 tags = tags.lower()
             # There may be several comma-separated tags here, but we
@@ -116,7 +132,7 @@ def search_for_keywords_in(d, f, orpats, andpats, notpats,
 
             taglist.append(tags)
 
-            for imgfile in parts[1].strip().split():
+            for imgfile in imgfiles:
                 filepath = os.path.join(d, imgfile)
                 if not os.path.exists(filepath):
                     continue    # Don't match files that no longer exist
@@ -180,8 +196,506 @@ def has_match(tags, orpats, andpats, notpats, ignorecase):
             return True
     return False
 
+
+class TagIndex:
+    """An inverted index over all Tags files under a set of directories:
+       maps each individual tag, and each directory name (which,
+       as in search_for_keywords, also counts as a tag), to the set
+       of files carrying it. Queries then become set operations.
+       Patterns are matched against trigram indices of the distinct
+       tags and directories, rather than by scanning all of them.
+       If maxdist is nonzero, patterns match approximately:
+       anything within that many typos (edit distance) of the pattern.
+    """
+
+    def __init__(self, ignorecase=True, maxdist=0):
+        self.ignorecase = ignorecase
+        self.maxdist = maxdist
+
+        # { tag: set of filepaths }
+        self.tags = defaultdict(set)
+
+        # { directory: set of filepaths }
+        self.dirs = defaultdict(set)
+
+        # Every tagged file that exists on disk
+        self.allfiles = set()
+
+        # Trigram indices of the keys of self.tags and self.dirs
+        self.tag_trigrams = TrigramIndex(ignorecase=ignorecase)
+        self.dir_trigrams = TrigramIndex(ignorecase=ignorecase)
+
+    @classmethod
+    def build(cls, grepdirs, ignorecase=True, maxdist=0):
+        """Walk the grepdirs (which may be shell-style patterns,
+           as in search_for_keywords) and index every Tags file found.
+        """
+        index = cls(ignorecase, maxdist)
+        for pat in grepdirs:
+            for d in glob.glob(os.path.expanduser(pat)):
+                for root, dirs, files in os.walk(d):
+                    if not files:
+                        continue
+                    for tagfilename in TAG_FILE_NAMES:
+                        try:
+                            index.add_tag_file(root,
+                                               os.path.join(root, tagfilename))
+                            # If Tags was there, don't look in Keywords.
+                            break
+                        except FileNotFoundError:
+                            pass
+        return index
+
+    def add_tag_file(self, d, f):
+        """Add the tag lines in f, a Tags file in directory d, to the index.
+           May raise FileNotFoundError.
+        """
+        if d.startswith('./'):
+            d = d[2:]
+        if DEBUG:
+            print("Indexing tag file", f)
+
+        with tags_lock(os.path.dirname(f)), open(f) as fp:
+            for tagstr, imgfiles in parse_tag_lines(fp):
+                if self.ignorecase:
+                    tagstr = tagstr.lower()
+                filepaths = set()
+                for imgfile in imgfiles:
+                    filepath = os.path.normpath(os.path.join(d, imgfile))
+                    if os.path.exists(filepath):
+                        filepaths.add(filepath)
+                if not filepaths:
+                    continue
+                for tag in tagstr.split(','):
+                    tag = tag.strip()
+                    if tag:
+                        self.tags[tag] |= filepaths
+                        self.tag_trigrams.add(tag)
+                d = os.path.normpath(d)
+                self.dirs[d] |= filepaths
+                self.dir_trigrams.add(d)
+                self.allfiles |= filepaths
+
+    def compile(self, pat):
+        """Compile a search pattern as a regexp, honoring ignorecase.
+           Patterns that aren't valid regexps are searched for literally.
+        """
+        flags = re.IGNORECASE if self.ignorecase else 0
+        try:
+            return re.compile(pat, flags)
+        except re.error:
+            return re.compile(re.escape(pat), flags)
+
+    def match(self, trigram_index, pat):
+        if self.maxdist:
+            return trigram_index.fuzzy_search(pat, self.maxdist)
+        return trigram_index.regex_search(self.compile(pat))
+
+    def tags_matching(self, pat):
+        """Return a list of indexed tags that match the pattern."""
+        return self.match(self.tag_trigrams, pat)
+
+    def dirs_matching(self, pat):
+        """Return a list of indexed directories that match the pattern."""
+        return self.match(self.dir_trigrams, pat)
+
+    def dirs_globbing(self, pat):
+        """Return a list of indexed directories where either the whole
+           path or any one component matches the shell-style pattern.
+        """
+        matches = []
+        for d in self.dirs:
+            if fnmatch.fnmatch(d, pat) or \
+               any(fnmatch.fnmatch(part, pat) for part in d.split(os.sep)):
+                matches.append(d)
+        return matches
+
+
+#
+# Boolean query expressions, e.g.
+#   (sunset or dawn) and not blurry and dir:2023*
+# Each node evaluates to a set of files from a TagIndex.
+#
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+class Query:
+    """Base class for nodes in a parsed query.
+       Subclasses implement find_files(index) and plan(index, indent);
+       evaluate() remembers the result, since a node may be asked
+       for its size while planning and again while evaluating.
+       They also implement sql(), which returns (condition, params),
+       an SQL condition on a tag store's images table using the
+       functions from register_sql_functions().
+    """
+
+    def evaluate(self, index):
+        """Return the set of files in index matching this query."""
+        try:
+            return self.files
+        except AttributeError:
+            self.files = self.find_files(index)
+            return self.files
+
+    def estimate(self, index):
+        return len(self.evaluate(index))
+
+
+class TermQuery(Query):
+    """Files with a tag, or in a directory, matching a pattern."""
+
+    def __init__(self, pat):
+        self.pat = pat
+
+    def __repr__(self):
+        return "'%s'" % self.pat
+
+    def matched_keys(self, index):
+        """Return the tags and directories that this term matches."""
+        return index.tags_matching(self.pat), index.dirs_matching(self.pat)
+
+    def find_files(self, index):
+        tags, dirs = self.matched_keys(index)
+        files = set()
+        for tag in tags:
+            files |= index.tags[tag]
+        for d in dirs:
+            files |= index.dirs[d]
+        return files
+
+    def plan(self, index, indent=''):
+        tags, dirs = self.matched_keys(index)
+        lines = [ "%sTERM %s: %d tags, %d dirs -> %d files"
+                  % (indent, self, len(tags), len(dirs),
+                     self.estimate(index)) ]
+        if tags:
+            lines.append("%s    tags: %s" % (indent, ', '.join(sorted(tags))))
+        return lines
+
+    def sql(self):
+        return ('(images.id IN (SELECT image_id FROM image_tags '
+                'WHERE tag_id IN (SELECT id FROM tags WHERE matches(name, ?)))'
+                ' OR images.dir_id IN '
+                '(SELECT id FROM dirs WHERE matches(path, ?)))',
+                [ self.pat, self.pat ])
+
+
+class DirQuery(TermQuery):
+    """Files in a directory matching a shell-style pattern: dir:2023*"""
+
+    def __repr__(self):
+        return "dir:%s" % self.pat
+
+    def matched_keys(self, index):
+        return [], index.dirs_globbing(self.pat)
+
+    def sql(self):
+        return ('images.dir_id IN (SELECT id FROM dirs WHERE dirglob(path, ?))',
+                [ self.pat ])
+
+
+class NotQuery(Query):
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return "NOT %s" % self.child
+
+    def find_files(self, index):
+        return index.allfiles - self.child.evaluate(index)
+
+    def plan(self, index, indent=''):
+        return [ "%sNOT (all %d files minus:) -> %d files"
+                 % (indent, len(index.allfiles), self.estimate(index)) ] \
+            + self.child.plan(index, indent + '    ')
+
+    def sql(self):
+        where, params = self.child.sql()
+        return 'NOT ' + where, params
+
+
+class OrQuery(Query):
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return '(' + ' OR '.join(map(repr, self.children)) + ')'
+
+    def find_files(self, index):
+        files = set()
+        for child in self.children:
+            files |= child.evaluate(index)
+        return files
+
+    def plan(self, index, indent=''):
+        lines = [ "%sOR (union) -> %d files" % (indent, self.estimate(index)) ]
+        for child in self.children:
+            lines += child.plan(index, indent + '    ')
+        return lines
+
+    def sql(self):
+        return join_sql(' OR ', self.children)
+
+
+class AndQuery(Query):
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return '(' + ' AND '.join(map(repr, self.children)) + ')'
+
+    def ordered_children(self, index):
+        """Split children into positive terms, smallest first so the
+           running intersection shrinks as fast as possible,
+           and negated terms, which are subtracted at the end
+           rather than complemented against every file.
+        """
+        positives = [ c for c in self.children if not isinstance(c, NotQuery) ]
+        negatives = [ c.child for c in self.children
+                      if isinstance(c, NotQuery) ]
+        positives.sort(key=lambda c: c.estimate(index))
+        return positives, negatives
+
+    def find_files(self, index):
+        positives, negatives = self.ordered_children(index)
+        if positives:
+            files = set(positives[0].evaluate(index))
+            for child in positives[1:]:
+                if not files:
+                    return files
+                files &= child.evaluate(index)
+        else:
+            files = set(index.allfiles)
+        for child in negatives:
+            if not files:
+                break
+            files -= child.evaluate(index)
+        return files
+
+    def plan(self, index, indent=''):
+        positives, negatives = self.ordered_children(index)
+        lines = [ "%sAND (intersect smallest first, then subtract) -> %d files"
+                  % (indent, self.estimate(index)) ]
+        if not positives:
+            lines.append("%s    ALL %d files" % (indent, len(index.allfiles)))
+        for child in positives:
+            lines += child.plan(index, indent + '    ')
+        for child in negatives:
+            lines.append("%s    MINUS:" % indent)
+            lines += child.plan(index, indent + '        ')
+        return lines
+
+    def sql(self):
+        # SQLite's planner decides the order
+        return join_sql(' AND ', self.children)
+
+
+def join_sql(op, children):
+    """Combine the sql() of several query nodes with AND or OR."""
+    wheres = []
+    params = []
+    for child in children:
+        where, childparams = child.sql()
+        wheres.append(where)
+        params += childparams
+    return '(' + op.join(wheres) + ')', params
+
+
+def patterns_query(orpats, andpats, notpats):
+    """Turn the classic +/- pattern lists into a query:
+       orpats are regular expressions, the others plain strings.
+    """
+    children = []
+    if orpats:
+        children.append(OrQuery([ TermQuery(pat) for pat in orpats ]))
+    children += [ TermQuery(re.escape(pat)) for pat in andpats ]
+    children += [ NotQuery(TermQuery(re.escape(pat))) for pat in notpats ]
+    return AndQuery(children)
+
+
+# Tokens: parentheses, quoted phrases, or runs of anything else
+TOKEN_RE = re.compile(r'''\s*(?:(\()|(\))|"([^"]*)"|'([^']*)'|([^\s()]+))''')
+
+
+def tokenize_query(expr):
+    """Split a query expression into a list of tokens.
+       Operators are returned as 'and', 'or', 'not', '(' or ')';
+       everything else as ('term', string).
+    """
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise QuerySyntaxError("Can't parse query at: " + expr[pos:])
+        pos = m.end()
+        lparen, rparen, dquoted, squoted, word = m.groups()
+        if lparen:
+            tokens.append('(')
+        elif rparen:
+            tokens.append(')')
+        elif dquoted is not None:
+            tokens.append(('term', dquoted))
+        elif squoted is not None:
+            tokens.append(('term', squoted))
+        elif word.lower() in ('and', 'or', 'not'):
+            tokens.append(word.lower())
+        else:
+            tokens.append(('term', word))
+    return tokens
+
+
+def parse_query(expr):
+    """Parse a boolean query expression into a tree of query nodes.
+       Grammar, from lowest to highest precedence:
+           expr    := andexpr ( 'or' andexpr )*
+           andexpr := notexpr ( ['and'] notexpr )*
+           notexpr := 'not' notexpr | '(' expr ')' | term
+       Adjacent terms with no operator between them are ANDed.
+       A term like dir:2023* matches directory names with a shell pattern;
+       any other term is a pattern matched against tags and directory names.
+       Raises QuerySyntaxError.
+    """
+    tokens = tokenize_query(expr)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def parse_or():
+        nonlocal pos
+        children = [ parse_and() ]
+        while peek() == 'or':
+            pos += 1
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else OrQuery(children)
+
+    def parse_and():
+        nonlocal pos
+        children = [ parse_not() ]
+        while True:
+            tok = peek()
+            if tok == 'and':
+                pos += 1
+            elif tok is None or tok in ('or', ')'):
+                break
+            children.append(parse_not())
+        return children[0] if len(children) == 1 else AndQuery(children)
+
+    def parse_not():
+        nonlocal pos
+        tok = peek()
+        if tok is None:
+            raise QuerySyntaxError("Query ended unexpectedly: " + expr)
+        pos += 1
+        if tok == 'not':
+            return NotQuery(parse_not())
+        if tok == '(':
+            node = parse_or()
+            if peek() != ')':
+                raise QuerySyntaxError("Missing ) in query: " + expr)
+            pos += 1
+            return node
+        if type(tok) is tuple:
+            term = tok[1]
+            if term.startswith('dir:'):
+                return DirQuery(term[4:])
+            return TermQuery(term)
+        raise QuerySyntaxError("Unexpected '%s' in query: %s" % (tok, expr))
+
+    if not tokens:
+        raise QuerySyntaxError("Empty query")
+    tree = parse_or()
+    if pos < len(tokens):
+        raise QuerySyntaxError("Unexpected '%s' in query: %s"
+                               % (tokens[pos], expr))
+    return tree
+
+
+def search_expression(grepdirs, expr, ignorecase=True, showplan=False,
+                      maxdist=0, tagstore=None):
+    """Return a sorted list of files under grepdirs matching the
+       boolean query expression expr.
+       If showplan is true, print the parsed query and its plan first.
+       If maxdist is nonzero, terms match tags within that edit distance.
+       If tagstore is a tag store file, search that instead of Tags files.
+    """
+    query = parse_query(expr)
+    if tagstore:
+        return search_tagstore(tagstore, grepdirs, query, ignorecase,
+                               showplan, maxdist)
+    index = TagIndex.build(grepdirs, ignorecase, maxdist)
+    if showplan:
+        print("Query:", query)
+        print("Index: %d tags, %d directories, %d files"
+              % (len(index.tags), len(index.dirs), len(index.allfiles)))
+        print('\n'.join(query.plan(index)))
+        print()
+    return sorted(query.evaluate(index))
+
+
+def register_sql_functions(db, ignorecase=True, maxdist=0):
+    """Define the SQL functions Query.sql() uses, matching the way
+       a TagIndex matches: matches(string, pattern) for tags and
+       directories, and dirglob(path, pattern) for dir: terms.
+    """
+    index = TagIndex(ignorecase, maxdist)
+    compiled = {}
+
+    def matches(s, pat):
+        if maxdist:
+            key = index.tag_trigrams.key
+            return substring_edit_distance(key(pat), key(s),
+                                           maxdist) <= maxdist
+        if pat not in compiled:
+            compiled[pat] = index.compile(pat)
+        return compiled[pat].search(s) is not None
+
+    def dirglob(path, pat):
+        return fnmatch.fnmatch(path, pat) or \
+            any(fnmatch.fnmatch(part, pat) for part in path.split(os.sep))
+
+    db.create_function('matches', 2, matches, deterministic=True)
+    db.create_function('dirglob', 2, dirglob, deterministic=True)
+
+
+def search_tagstore(dbfile, grepdirs, query, ignorecase=True, showplan=False,
+                    maxdist=0):
+    """Return a sorted list of files under grepdirs matching query
+       (from parse_query() or patterns_query()), using one SQL query
+       on the tag store in dbfile rather than reading Tags files.
+       Paths are absolute.
+    """
+    from metapho.tagstore import TagStore
+
+    roots = [ d for pat in grepdirs
+              for d in glob.glob(os.path.expanduser(pat)) ]
+    if not roots:
+        return []
+
+    store = TagStore(dbfile)
+    register_sql_functions(store.db, ignorecase, maxdist)
+    where, params = query.sql()
+    if showplan:
+        sql, allparams = store.search_sql(where, params, roots)
+        print("Query:", query)
+        print(sql)
+        for row in store.db.execute('EXPLAIN QUERY PLAN ' + sql, allparams):
+            print("   ", row[-1])
+        print()
+    files = store.search(where, params, roots)
+    store.close()
+
+    # As with Tags files, files that don't exist on disk never match
+    return sorted(f for f in files if os.path.exists(f))
+
+
 def Usage():
     print('''Usage: %s [-s] [-d dirs] condition [condition ...]
+       %s [-d dirs] [-P] -e 'expression'
 
 Search for files matching patterns in Tags or Keywords files.
 Will search recursively under the current directory unless -d is specified.
@@ -191,17 +705,31 @@ Conditions can include three types of patterns:
   2. Starts with -: must NOT be present (NOT).
   3. Starts with neither: one of these must be present (OR).
 
+Or use -e with a boolean expression using and, or, not and parentheses:
+  fotogr -e '(sunset or dawn) and not blurry and dir:2023*'
+Terms next to each other with no operator are ANDed.
+Put phrases containing spaces in quotes.
+dir:PATTERN matches directory names with a shell-style pattern;
+other terms match tags or directory names.
+
 Optional arguments:
   -i              ignore case (this is the default)
   +i              don't ignore case (case is ignored by default)
   -t              taglines: print out the tag lines that match, not just
                   the filenames, in case you need to narrow the search
+  -e expression   search for a boolean expression (see above)
+  -P              with -e, print the query plan before the results
+  -k N            with -e, match terms approximately, allowing up to
+                  N typos (edit distance), e.g. sqirrel matches squirrel
   -D              show verbose output for debugging
   -d dir,dir,dir  comma-separated list of directories to use (else .)
                   Each dir may be a shell-style pattern, e.g. 19??,20??
+  -S tagstore     search an SQLite tag store (see metapho-tagstore)
+                  instead of Tags files; results are absolute paths
 
 Copyright 2009-2022 by Akkana Peck.
-Share and enjoy under the GPL v2 or later.''' % os.path.basename(sys.argv[0]))
+Share and enjoy under the GPL v2 or later.'''
+          % (os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0])))
     sys.exit(0)
 
 
@@ -212,7 +740,7 @@ def parse_args(args):
         Usage()
 
     # Loop over flag args, which must come before pattern args.
-    while True:
+    while args:
         if args[0] == '-i':
             ret["ignorecase"] = True
             args = args[1:]
@@ -222,6 +750,24 @@ def parse_args(args):
         elif args[0] == '-t':
             ret["taglines"] = True
             args = args[1:]
+        elif args[0] == '-P':
+            ret["showplan"] = True
+            args = args[1:]
+        elif args[0] == '-k':
+            if len(args) == 1 or not args[1].isdigit():
+                Usage()
+            ret["maxdist"] = int(args[1])
+            args = args[2:]
+        elif args[0] == '-e':
+            if len(args) == 1:
+                Usage()
+            ret["expr"] = args[1]
+            args = args[2:]
+        elif args[0] == '-S':
+            if len(args) == 1:
+                Usage()
+            ret["tagstore"] = args[1]
+            args = args[2:]
         elif args[0] == '-D':
             global DEBUG
             DEBUG = True
@@ -249,6 +795,20 @@ def parse_args(args):
         ret["ignorecase"] = True
     if "taglines" not in ret:
         ret["taglines"] = False
+    if "showplan" not in ret:
+        ret["showplan"] = False
+    if "maxdist" not in ret:
+        ret["maxdist"] = 0
+    if "tagstore" not in ret:
+        ret["tagstore"] = None
+
+    if "expr" in ret:
+        # An expression can also be given as several words, unquoted.
+        if args:
+            ret["expr"] = ' '.join([ret["expr"]] + args)
+        return ret
+    if not args:
+        Usage()
 
     ret['orpats'], ret['andpats'], ret['notpats'] = parse_pattern_args(args)
 
@@ -275,6 +835,31 @@ def main():
 
     args = parse_args(sys.argv[1:])
 
+    if "expr" in args:
+        try:
+            r = search_expression(args["dirlist"], args["expr"],
+                                  args["ignorecase"], args["showplan"],
+                                  args["maxdist"], args["tagstore"])
+        except (QuerySyntaxError, ValueError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print(' '.join(r))
+        return
+
+    if args["tagstore"]:
+        if args["taglines"]:
+            print("-t doesn't work with -S", file=sys.stderr)
+        query = patterns_query(args["orpats"], args["andpats"],
+                               args["notpats"])
+        try:
+            r = search_tagstore(args["tagstore"], args["dirlist"], query,
+                                args["ignorecase"], args["showplan"])
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print(' '.join(r))
+        return
+
     r = search_for_keywords(args["dirlist"],
                             args["orpats"], args["andpats"], args["notpats"],
                             args["ignorecase"], args["taglines"])
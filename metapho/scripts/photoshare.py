@@ -12,14 +12,21 @@
 # Copyright 2024 by Akkana Peck: share and enjoy under the GPLv2 or later.
 
 
+from collections import defaultdict
 from datetime import date
+import heapq
 import os, sys
 
 from . import fotogr
+from metapho import metacache
+from metapho.metacache import MetadataCache, taken_or_mtime
 
 
 SHAREFILE = os.path.expanduser('~/Docs/Lists/sharephotos')
 
+# Dates taken for "suggest" come from metapho's shared metadata cache
+METADATA_CACHE = metacache.CACHEFILE
+
 
 def read_in_sharefile():
     sharedfiles = []
@@ -45,21 +52,32 @@ def add_to_sharefile(imglist):
         print("Added to the sharefile", SHAREFILE)
 
 
-def search_in_sharefile(imgname, sharedfiles):
-    """The sharefile can have directory fragments, like lassen/img.jpg
-       so search for anything that includes namefrag.
-       Return the most recent date it was shared, or None if not found.
+def index_sharefile(sharedfiles):
+    """Given the list of (datestr, filelist) from read_in_sharefile(),
+       return a dictionary mapping the basename of every shared file
+       to the most recent date it was shared.
+       The sharefile can have directory fragments, like lassen/img.jpg,
+       so index only the basename.
     """
-    namefrag = os.path.basename(imgname)
-    most_recent_date = None
+    shareindex = {}
     for datestr, filelist in sharedfiles:
         for f in filelist:
-            if namefrag in f:
-                most_recent_date = datestr
-                # print(imgname, "was shared on", datestr,
-                #       "because", namefrag, "is in", f)
-
-    return most_recent_date
+            namefrag = os.path.basename(f)
+            # Dates are YYYY-MM-DD, so they sort as strings.
+            if namefrag not in shareindex or datestr > shareindex[namefrag]:
+                shareindex[namefrag] = datestr
+    return shareindex
+
+
+def search_in_sharefile(imgname, shareindex):
+    """Return the most recent date imgname was shared, or None if not found.
+       shareindex is the dictionary from index_sharefile(),
+       though the list from read_in_sharefile() also works
+       (but has to be indexed on every call).
+    """
+    if type(shareindex) is list:
+        shareindex = index_sharefile(shareindex)
+    return shareindex.get(os.path.basename(imgname))
 
 
 def find_unshared_images(dirlist, keywords=[]):
@@ -68,6 +86,15 @@ def find_unshared_images(dirlist, keywords=[]):
        If keywords is set, look for those instead.
        keywords use the + and - syntax used by fotogr.
     """
+    shared, unshared = find_tagged_image_times(dirlist, keywords)
+    return unshared
+
+
+def find_tagged_image_times(dirlist, keywords=[]):
+    """Find images tagged with 'share' or 'wallpaper',
+       or with keywords if set, and return shared and unshared
+       lists as in find_shared_image_times().
+    """
     if keywords:
         orpats, andpats, notpats = fotogr.parse_pattern_args(keywords)
     else:
@@ -79,8 +106,7 @@ def find_unshared_images(dirlist, keywords=[]):
     images_to_check = fotogr.search_for_keywords(dirlist,
                                                  orpats, andpats, notpats,
                                                  True, False)
-    shared, unshared = find_shared_image_times(list(images_to_check))
-    return unshared
+    return find_shared_image_times(list(images_to_check))
 
 
 def find_shared_image_times(images_to_check):
@@ -91,11 +117,12 @@ def find_shared_image_times(images_to_check):
     shared = []
     unshared = []
 
-    # Read in the sharefile
-    sharedfiles = read_in_sharefile()
+    # Read in the sharefile, and index it so each lookup is a
+    # dictionary access rather than a scan of the whole share history.
+    shareindex = index_sharefile(read_in_sharefile())
 
     for img in images_to_check:
-        datestr = search_in_sharefile(img, sharedfiles)
+        datestr = search_in_sharefile(img, shareindex)
         if datestr:
             shared.append((datestr, img))
         else:
@@ -110,6 +137,70 @@ def find_shared_image_times(images_to_check):
     return shared, unshared
 
 
+def update_metadata_cache(images, cache):
+    """Make sure every image in images has current metadata in cache,
+       a MetadataCache, reading only images that are new or changed.
+       Returns a dictionary { image: metadata } for the images that
+       exist, and the number of images whose metadata had to be read.
+    """
+    paths = { img: os.path.abspath(img) for img in images }
+    bypath, nread = cache.populate(set(paths.values()))
+    return { img: bypath[path] for img, path in paths.items()
+             if path in bypath }, nread
+
+
+def rank_candidates(images, metadata, num, order="taken"):
+    """Return up to num images, chosen from images (which must all
+       have entries in the metadata dictionary returned by
+       update_metadata_cache), in the order they should be shared:
+         taken: oldest taken first
+         dirs:  round-robin across directories, taking the oldest
+                remaining image from each directory in turn.
+       Only the top num images in each ranking are ever sorted.
+    """
+    def taken(img):
+        return taken_or_mtime(metadata[img])
+
+    if order == "taken":
+        return heapq.nsmallest(num, images, key=taken)
+
+    if order != "dirs":
+        raise ValueError("Unknown order: " + order)
+
+    bydir = defaultdict(list)
+    for img in images:
+        bydir[os.path.dirname(os.path.abspath(img))].append(img)
+
+    # No directory can contribute more than num images.
+    queues = [ heapq.nsmallest(num, imgs, key=taken)
+               for imgs in bydir.values() ]
+    # Start with the directory that has the oldest image.
+    queues.sort(key=lambda q: taken(q[0]))
+
+    ranked = []
+    for i in range(num):
+        for q in queues:
+            if i < len(q):
+                ranked.append(q[i])
+                if len(ranked) >= num:
+                    return ranked
+    return ranked
+
+
+def suggest_images(dirlist, num, keywords=[], order="taken"):
+    """Suggest up to num unshared images, in order to be shared,
+       using (and updating) the metadata cache.
+    """
+    shared, unshared = find_tagged_image_times(dirlist, keywords)
+
+    cache = MetadataCache(METADATA_CACHE)
+    metadata, nread = update_metadata_cache(unshared, cache)
+    cache.close()
+    unshared = [ img for img in unshared if img in metadata ]
+
+    return rank_candidates(unshared, metadata, num, order)
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="",
@@ -126,20 +217,30 @@ def main():
 
 %(prog)s add img2.jpg img.jpg ...
     Add the specified images to the share list with today's date
+
+%(prog)s suggest [N] [keyword keyword keyword]
+    Suggest N (default 10) unshared photos to share next,
+    oldest first (or see --order)
 """)
     parser.add_argument('-d', action="store", dest="dirlist",
                         help='Directories to search, comma-separated')
     parser.add_argument('-q', dest="quiet", action="store_true", default=False,
                         help='Quiet: print only the list of images, nothing else')
+    parser.add_argument('--order', action="store", dest="order",
+                        default="taken", choices=["taken", "dirs"],
+                        help="""Order for suggest: taken (oldest first, default)
+or dirs (round-robin across directories)""")
     args, rest = parser.parse_known_args(sys.argv)
 
-    if not args.dirlist:
+    if args.dirlist:
+        args.dirlist = args.dirlist.split(',')
+    else:
         args.dirlist = [ '.' ]
 
     # rest starts with the program name. Don't need that.
     rest = rest[1:]
 
-    if rest and rest[0] in ['search', 'check', 'add']:
+    if rest and rest[0] in ['search', 'check', 'add', 'suggest']:
         cmd = rest[0]
         rest = rest[1:]
     else:
@@ -151,6 +252,15 @@ def main():
         print(' '.join(unshared))
         sys.exit(0)
 
+    if cmd == 'suggest':
+        num = 10
+        if rest and rest[0].isdigit():
+            num = int(rest[0])
+            rest = rest[1:]
+        suggestions = suggest_images(args.dirlist, num, rest, args.order)
+        print(' '.join(suggestions))
+        sys.exit(0)
+
     if cmd == 'check':
         # check status of specified images
         shared, unshared = find_shared_image_times(rest)
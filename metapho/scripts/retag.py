@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Rename, merge or split tags in every Tags file under a directory tree,
+without running metapho:
+
+    metapho-retag [-n] [-j JOBS] --rename Sqirrel=squirrel ~/Photos
+    metapho-retag --merge "pup,puppy=dog" --split "sunrise=dawn,sun" dir ...
+
+Each Tags file is read and written by a Tagger of its own, so
+directories are processed in parallel in a process pool.
+Only Tags files where a rule changed something are rewritten,
+each one atomically, keeping the old one as Tags.bak.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import argparse
+import sys, os
+
+from metapho import imagelist
+from metapho.tagger import Tagger, DEFAULT_CAT
+
+
+TAG_FILE_NAMES = ("Tags", "Keywords")
+
+
+def parse_rule(rule, kind):
+    """Parse a rule like "old=new" for kind rename, "old1,old2=new"
+       for merge or "old=new1,new2" for split, into
+       (old tag names, new tag names). Raises ValueError if it
+       doesn't fit the kind.
+    """
+    olds, equals, news = rule.partition('=')
+    olds = [ t.strip() for t in olds.split(',') if t.strip() ]
+    news = [ t.strip() for t in news.split(',') if t.strip() ]
+    if not equals or not olds or not news:
+        raise ValueError("%s rule %s should look like %s" %
+                         (kind, rule, { 'rename': "old=new",
+                                        'merge': "old1,old2=new",
+                                        'split': "old=new1,new2" }[kind]))
+    if kind != 'merge' and len(olds) > 1:
+        raise ValueError("Only --merge can have several old tags: %s" % rule)
+    if kind != 'split' and len(news) > 1:
+        raise ValueError("Only --split can have several new tags: %s" % rule)
+    return olds, news
+
+
+def find_tag_dirs(roots):
+    """The directories under roots that have a Tags or Keywords file,
+       skipping the directories metapho ignores.
+    """
+    tagdirs = []
+    for root in roots:
+        for dirpath, dirs, files in os.walk(root):
+            dirs[:] = sorted(d for d in dirs
+                             if not Tagger.ignore_directory(d, dirpath))
+            if any(name in files for name in TAG_FILE_NAMES):
+                tagdirs.append(dirpath)
+    return tagdirs
+
+
+def tag_category(tagger, tagname):
+    """The first category tagname is in, or None."""
+    tagno = tagger.tagname_to_tagno(tagname)
+    for cat in tagger.categories:
+        if tagno in tagger.categories[cat]:
+            return cat
+    return None
+
+
+def apply_rules(tagger, rules):
+    """Apply rules, [ (old tag names, new tag names) ], to the images
+       in the imagelist: every image with any of the old tags gets all
+       of the new ones instead. New tags that don't exist yet go in the
+       old tag's category, and a tag that's just renamed keeps its place
+       there. Returns [ number of images changed ] for each rule.
+    """
+    counts = []
+    for olds, news in rules:
+        oldnos = [ tagger.tagname_to_tagno(old) for old in olds
+                   if old in tagger.tag_list ]
+        images = [ img for img in imagelist.image_list()
+                   if any(tagno in img.tags for tagno in oldnos) ]
+        counts.append(len(images))
+        if not images:
+            continue
+
+        if len(oldnos) == 1 and len(news) == 1 \
+           and news[0] not in tagger.tag_list:
+            tagger.tag_list[oldnos[0]] = news[0]
+            tagger.mark_changed(tagnos=oldnos)
+            continue
+
+        category = tag_category(tagger, olds[0])
+        for tagno in oldnos:
+            tagger.untag_images(tagno, images)
+            tagger.delete_tag(tagno)
+        for new in news:
+            tagger.tag_images(new, images,
+                              tag_category(tagger, new) or category)
+    return counts
+
+
+def retag_dir(dirname, rules, dry_run=False):
+    """Apply rules to the Tags file in dirname, rewriting it if that
+       changed anything, unless dry_run is set.
+       Returns (Tags file, whether it changed, counts from apply_rules()).
+    """
+    imagelist.clear_images()
+    tagger = Tagger()
+    tagger.read_tags(dirname, recursive=False)
+    tagfile = os.path.abspath(tagger.tagfiles[0])
+
+    # Drop the empty default category read_tags() starts with,
+    # as read_all_tags_for_images() does
+    if len(tagger.categories) > 1 and DEFAULT_CAT in tagger.categories \
+       and not tagger.categories[DEFAULT_CAT]:
+        del tagger.categories[DEFAULT_CAT]
+
+    # Only changes made by the rules count, not reformatting
+    tagger.mark_tags_saved()
+    counts = apply_rules(tagger, rules)
+    if not any(counts):
+        return tagfile, False, counts
+
+    changed = any(tagger.saved_tagfiles.get(f) != contents
+                  for f, (contents, filenames)
+                  in tagger.tagfile_contents(changed_only=True).items())
+    if changed and not dry_run:
+        tagger.save_tagfiles(fingerprints=False)
+    return tagfile, changed, counts
+
+
+def _retag_dir_args(args):
+    return retag_dir(*args)
+
+
+def retag(roots, rules, dry_run=False, jobs=None):
+    """Apply rules to every Tags file under roots, jobs directories
+       at a time (default: one per CPU).
+       Returns [ (Tags file, whether it changed, counts) ].
+    """
+    tagdirs = find_tag_dirs(roots)
+    args = [ (d, rules, dry_run) for d in tagdirs ]
+    if len(tagdirs) > 1 and jobs != 1:
+        # Each directory needs its own imagelist, so use processes,
+        # and don't fork in case the caller has threads running.
+        with ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context('spawn')) as pool:
+            return list(pool.map(_retag_dir_args, args, chunksize=4))
+    return [ retag_dir(*a) for a in args ]
+
+
+def print_summary(results, rules, dry_run):
+    for tagfile, changed, counts in results:
+        if not changed:
+            continue
+        print("%s:" % tagfile)
+        for (olds, news), count in zip(rules, counts):
+            if count:
+                print("  %s -> %s: %d images" % (', '.join(olds),
+                                                 ', '.join(news), count))
+
+    nchanged = sum(1 for tagfile, changed, counts in results if changed)
+    print("%s %d of %d Tags files" % ("Would rewrite" if dry_run
+                                      else "Rewrote",
+                                      nchanged, len(results)))
+    for i, (olds, news) in enumerate(rules):
+        total = sum(counts[i] for tagfile, changed, counts in results
+                    if changed)
+        print("%s -> %s: %d images" % (', '.join(olds), ', '.join(news),
+                                       total))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rename, merge or split tags in all the Tags files "
+                    "under some directories")
+    parser.add_argument('--rename', action='append', default=[],
+                        metavar='OLD=NEW', help="Rename a tag")
+    parser.add_argument('--merge', action='append', default=[],
+                        metavar='OLD1,OLD2=NEW',
+                        help="Replace several tags with one")
+    parser.add_argument('--split', action='append', default=[],
+                        metavar='OLD=NEW1,NEW2',
+                        help="Replace a tag with several")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="Show what would change, but don't change it")
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="How many directories to do at once "
+                             "(default: one per CPU)")
+    parser.add_argument('dirs', nargs='*', default=['.'],
+                        help="Directories to look for Tags files under "
+                             "(default .)")
+    args = parser.parse_args()
+
+    # Rules are applied in the order given on the command line
+    # within each kind: renames, then merges, then splits.
+    rules = []
+    try:
+        for kind in ('rename', 'merge', 'split'):
+            for rule in getattr(args, kind):
+                rules.append(parse_rule(rule, kind))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if not rules:
+        parser.print_usage(sys.stderr)
+        print("Nothing to do: give at least one --rename, --merge or --split",
+              file=sys.stderr)
+        sys.exit(1)
+
+    results = retag(args.dirs, rules, dry_run=args.dry_run, jobs=args.jobs)
+    print_summary(results, rules, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Suggest tags for an image: rank the tags it doesn't have yet by how
+likely it is to want them, from the tags on the images shown just
+before and after it (usually taken around the same time), the tags
+that usually go with the ones it already has, and the tags most used
+in its directory.
+
+The counts behind that are kept up to date as tags change, one image
+at a time, and each tag's and directory's best few candidates are
+cached until their counts change, so ranking the tags for one image
+only looks at a few candidates per tag it has.
+"""
+
+import collections
+import heapq
+import os
+from operator import itemgetter
+
+
+# How many images on each side count as neighbors
+NEIGHBORS = 3
+
+# How many of the tags that go with each tag, or that are used in
+# each directory, to keep as candidates
+CANDIDATES = 10
+
+# How much each kind of evidence counts
+NEIGHBOR_WEIGHT = 1.
+COOCCUR_WEIGHT = 1.
+DIR_WEIGHT = .5
+
+
+def neighbors(images, index, count=NEIGHBORS):
+    """The displayed images within count places of images[index]
+       on either side, as [ (distance, image) ], nearest first.
+    """
+    found = []
+    for step in (-1, 1):
+        distance = 0
+        i = index + step
+        while 0 <= i < len(images) and distance < count:
+            if images[i].displayed:
+                distance += 1
+                found.append((distance, images[i]))
+            i += step
+    found.sort(key=itemgetter(0))
+    return found
+
+
+class TagSuggester:
+    """Keeps tag counts for a set of images, to suggest tags for them.
+       Call update() with images whose tags have changed.
+    """
+
+    def __init__(self, images=()):
+        # How many images have each tag number
+        self.tag_counts = collections.Counter()
+
+        # { tagno: Counter({ other tagno: images with both }) }
+        self.cooccur = collections.defaultdict(collections.Counter)
+
+        # { directory: Counter({ tagno: images there with it }) },
+        # and how many tagged images each directory has
+        self.dir_counts = collections.defaultdict(collections.Counter)
+        self.dir_images = collections.Counter()
+
+        # The tags each image had when it was last counted,
+        # { filename: frozenset of tag numbers }
+        self.counted = {}
+
+        # Tag numbers of deleted tags, which images may still have
+        # but which aren't counted or suggested
+        self.deleted = set()
+
+        # Cached candidates, [ (tagno, probability) ], by tag and by
+        # directory, dropped when the counts they came from change
+        self._tag_candidates = {}
+        self._dir_candidates = {}
+
+        self.update(images)
+
+    def update(self, images):
+        """Recount the tags on images that have changed since they
+           were last counted.
+        """
+        for img in images:
+            self._recount(img.filename, frozenset(img.tags) - self.deleted)
+
+    def delete_tag(self, tagno):
+        """Stop counting and suggesting tag number tagno,
+           which has been deleted.
+        """
+        self.deleted.add(tagno)
+        for filename, tags in list(self.counted.items()):
+            if tagno in tags:
+                self._recount(filename, tags - { tagno })
+
+    def _recount(self, filename, new):
+        """Count the image filename as having the tags in new
+           instead of whatever it was last counted with.
+        """
+        old = self.counted.get(filename, frozenset())
+        if old == new:
+            return
+        dirname = os.path.dirname(filename)
+        self._count(old, dirname, -1)
+        self._count(new, dirname, 1)
+        if new:
+            self.counted[filename] = new
+        else:
+            self.counted.pop(filename, None)
+
+    def _count(self, tags, dirname, n):
+        """Add n to the counts for one image's tags in dirname."""
+        if not tags:
+            return
+
+        def add(counter, key):
+            counter[key] += n
+            if not counter[key]:
+                del counter[key]
+
+        add(self.dir_images, dirname)
+        for a in tags:
+            add(self.tag_counts, a)
+            add(self.dir_counts[dirname], a)
+            for b in tags:
+                if b != a:
+                    add(self.cooccur[a], b)
+            if not self.cooccur[a]:
+                del self.cooccur[a]
+            self._tag_candidates.pop(a, None)
+        if not self.dir_counts[dirname]:
+            del self.dir_counts[dirname]
+        self._dir_candidates.pop(dirname, None)
+
+    @staticmethod
+    def _candidates(counter, total):
+        return [ (tagno, count / total) for tagno, count
+                 in heapq.nlargest(CANDIDATES, counter.items(),
+                                   key=itemgetter(1)) ]
+
+    def tag_candidates(self, tagno):
+        """The tags most often found with tagno, as
+           [ (tagno, fraction of the images with tagno that have it) ].
+        """
+        if tagno not in self._tag_candidates:
+            self._tag_candidates[tagno] = self._candidates(
+                self.cooccur.get(tagno, {}), self.tag_counts[tagno] or 1)
+        return self._tag_candidates[tagno]
+
+    def dir_candidates(self, dirname):
+        """The tags most used in dirname, as
+           [ (tagno, fraction of the tagged images there that have it) ].
+        """
+        if dirname not in self._dir_candidates:
+            self._dir_candidates[dirname] = self._candidates(
+                self.dir_counts.get(dirname, {}),
+                self.dir_images[dirname] or 1)
+        return self._dir_candidates[dirname]
+
+    def scores(self, img, nearby=(), tags=None):
+        """Score the tags img might want, as { tagno: score }.
+           nearby is [ (distance, image) ] as from neighbors().
+           tags are the tags img has now, default img.tags;
+           they aren't scored.
+        """
+        if tags is None:
+            tags = img.tags
+        tags = set(tags)
+        scores = collections.defaultdict(float)
+
+        # Closer neighbors count for more
+        weights = sum(1. / distance for distance, other in nearby)
+        for distance, other in nearby:
+            for tagno in other.tags:
+                if tagno not in self.deleted:
+                    scores[tagno] += NEIGHBOR_WEIGHT / distance / weights
+
+        for a in tags:
+            for tagno, p in self.tag_candidates(a):
+                scores[tagno] += COOCCUR_WEIGHT * p / len(tags)
+
+        for tagno, p in self.dir_candidates(os.path.dirname(img.filename)):
+            scores[tagno] += DIR_WEIGHT * p
+
+        for tagno in tags:
+            scores.pop(tagno, None)
+        return scores
+
+    def suggest(self, img, nearby=(), tags=None, n=5, within=None):
+        """The n tag numbers img most likely wants, best first.
+           If within is given, only tag numbers in it are suggested.
+           See scores() for the other arguments.
+        """
+        scores = self.scores(img, nearby, tags)
+        if within is not None:
+            within = set(within)
+            scores = { tagno: score for tagno, score in scores.items()
+                       if tagno in within }
+        # Break ties by tag number, so suggestions don't flicker
+        return [ tagno for tagno, score in
+                 heapq.nsmallest(n, scores.items(),
+                                 key=lambda item: (-item[1], item[0])) ]
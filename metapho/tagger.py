@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
 
-import collections    # for OrderedDict
+import collections
+import contextlib
 import shlex
+import json
+import shutil
 from itertools import takewhile
 import re
 import sys, os
 
+try:
+    import fcntl
+except ImportError:
+    # No advisory locking (e.g. on Windows): Tags files are still
+    # replaced atomically, but parallel sessions could clobber each other.
+    fcntl = None
+
 from . import imagelist
 from .metapho import MetaphoImage
+from .trigram import TrigramIndex
+from .taglist import TagList
+from .categories import Categories
+from .fingerprint import FingerprintCache
 
 
 # commonprefix is buggy, doesn't restrict itself to path components, see
@@ -23,6 +37,158 @@ def commonprefix(paths):
 
 DEFAULT_CAT = "Tags"
 
+# Tag changes not yet saved to Tags files are appended to this file,
+# in the common directory, so they survive a crash.
+JOURNAL_NAME = "Tags.journal"
+
+# An image's filename and tags, as copied by Tagger.snapshot()
+SavedImage = collections.namedtuple('SavedImage', [ 'filename', 'tags' ])
+
+
+def write_atomically(path, contents, backup=None):
+    """Write contents to path so that a crash can't leave it half-written:
+       write a temporary file, fsync it and rename it over path.
+       If backup is a filename, the old file is kept there.
+    """
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as fp:
+        fp.write(contents)
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    if backup and os.path.exists(path):
+        try:
+            os.unlink(backup)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(path, backup)
+        except OSError:
+            # Some filesystems can't make hard links
+            shutil.copy2(path, backup)
+
+    os.replace(tmpfile, path)
+
+    # Make sure the rename itself is on disk
+    try:
+        dirfd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+    except OSError:
+        pass
+
+
+def flock(fd, exclusive=False, blocking=True):
+    """Take an advisory lock on an open file descriptor; it's released
+       when the descriptor is closed. Returns False only if blocking
+       is false and another process holds a conflicting lock.
+    """
+    if not fcntl:
+        return True
+    op = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+        op |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(fd, op)
+    except BlockingIOError:
+        return False
+    except OSError:
+        # A filesystem that can't lock: carry on unlocked
+        pass
+    return True
+
+
+@contextlib.contextmanager
+def tags_lock(dirname, exclusive=False):
+    """Hold an advisory lock while reading (shared) or rewriting
+       (exclusive) the Tags file in dirname, so several programs
+       can work on the same Tags files at once. It's the directory
+       that gets locked, since write_atomically() replaces the file.
+    """
+    try:
+        fd = os.open(dirname or '.', os.O_RDONLY)
+    except OSError:
+        fd = None
+    try:
+        if fd is not None:
+            flock(fd, exclusive)
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def parse_tags_file(fp, pathname=''):
+    """Generator: parse lines from an open Tags file, yielding
+       ('category', catname) for each category line and
+       ('tag', [tagname, ...], [filename, ...]) for each tag line,
+       with filenames as written in the file (relative to its directory).
+       pathname is used only for error messages.
+    """
+    for line in fp:
+        # The one line type that doesn't need a colon is a cat name.
+        if line.startswith('category '):
+            newcat = line[9:].strip()
+            if newcat:
+                yield 'category', newcat
+            else:
+                print(("%s: Parse error: couldn't read category name, %s"
+                      % (pathname, line)))
+            continue
+
+        # Any other legal line type must have a colon.
+        # To allow for tags that contain colons, look only for the
+        # last one.
+        colon = line.rfind(':')
+        if colon < 0:
+            continue    # If there's no colon, it's not a legal tag line
+
+        # Now we know we have tagname, typename or photoname.
+        # Get the list of objects (filenames) after the colon.
+        # Use shlex to handle quoted and backslashed
+        # filenames with embedded spaces.
+        try:
+            objects = shlex.split(line[colon+1:].strip())
+        except ValueError:
+            print(pathname, "Couldn't parse:", line)
+            continue
+
+        # tagtype and photo lines are allowed, but have never been used.
+        if line.startswith('tagtype ') or line.startswith('photo '):
+            continue
+
+        # Anything else is a tag.
+        # If it starts with "tag " (as it should), strip that off.
+        if line.startswith('tag '):
+            tagstr = line[4:colon].strip()
+        else:
+            tagstr = line[:colon].strip()
+
+        # It may be several comma-separated tags.
+        yield 'tag', list(map(str.strip, tagstr.split(','))), objects
+
+
+def read_tag_sets(lines, dirname, pathname=''):
+    """Parse the lines of a Tags file in dirname into
+       ({ absolute image path: set of tag names }, { tag name: category }),
+       for comparing versions of the file.
+    """
+    tagsets = collections.defaultdict(set)
+    tagcats = {}
+    category = DEFAULT_CAT
+    for item in parse_tags_file(lines, pathname):
+        if item[0] == 'category':
+            category = item[1]
+            continue
+        for tagname in item[1]:
+            tagcats.setdefault(tagname, category)
+            for o in item[2]:
+                tagsets[os.path.normpath(os.path.join(dirname, o))].add(
+                    tagname)
+    return tagsets, tagcats
+
 
 class Tagger(object):
     """Manages tags for images.
@@ -51,16 +217,18 @@ class Tagger(object):
         # The actual per-image lists of tags live in the MetaphoImage class.
         # Each image has img.tags, which is a list of tag indices.
 
-        # The category list is an OrderedDict
+        # The categories are an ordered mapping (see categories.py):
         # { "First category": [ 3, 5, 11 ] }
         # means category 0 has the name "First category" and includes
         # tags 3, 5 and 11 from the tag_list.
-        self.categories = collections.OrderedDict()
+        self.categories = Categories()
 
         # The tag list is a list of all tags we know about (strings).
         # A tag may be in several categories.
         # The index of a tag in this list is the tag number.
-        self.tag_list = []
+        # Deleted tags are left in it as None (see taglist.py),
+        # so tag numbers never change.
+        self.tag_list = TagList()
 
         # Files from which we've read tags (named Tags or Keywords)
         self.tagfiles = []
@@ -80,15 +248,86 @@ class Tagger(object):
         # We don't necessarily use this, but callers might want to know.
         self.all_tags_files = []
 
+        # Which images each Tags file (absolute path) has tags for,
+        # { tagfile: set of absolute image paths }, so each file's
+        # images can be written back to it.
+        self.tagfile_images = {}
+
+        # Where tag changes are journaled until they're saved:
+        # see open_journal(). None means changes aren't journaled.
+        self.journal_path = None
+        self.journal = None
+
+        # The FingerprintCache tagged images are remembered in when
+        # they're saved, made when first needed. Set it to use
+        # a different cache file.
+        self.fingerprint_cache = None
+
+        # What was last read from or written to each Tags file,
+        # { tagfile: contents as format_tags() makes them },
+        # so only files whose contents changed need to be rewritten,
+        # and changes made by other programs can be merged.
+        self.saved_tagfiles = {}
+
+        # What's changed since the Tags files were last saved:
+        # the filenames of images whose tags changed, and the numbers
+        # of tags that were renamed, deleted or put in another category.
+        # Saving only looks at the Tags files these are in:
+        # see mark_changed().
+        self.changed_images = set()
+        self.changed_tags = set()
+
+        # The mtime (in ns) of each Tags file when it was last read
+        # or written, to tell whether something else has changed it.
+        self.tagfile_mtimes = {}
+
+        # Changes from other programs merged in by the last
+        # save_tagfiles(), as journal records: see merge_tagfile().
+        self.merged_records = []
+
+        # Whether save_tagfiles() has finished, so merge_snapshot()
+        # can tell whether a snapshot was saved.
+        self.saved = False
+
+        # An SQLite tag database (see tagstore.py) to read and save tags
+        # in, instead of Tags files. None means use Tags files.
+        self.tagstore = None
+
+        # A TagSuggester (see suggest.py) to tell when tags change,
+        # or None.
+        self.suggester = None
+
+        # A trigram index of tag_list for match_tag(),
+        # and what it was built from: see tag_trigrams().
+        self._tag_trigrams = None
+        self._tag_trigrams_for = None
+
     def __repr__(self):
         """Returns a string summarizing all known images and tags,
            suitable for printing on stdout or pasting into a Tags file.
            Don't include images that no longer exist on disk.
         """
+        return self.format_tags(imagelist.image_list(), self.commondir)
+
+    def format_tags(self, images, topdir):
+        """Return the tags for the given images in the format of
+           a Tags file in directory topdir.
+           Don't include images that no longer exist on disk.
+        """
+        # Find each tag's images in one pass through the images.
+        # Check existence once per image, not once per tag:
+        # can't rely on img.invalid because that's only set
+        # if the user has tried to view that image.
+        filenames_by_tag = collections.defaultdict(list)
+        for img in images:
+            if img.tags and os.path.exists(img.filename):
+                for tagno in img.tags:
+                    filenames_by_tag[tagno].append(img.filename)
+
+        prefix = topdir + os.sep
         outstr = ''
-        commondirlen = len(self.commondir)
 
-        for cat in sorted(self.categories):
+        for cat in self.categories.sorted_names():
             outstr += '\ncategory ' + cat + '\n\n'
 
             # self.categories[cat] is a list of numeric tag indices,
@@ -97,26 +336,14 @@ class Tagger(object):
             for tagno in self.categories[cat]:
                 tagstr = self.tag_list[tagno]
 
-                # No empty tag strings
-                if tagstr.strip() == '':
+                # No empty or deleted tags
+                if not tagstr or tagstr.strip() == '':
                     continue
 
                 imgstr = ''
-                imglist = []
-                for img in imagelist.image_list():
-                    # Does the image still exist on disk?
-                    # can't rely on img.invalid because that's only set
-                    # if the user has tried to view that image.
-                    if tagno in img.tags and os.path.exists(img.filename):
-                        imglist.append(img)
-
-                # Now we have all the images in this category.
-                # Sort them alphabetically by name.
-                imglist.sort()
-                for img in imglist:
-                    filename = img.filename
-                    if filename.startswith(self.commondir):
-                        filename = filename[commondirlen+1:]
+                for filename in sorted(filenames_by_tag.get(tagno, ())):
+                    if filename.startswith(prefix):
+                        filename = filename[len(prefix):]
                     if ' ' in filename:
                         imgstr += ' "' + filename + '"'
                     else:
@@ -127,15 +354,94 @@ class Tagger(object):
         return outstr
 
     def rename_category(self, old, new):
-        for i in range(len(self.categories)):
-            k,v = self.categories.popitem(False)
-            self.categories[new if old == k else k] = v
+        self.categories.rename(old, new)
+        self.mark_changed(tagnos=self.categories[new])
+
+    def mark_changed(self, images=(), tagnos=()):
+        """Note that the tags on images have changed, or that the tags
+           numbered tagnos have been renamed, deleted or put in another
+           category, so the next save will check the Tags files they're in.
+           Anything that changes tags without going through Tagger
+           should call this.
+        """
+        self.changed = True
+        self.changed_images.update(img.filename for img in images)
+        self.changed_tags.update(tagnos)
+
+    def tagfile_contents(self, images=None, changed_only=False):
+        """Decide which Tags file each tagged image belongs in.
+           Images go back to every Tags file they were read from;
+           newly tagged images go in the Tags file in their own directory,
+           if there is one, otherwise the one in the common directory.
+           images defaults to everything in the imagelist.
+           If changed_only is set, only include the Tags files that
+           haven't been saved, or have something in them that changed
+           since (see mark_changed()).
+           Returns { tagfile: (contents, set of image filenames) }.
+        """
+        if images is None:
+            images = imagelist.image_list()
+        images = { img.filename: img for img in images }
+
+        dir_tagfiles = { os.path.dirname(tagfile): tagfile
+                         for tagfile in self.tagfile_images }
+        common_tagfile = dir_tagfiles.get(self.commondir,
+                                          os.path.join(self.commondir, "Tags"))
+
+        if changed_only:
+            changed = set(self.changed_images)
+            if self.changed_tags:
+                changed.update(filename for filename, img in images.items()
+                               if not self.changed_tags.isdisjoint(img.tags))
+            tagfile_images = { tagfile: set(filenames)
+                               for tagfile, filenames
+                               in self.tagfile_images.items()
+                               if tagfile not in self.saved_tagfiles
+                               or not filenames.isdisjoint(changed) }
+            new = [ filename for filename in changed
+                    if filename in images and images[filename].tags
+                    and not any(filename in filenames for filenames
+                                in self.tagfile_images.values()) ]
+        else:
+            tagfile_images = { tagfile: set(filenames)
+                               for tagfile, filenames
+                               in self.tagfile_images.items() }
+            known = set().union(*tagfile_images.values())
+            new = [ filename for filename, img in images.items()
+                    if img.tags and filename not in known ]
+
+        for filename in new:
+            tagfile = dir_tagfiles.get(os.path.dirname(filename),
+                                       common_tagfile)
+            if tagfile not in tagfile_images:
+                tagfile_images[tagfile] = \
+                    set(self.tagfile_images.get(tagfile, ()))
+            tagfile_images[tagfile].add(filename)
+
+        return { tagfile: (self.format_tags([ images[f] for f in filenames
+                                              if f in images ],
+                                            os.path.dirname(tagfile)),
+                           filenames)
+                 for tagfile, filenames in tagfile_images.items() }
+
+    def mark_tags_saved(self):
+        """Remember the current tags as what's in the Tags files,
+           so write_tag_file() will only rewrite files that change
+           after this.
+        """
+        for tagfile, (contents, filenames) in self.tagfile_contents().items():
+            self.saved_tagfiles[tagfile] = contents
+        self.changed_images = set()
+        self.changed_tags = set()
 
     def write_tag_file(self):
-        """Save the current set of tags to a Tags file chosen from
-           the top-level directory used in the images we've seen.
-           If there was a previous Tags file there, it will be saved
-           as Tags.bak.
+        """Save the current set of tags to the Tags files they belong in
+           (see tagfile_contents()), rewriting only the ones whose
+           contents changed, unless force_write is set.
+           Each file is replaced atomically, and its previous version
+           is saved as Tags.bak. Changes another program has made
+           to a file since it was read are merged, not overwritten.
+           If there's a tag store, the tags go there instead.
         """
         if not self.changed and not self.force_write:
             print("No tags changed; not rewriting Tags file")
@@ -145,13 +451,248 @@ class Tagger(object):
             print("Nothing was tagged; not writing Tags file")
             return
 
-        outpath = os.path.join(self.commondir, "Tags")
-        print("Saving to", outpath)
-        if os.path.exists(outpath):
-            os.rename(outpath, outpath + ".bak")
-        outfile = open(outpath, "w")
-        outfile.write(str(self))
-        outfile.close()
+        self.save_tagfiles()
+        self.changed = False
+
+        # Everything in the journal is in the Tags files now.
+        self.clear_journal()
+
+    def save_tagfiles(self, images=None, fingerprints=True):
+        """Write the Tags files for images (default: the imagelist)
+           whose contents changed, or all of them if force_write is set.
+           Only the Tags files with changes in them (see mark_changed())
+           are even formatted to see whether they changed, unless
+           force_write is set;
+           and unless fingerprints is false, remember fingerprints
+           for the tagged images in the files that were rewritten.
+           This is the slow part of saving, which snapshot() lets
+           happen in another thread.
+           Returns the Tags files that were rewritten.
+        """
+        if self.tagstore:
+            self.save_tagstore(images)
+            self.saved = True
+            return []
+
+        if images is None:
+            images = imagelist.image_list()
+            def new_image(filename):
+                img = MetaphoImage(filename, displayed=False)
+                imagelist.add_images(img)
+                return img
+        else:
+            images = list(images)
+            def new_image(filename):
+                img = SavedImage(filename, [])
+                images.append(img)
+                return img
+
+        self.merged_records = []
+        written = []
+        for tagfile, (contents, filenames) in \
+                self.tagfile_contents(
+                    images, changed_only=not self.force_write).items():
+            if not self.force_write and \
+               self.saved_tagfiles.get(tagfile) == contents:
+                continue
+            with tags_lock(os.path.dirname(tagfile), exclusive=True):
+                ondisk = self.merge_tagfile(tagfile, filenames, images,
+                                            new_image)
+                if ondisk is not None:
+                    byname = { img.filename: img for img in images }
+                    contents = self.format_tags([ byname[f] for f in filenames
+                                                  if f in byname ],
+                                                os.path.dirname(tagfile))
+                if contents != ondisk:
+                    print("Saving to", tagfile)
+                    write_atomically(tagfile, contents,
+                                     backup=tagfile + ".bak")
+                    written.append(tagfile)
+                self.saved_tagfiles[tagfile] = contents
+                self.tagfile_images[tagfile] = filenames
+                self.tagfile_mtimes[tagfile] = os.stat(tagfile).st_mtime_ns
+
+        if not written:
+            print("No Tags files needed rewriting")
+
+        # Everything that changed is saved now, except that merged
+        # changes may belong in other Tags files too.
+        self.changed_images = set()
+        self.changed_tags = set()
+        for record in self.merged_records:
+            self.changed_images.update(record["files"])
+
+        if fingerprints and written:
+            rewritten = set().union(*(self.tagfile_images[tagfile]
+                                      for tagfile in written))
+            self.remember_fingerprints([ img for img in images
+                                         if img.filename in rewritten ])
+        self.saved = True
+        return written
+
+    def save_tagstore(self, images=None):
+        """Save tags for images (default: the imagelist) in the tag store,
+           and remember fingerprints for the tagged images.
+        """
+        from .tagstore import TagStore
+
+        if images is None:
+            images = imagelist.image_list()
+        store = TagStore(self.tagstore)
+        try:
+            print("Saving to", self.tagstore)
+            store.save(self, images)
+        finally:
+            store.close()
+
+        self.remember_fingerprints(images)
+
+    def merge_tagfile(self, tagfile, filenames, images, new_image):
+        """If another program has changed tagfile since it was last
+           read or written, apply its changes to images (and add any
+           newly tagged files to filenames, making images for them
+           with new_image(filename)): a three-way merge between
+           what was read, the current tags and what's on disk now.
+           Where both sides changed the same tag on the same file,
+           they made the same change, so nothing can conflict.
+           The changes are also left in self.merged_records.
+           Call this with the Tags file locked. Returns the contents
+           on disk, or None if nothing else has changed it.
+        """
+        try:
+            with open(tagfile) as fp:
+                if os.fstat(fp.fileno()).st_mtime_ns == \
+                   self.tagfile_mtimes.get(tagfile):
+                    return None
+                ondisk = fp.read()
+        except FileNotFoundError:
+            return None
+
+        dirname = os.path.dirname(tagfile)
+        theirs, tagcats = read_tag_sets(ondisk.splitlines(), dirname, tagfile)
+        base = read_tag_sets(self.saved_tagfiles.get(tagfile, '').splitlines(),
+                             dirname)[0]
+
+        added = collections.defaultdict(list)
+        removed = collections.defaultdict(list)
+        for filename in sorted(set(theirs) | set(base)):
+            for tagname in theirs[filename] - base[filename]:
+                added[tagname].append(filename)
+            for tagname in base[filename] - theirs[filename]:
+                removed[tagname].append(filename)
+        if not added and not removed:
+            return ondisk
+        print("Merging changes to", tagfile, "made by another program")
+
+        byname = { img.filename: img for img in images }
+        changed = []
+        for tagname, files in added.items():
+            tagno = self.tag_number(tagname, tagcats[tagname])
+            for filename in files:
+                if filename not in byname:
+                    byname[filename] = new_image(filename)
+                if tagno not in byname[filename].tags:
+                    byname[filename].tags.append(tagno)
+                    changed.append(byname[filename])
+                filenames.add(filename)
+            self.merged_records.append({ "add": tagname,
+                                         "category": tagcats[tagname],
+                                         "files": files })
+        for tagname, files in removed.items():
+            if tagname not in self.tag_list:
+                continue
+            tagno = self.tag_list.index(tagname)
+            for filename in files:
+                if filename in byname and tagno in byname[filename].tags:
+                    byname[filename].tags.remove(tagno)
+                    changed.append(byname[filename])
+            self.merged_records.append({ "remove": tagname, "files": files })
+
+        if self.suggester:
+            self.suggester.update(changed)
+        return ondisk
+
+    def snapshot(self):
+        """Copy the tag state, so it can be saved in another thread
+           while tagging goes on: copying is much quicker than saving.
+           Returns (tagger, images), a Tagger holding copies of
+           everything save_tagfiles() needs and a list of SavedImages;
+           call tagger.save_tagfiles(images) in any thread,
+           then merge_snapshot() in this one, whether or not
+           that succeeded.
+        """
+        snap = Tagger()
+        snap.categories = self.categories.copy()
+        snap.tag_list = TagList(self.tag_list)
+        snap.commondir = self.commondir
+        snap.force_write = self.force_write
+        snap.tagstore = self.tagstore
+        snap.fingerprint_cache = self.fingerprint_cache
+        snap.tagfile_images = { tagfile: set(filenames)
+                                for tagfile, filenames
+                                in self.tagfile_images.items() }
+        snap.saved_tagfiles = dict(self.saved_tagfiles)
+        snap.tagfile_mtimes = dict(self.tagfile_mtimes)
+
+        # What's changed is the snapshot's to save now. If saving it
+        # fails, give them back to this tagger.
+        snap.changed_images, self.changed_images = self.changed_images, set()
+        snap.changed_tags, self.changed_tags = self.changed_tags, set()
+
+        images = [ SavedImage(img.filename, list(img.tags))
+                   for img in imagelist.image_list() ]
+        return snap, images
+
+    def merge_snapshot(self, snap, journal_size):
+        """After snap (from snapshot()) has saved its tags, remember
+           what it saved, and drop the changes it saved from the journal:
+           those in the first journal_size bytes, which should be
+           the journal_size() from when the snapshot was taken.
+           If snap didn't finish saving, the journal is left alone
+           and the changes it had are still to be saved.
+           Returns whether snap was saved.
+        """
+        if not snap.saved:
+            self.changed = True
+            self.changed_images |= snap.changed_images
+            self.changed_tags |= snap.changed_tags
+            return False
+
+        self.saved_tagfiles.update(snap.saved_tagfiles)
+        self.tagfile_images.update(snap.tagfile_images)
+        self.tagfile_mtimes.update(snap.tagfile_mtimes)
+        if self.fingerprint_cache is None:
+            self.fingerprint_cache = snap.fingerprint_cache
+        self.trim_journal(journal_size)
+
+        # Pick up what snap merged from other programs. It's already
+        # saved, so it doesn't need journaling or count as a change.
+        changed = self.changed
+        journal_path = self.journal_path
+        self.journal_path = None
+        for record in snap.merged_records:
+            self.replay_record(record)
+        self.journal_path = journal_path
+        self.changed = changed
+        return True
+
+    def remember_fingerprints(self, images=None):
+        """Remember what every tagged image (in images, default
+           the imagelist) looks like, so it can be found by content
+           if it's later moved or renamed.
+        """
+        if self.fingerprint_cache is None:
+            self.fingerprint_cache = FingerprintCache()
+        fingerprints = self.fingerprint_cache
+        if fingerprints.mode == 'off':
+            return
+        if images is None:
+            images = imagelist.image_list()
+        fingerprints.remember([ img.filename for img in images if img.tags ])
+        try:
+            fingerprints.save()
+        except OSError as e:
+            print("Couldn't save fingerprints:", e, file=sys.stderr)
 
     def check_commondir(self, d):
         """Keep track of the dir common to all directories we use:
@@ -166,6 +707,7 @@ class Tagger(object):
     def read_all_tags_for_images(self):
         """Read tags in all directories used by known images,
            plus the common dir, plus .
+           (or from the tag store, if there is one).
            Leave the pointer where it was before.
         """
         dirs = set()
@@ -182,8 +724,17 @@ class Tagger(object):
 
         dirs.add(self.commondir)
 
-        for d in dirs:
-            self.read_tags(d, recursive=False)
+        if self.tagstore:
+            from .tagstore import TagStore
+            if not self.current_category:
+                self.current_category = DEFAULT_CAT
+                self.categories[self.current_category] = []
+            store = TagStore(self.tagstore)
+            store.load(self, imagelist.image_list())
+            store.close()
+        else:
+            for d in dirs:
+                self.read_tags(d, recursive=False)
 
         # This is better handled at a higher level, so programs can
         # warn the user about it in an appropriate way.
@@ -195,6 +746,241 @@ class Tagger(object):
            DEFAULT_CAT in self.categories and not self.categories[DEFAULT_CAT]:
             del self.categories[DEFAULT_CAT]
 
+        self.mark_tags_saved()
+
+        if self.commondir:
+            self.open_journal(os.path.join(self.commondir, JOURNAL_NAME))
+
+    def open_journal(self, path):
+        """Start journaling tag changes to path, after replaying
+           any changes left there by a session that never saved them.
+           If another session is still running and journaling there,
+           leave its changes alone and don't journal this one.
+        """
+        journal = None
+        lines = []
+        if os.path.exists(path):
+            try:
+                journal = self.lock_journal(path)
+                if not journal:
+                    return
+                journal.seek(0)
+                lines = journal.readlines()
+            except OSError as e:
+                print("Can't read %s: %s" % (path, e), file=sys.stderr)
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A torn last line, if the machine crashed mid-write
+                print("Skipping bad line in %s: %s" % (path, line.strip()),
+                      file=sys.stderr)
+
+        if records:
+            print("Replaying %d unsaved tag changes from %s"
+                  % (len(records), path))
+            for record in records:
+                self.replay_record(record)
+
+        # Don't start journaling until after the replay:
+        # the replayed changes are already in the journal.
+        self.journal_path = path
+        self.journal = journal
+
+    @staticmethod
+    def lock_journal(path):
+        """Open the journal at path for appending, and lock it to show
+           that this session owns it: the lock lasts until it's closed,
+           or the session exits or crashes.
+           Returns None if another session owns it.
+        """
+        journal = open(path, 'a+')
+        if flock(journal.fileno(), exclusive=True, blocking=False):
+            return journal
+        journal.close()
+        print("Another session is journaling to %s; not journaling this one"
+              % path, file=sys.stderr)
+        return None
+
+    def replay_record(self, record):
+        """Apply one record from the journal."""
+        def tagno(name):
+            try:
+                return self.tag_list.index(name)
+            except ValueError:
+                return self.tag_number(name,
+                                       record.get("category") or DEFAULT_CAT)
+
+        def images():
+            known = { img.filename: img for img in imagelist.image_list() }
+            for filename in record["files"]:
+                if filename not in known:
+                    known[filename] = MetaphoImage(filename, displayed=False)
+                    imagelist.add_images(known[filename])
+                yield known[filename]
+
+        if "add" in record:
+            self.tag_images(tagno(record["add"]), list(images()))
+        elif "remove" in record:
+            if record["remove"] in self.tag_list:
+                self.untag_images(record["remove"], list(images()))
+        elif "set" in record:
+            self.set_tags([ tagno(name) for name in record["set"] ],
+                          list(images()))
+        elif "delete" in record:
+            if record["delete"] in self.tag_list:
+                self.delete_tag(record["delete"])
+        elif "rename" in record:
+            if record["rename"] in self.tag_list:
+                tagno = self.tag_list.index(record["rename"])
+                self.tag_list[tagno] = record["to"]
+                self.mark_changed(tagnos=[ tagno ])
+
+    def journal_record(self, **record):
+        """Append a record of a tag change to the journal,
+           if there is one. Records are JSON, one per line.
+        """
+        if not self.journal_path:
+            return
+        try:
+            if not self.journal:
+                self.journal = self.lock_journal(self.journal_path)
+                if not self.journal:
+                    self.journal_path = None
+                    return
+            self.journal.write(json.dumps(record) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        except OSError as e:
+            print("Can't write to %s: %s" % (self.journal_path, e),
+                  file=sys.stderr)
+
+    def journal_size(self):
+        """How much has been written to the journal, in bytes."""
+        try:
+            return os.path.getsize(self.journal_path)
+        except (TypeError, OSError):
+            return 0
+
+    def trim_journal(self, size):
+        """Forget the first size bytes of journaled changes,
+           once they've been saved, keeping any changes made since.
+        """
+        if not self.journal_path:
+            return
+        try:
+            with open(self.journal_path, 'rb') as fp:
+                fp.seek(size)
+                rest = fp.read()
+        except FileNotFoundError:
+            return
+        if not rest:
+            self.clear_journal()
+            return
+        write_atomically(self.journal_path, rest.decode())
+        # That's a new file, so lock it before letting go of the old one
+        oldjournal = self.journal
+        self.journal = self.lock_journal(self.journal_path)
+        if not self.journal:
+            self.journal_path = None
+        if oldjournal:
+            oldjournal.close()
+
+    def clear_journal(self):
+        """Forget journaled changes, once they've been saved."""
+        # Remove it before unlocking, so no other session can claim it
+        if self.journal_path:
+            try:
+                os.unlink(self.journal_path)
+            except FileNotFoundError:
+                pass
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    @staticmethod
+    def scan_tags_for_images(filenames):
+        """Read the Tags files that read_all_tags_for_images() would
+           read for the given image filenames, without touching the
+           tagger or the imagelist, so it's safe to call from a
+           background thread. Pass the result to merge_tag_scan().
+        """
+        dirs = set(os.path.dirname(os.path.abspath(f)) for f in filenames)
+        commondir = commonprefix(list(dirs)) if dirs else None
+        if commondir:
+            dirs.add(commondir)
+
+        scan = { "dirs": sorted(dirs),
+                 "tagfiles": [],
+                 # [ (category, [tagname, ...]) ] in the order seen
+                 "categories": [],
+                 # { abspath: [tagname, ...] }
+                 "tagged": collections.defaultdict(list) }
+        for d in scan["dirs"]:
+            with tags_lock(d):
+                for tagfilename in ("Tags", "Keywords"):
+                    pathname = os.path.join(d, tagfilename)
+                    try:
+                        fp = open(pathname)
+                        break
+                    except OSError:
+                        continue
+                else:
+                    continue
+                with fp:
+                    lines = fp.readlines()
+
+            scan["tagfiles"].append(pathname)
+            category = DEFAULT_CAT
+            for item in parse_tags_file(lines, pathname):
+                if item[0] == 'category':
+                    category = item[1]
+                    scan["categories"].append((category, []))
+                    continue
+                if (not scan["categories"]
+                    or scan["categories"][-1][0] != category):
+                    scan["categories"].append((category, []))
+                for tagname in item[1]:
+                    scan["categories"][-1][1].append(tagname)
+                    for o in item[2]:
+                        scan["tagged"][os.path.normpath(
+                            os.path.join(d, o))].append(tagname)
+
+        return scan
+
+    def merge_tag_scan(self, scan):
+        """Apply the results of scan_tags_for_images() to the tagger
+           and to images already in the imagelist. Unlike
+           read_all_tags_for_images(), doesn't add non-displayed images
+           for tagged files that aren't in the imagelist.
+        """
+        for d in scan["dirs"]:
+            self.check_commondir(d)
+        self.tagfiles += scan["tagfiles"]
+        self.all_tags_files += [ os.path.normpath(f)
+                                 for f in scan["tagfiles"] ]
+
+        tagindices = { tag: i for i, tag in enumerate(self.tag_list) }
+        for category, tagnames in scan["categories"]:
+            if category not in self.categories:
+                self.categories[category] = []
+            for tagname in tagnames:
+                if tagname not in tagindices:
+                    tagindices[tagname] = len(self.tag_list)
+                    self.tag_list.append(tagname)
+                    self.categories[category].append(tagindices[tagname])
+
+        for img in imagelist.image_list():
+            for tagname in scan["tagged"].get(img.filename, ()):
+                if tagindices[tagname] not in img.tags:
+                    img.tags.append(tagindices[tagname])
+
+        if self.tag_list and len(self.categories) > 1 and \
+           DEFAULT_CAT in self.categories and not self.categories[DEFAULT_CAT]:
+            del self.categories[DEFAULT_CAT]
+
     def read_tags(self, dirname, recursive=True):
         """Read in tags from files named in the given directory,
            and tag images in the imagelist appropriately.
@@ -233,82 +1019,52 @@ tag Bruny Island: img 008.jpg
            but they've never been used.)
         """
         # The default category name is Tags.
+        # It may already be there, if tags were loaded from a store.
         if not self.current_category:
             self.current_category = DEFAULT_CAT
-            self.categories[self.current_category] = []
+            if self.current_category not in self.categories:
+                self.categories[self.current_category] = []
 
-        try:
-            pathname = os.path.join(dirname, "Tags")
-            fp = open(pathname)
-            self.tagfiles.append(pathname)
-        except IOError:
-            # print("Couldn't find a file named Tags, trying Keywords")
+        # Don't read while another program is rewriting it
+        with tags_lock(dirname):
             try:
-                pathname = os.path.join(dirname, "Keywords")
+                pathname = os.path.join(dirname, "Tags")
                 fp = open(pathname)
                 self.tagfiles.append(pathname)
             except IOError:
-                # print("No Tags or Keywords file in", dirname)
-                return
+                # print("Couldn't find a file named Tags, trying Keywords")
+                try:
+                    pathname = os.path.join(dirname, "Keywords")
+                    fp = open(pathname)
+                    self.tagfiles.append(pathname)
+                except IOError:
+                    # print("No Tags or Keywords file in", dirname)
+                    return
+            with fp:
+                lines = fp.readlines()
+                mtime = os.fstat(fp.fileno()).st_mtime_ns
 
         pathname = os.path.normpath(pathname)
         # print("Reading tags from", pathname)
         self.all_tags_files.append(pathname)
-
-        for line in fp:
-            # The one line type that doesn't need a colon is a cat name.
-            if line.startswith('category '):
-                newcat = line[9:].strip()
-                if newcat:
-                    self.current_category = newcat
-                    if self.current_category not in self.categories:
-                        self.categories[self.current_category] = []
-                else:
-                    print(("%s: Parse error: couldn't read category name, %s"
-                          % (pathname, line)))
-                continue
-
-            # Any other legal line type must have a colon.
-            # To allow for tags that contain colons, look only for the
-            # last one.
-            colon = line.rfind(':')
-            if colon < 0:
-                continue    # If there's no colon, it's not a legal tag line
-
-            # Now we know we have tagname, typename or photoname.
-            # Get the list of objects (filenames) after the colon.
-            # Use shlex to handle quoted and backslashed
-            # filenames with embedded spaces.
-            try:
-                objects = shlex.split(line[colon+1:].strip())
-                if dirname != '.':
-                    objects = [os.path.normpath(os.path.join(dirname, o))
-                               for o in objects]
-            except ValueError:
-                print(pathname, "Couldn't parse:", line)
+        tagged = self.tagfile_images.setdefault(os.path.abspath(pathname),
+                                                set())
+        self.tagfile_mtimes[os.path.abspath(pathname)] = mtime
+
+        for item in parse_tags_file(lines, pathname):
+            if item[0] == 'category':
+                self.current_category = item[1]
+                if self.current_category not in self.categories:
+                    self.categories[self.current_category] = []
                 continue
 
-            if line.startswith('tagtype '):
-                typename = line[8:colon].strip()
-
-            elif line.startswith('photo '):
-                photoname = line[6:colon].strip()
-
-            else:
-                # Anything else is a tag.
-                # If it starts with "tag " (as it should), strip that off.
-                if line.startswith('tag '):
-                    tagstr = line[4:colon].strip()
-                else:
-                    tagstr = line[:colon].strip()
-
-                # It may be several comma-separated tags.
-                tagnames = list(map(str.strip, tagstr.split(',')))
-
-                for tagname in tagnames:
-                    self.process_tag(tagname, objects)
-
-        fp.close()
+            tagnames, objects = item[1], item[2]
+            if dirname != '.':
+                objects = [os.path.normpath(os.path.join(dirname, o))
+                           for o in objects]
+            for tagname in tagnames:
+                self.process_tag(tagname, objects)
+            tagged.update(os.path.abspath(o) for o in objects)
 
     def process_tag(self, tagname, filenames):
         """After reading a tag from a tags file, add it to the global
@@ -357,47 +1113,133 @@ tag Bruny Island: img 008.jpg
            or an integer index into the tag list.
            Return the index (in the global tags list) of the tag just added.
         """
-        self.changed = True
+        return self.tag_images(tag, [ img ], category)
 
+    def tag_number(self, tag, category=None):
+        """Return the index in the tag list of tag, which may be
+           a string or already an index. A string that isn't a tag yet
+           becomes a new tag, and is added to the given category
+           (or else the current one) if it isn't already there.
+        """
         if not category:
             category = self.current_category
         if category not in self.categories:
             self.categories[category] = []
 
         if type(tag) is int:
-            if tag not in img.tags:
-                img.tags.append(tag)
             return tag
 
-        # Else it's a string. Is it already in the tag list?
-        if tag in self.tag_list:
+        try:
             tagno = self.tag_list.index(tag)
-            if tagno not in self.categories[category]:
-                self.categories[category].append(tagno)
-            img.tags.append(tagno)
+        except ValueError:
+            self.tag_list.append(tag)
+            tagno = len(self.tag_list) - 1
+            self.categories[category].append(tagno)
             return tagno
+        if tagno not in self.categories[category]:
+            # Images that already have it are listed under this
+            # category now too
+            self.categories[category].append(tagno)
+            self.changed_tags.add(tagno)
+        return tagno
+
+    def tag_images(self, tag, images, category=None):
+        """Add a tag to all the given images at once.
+           tag may be a string or an index, as in add_tag().
+           Return the index (in the global tags list) of the tag.
+        """
+        self.changed = True
 
-        # Make a new tag.
-        self.tag_list.append(tag)
-        newindex = len(self.tag_list) - 1
-        img.tags.append(newindex)
-        self.categories[category].append(newindex)
-        return newindex
+        tagno = self.tag_number(tag, category)
+        changed = [ img for img in images if tagno not in img.tags ]
+        for img in changed:
+            img.tags.append(tagno)
+        if changed:
+            self.mark_changed(changed)
+            # Record the category for new tags, so a replay can recreate it
+            self.journal_record(add=self.tag_list[tagno],
+                                category=(None if type(tag) is int
+                                          else category
+                                               or self.current_category),
+                                files=[ img.filename for img in changed ])
+            if self.suggester:
+                self.suggester.update(changed)
+        return tagno
+
+    def untag_images(self, tag, images=None, predicate=None):
+        """Remove a tag (a string or an index) from all the given images,
+           or from every image in the image list if images is None;
+           but if predicate is given, only from images where
+           predicate(img) is true.
+           Return the number of images that had the tag.
+        """
+        if type(tag) is int:
+            tagno = tag
+        else:
+            tagno = self.tagname_to_tagno(tag)
+            if tagno < 0:
+                return 0
 
-    def remove_tag(self, tag, img):
-        self.changed = True
+        if images is None:
+            images = imagelist.image_list()
 
+        changed = [ img for img in images
+                    if tagno in img.tags and (not predicate or predicate(img)) ]
+        for img in changed:
+            img.tags.remove(tagno)
+        if changed:
+            self.mark_changed(changed)
+            self.journal_record(remove=self.tag_list[tagno],
+                                files=[ img.filename for img in changed ])
+            if self.suggester:
+                self.suggester.update(changed)
+        return len(changed)
+
+    def set_tags(self, tags, images):
+        """Give each of the given images exactly the tags in tags,
+           a list of indices into the tag list.
+        """
+        changed = [ img for img in images if img.tags != tags ]
+        for img in changed:
+            img.tags = list(tags)
+        if changed:
+            self.mark_changed(changed)
+            self.journal_record(set=[ self.tag_list[t] for t in tags
+                                      if self.tag_list[t] is not None ],
+                                files=[ img.filename for img in changed ])
+            if self.suggester:
+                self.suggester.update(changed)
+
+    def remove_tag(self, tag, img):
+        """If tag is an index, take it off img.
+           If it's a string, delete that tag altogether.
+        """
         if type(tag) is int:
-            if tag in img.tags:
-                img.tags.remove(tag)
+            self.untag_images(tag, [ img ])
+        else:
+            self.delete_tag(tag)
 
-        # Else it's a string. Remove it if it's there.
-        try:
-            self.tag_list.remove(tag)
-        except:
-            pass
+    def delete_tag(self, tag):
+        """Delete a tag (a string or an index) from the tag list and
+           all categories. Its number is left as a tombstone and
+           never reused, so no other tag is renumbered. Images that
+           still have it don't get it written out: see format_tags().
+        """
+        if type(tag) is int:
+            tagno = tag
+        else:
+            tagno = self.tagname_to_tagno(tag)
+        if tagno < 0 or self.tag_list[tagno] is None:
+            return
 
-        # XXX Need to remove it from self.current_category too?
+        self.journal_record(delete=self.tag_list[tagno])
+        self.tag_list[tagno] = None
+        for tagnos in self.categories.values():
+            if tagno in tagnos:
+                tagnos.remove(tagno)
+        self.mark_changed(tagnos=[ tagno ])
+        if self.suggester:
+            self.suggester.delete_tag(tagno)
 
     def change_tag(self, entryno, newstr):
         """Update a tag's string.
@@ -425,8 +1267,11 @@ tag Bruny Island: img 008.jpg
 
         # If it's changing an existing tag, just do it.
         if entryno < numtags:
-            self.tag_list[self.categories[self.current_category][entryno]] \
-                = newstr
+            tagno = self.categories[self.current_category][entryno]
+            if self.tag_list[tagno] != newstr:
+                self.journal_record(rename=self.tag_list[tagno], to=newstr)
+                self.mark_changed(tagnos=[ tagno ])
+            self.tag_list[tagno] = newstr
 
         # The string is nonempty and doesn't change an existing tag,
         # so add a new tag.
@@ -436,34 +1281,65 @@ tag Bruny Island: img 008.jpg
         self.changed = True
 
     def clear_tags(self, img):
-        img.tags = []
+        if img.tags:
+            img.tags = []
+            self.mark_changed([ img ])
+            if self.suggester:
+                self.suggester.update([ img ])
 
     def toggle_tag(self, tagno, img):
         """Toggle tag number tagno for the given img."""
         self.changed = True
 
         if tagno in img.tags:
-            img.tags.remove(tagno)
+            self.untag_images(tagno, [ img ])
             return
 
         # It's not there yet. See if it exists in the global tag list.
         # if tagno > len(self.tag_list):
         #     print("Warning: adding a not yet existent tag", tagno)
 
-        img.tags.append(tagno)
+        self.tag_images(tagno, [ img ])
 
     def tagname_to_tagno(self, tagname):
         """Given a tag name, return its index in the list. -1 if not found.
         """
-        for i, tag in enumerate(self.tag_list):
-            if tagname == tag:
-                return i
-        return -1
+        try:
+            return self.tag_list.index(tagname)
+        except ValueError:
+            return -1
 
-    def match_tag(self, pattern):
-        """Return a list of tags matching the pattern."""
-        print("*** match_tag isn't implemented yet!", file=sys.stderr)
-        return None
+    def tag_trigrams(self):
+        """Return a TrigramIndex of all known tag names,
+           rebuilding it only if the tag list has changed.
+        """
+        # A TagList counts its changes (see taglist.py), so that's
+        # all there is to check. Anything else assigned to tag_list
+        # has to be compared with what the index was built from.
+        version = getattr(self.tag_list, "version", None)
+        if version is None:
+            built_for = list(self.tag_list)
+        else:
+            built_for = (self.tag_list, version)
+        if self._tag_trigrams is None or self._tag_trigrams_for != built_for:
+            self._tag_trigrams = TrigramIndex(tag for tag in self.tag_list
+                                              if tag is not None)
+            self._tag_trigrams_for = built_for
+        return self._tag_trigrams
+
+    def match_tag(self, pattern, maxdist=0, regex=False):
+        """Return a list of tags matching the pattern, ignoring case:
+           tags containing pattern as a substring, or matching it
+           as a regexp if regex is true,
+           or if maxdist is nonzero, containing something within
+           maxdist typos (edit distance) of pattern.
+        """
+        index = self.tag_trigrams()
+        if maxdist:
+            return index.fuzzy_search(pattern, maxdist)
+        if regex:
+            return index.regex_search(pattern, re.IGNORECASE)
+        return index.search(pattern)
 
     def img_has_tags_in(self, img, cat):
         for tag in img.tags:
@@ -503,16 +1379,7 @@ tag Bruny Island: img 008.jpg
             local_untagged = []
             nfiles = 0
             for f in files:
-                if f.startswith("Tags") or f.startswith("Keywords"):
-                    continue
-
-                # Assume all image files will have an extension
-                if '.' not in f:
-                    continue
-
-                # Filter out file extensions we know we don't handle:
-                base, ext = os.path.splitext(f)
-                if ext in self.SKIP_EXTENSIONS:
+                if not self.is_taggable(f):
                     continue
 
                 # Now we have a file that should be tagged. Is it?
@@ -553,6 +1420,22 @@ tag Bruny Island: img 008.jpg
         else:
             print("No category set yet")
 
+    @classmethod
+    def is_taggable(cls, filename):
+        """Is filename (a basename) something that ought to be tagged,
+           as opposed to a Tags file or a file type we don't handle?
+        """
+        if filename.startswith("Tags") or filename.startswith("Keywords"):
+            return False
+
+        # Assume all image files will have an extension
+        if '.' not in filename:
+            return False
+
+        # Filter out file extensions we know we don't handle:
+        base, ext = os.path.splitext(filename)
+        return ext not in cls.SKIP_EXTENSIONS
+
     @classmethod
     def ignore_directory(cls, d, path=None):
         """Detect directory names that don't need to be indexed separately
@@ -618,11 +1501,14 @@ tag Bruny Island: img 008.jpg
 
 def Usage():
     progname = os.path.basename(sys.argv[0])
-    print("Usage:", progname)
+    print("Usage:", progname, "[--full]")
     print()
     print("""Find directories under the current one that have image files
 but lack a file named either Tags or Keywords.""")
     print()
+    print(progname, "remembers the state of each directory between runs,")
+    print("    and only re-examines directories and Tags files that have")
+    print("    changed since last time. --full re-examines everything.")
     print(progname, "will ignore files with the following extensions:")
     print('   ', ' '.join(Tagger.SKIP_EXTENSIONS))
     print("    (you can configure that with an environment variable,")
@@ -643,11 +1529,18 @@ def main():
        images in the Tags file that don't exist on disk,
        images on disk that aren't in ./Tags.
     """
-    if len(sys.argv) > 1 and (sys.argv[1] == '-h' or sys.argv[1] == '--help'):
-        Usage()
+    full = False
+    for arg in sys.argv[1:]:
+        if arg == '--full':
+            full = True
+        else:
+            Usage()
+
+    from .dircache import DirStateCache
 
-    tagger = Tagger()
-    tagger.read_tags('.')
+    cache = DirStateCache(full=full)
+    nef, utf, utd = cache.scan('.')
+    cache.save()
 
     print()
 
@@ -665,25 +1558,22 @@ def main():
                             if p.startswith(curdir)
                             else p for p in dirs ] ]
 
-    # This might be interesting information but it's too long a list
-    # when evaluating a year's photos.
-    # print "Found Tags files in:", ' '.join(tagger.all_tags_files)
-    # print
-
-    nef = MetaphoImage.find_nonexistent_files()
     if nef:
         print("Tagged files that don't exist on disk:", ' '.join(rel_dirs(nef)))
         print()
 
-    utf, utd = tagger.find_untagged_files('.')
-
     if utd:
         print("Directories that need a Tags file:", ' '.join(rel_dirs(utd)))
         print()
 
     if utf:
         print("Individual files that aren't tagged:")
-        tagger.print_files_by_directory(rel_dirs(utf))
+        Tagger.print_files_by_directory(rel_dirs(utf))
+        print()
+
+    print("%d directories unchanged (%.3f sec), %d re-examined (%.3f sec)"
+          % (cache.stats["cached"], cache.stats["cached_time"],
+             cache.stats["recomputed"], cache.stats["recomputed_time"]))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+The list of tag names, where a tag's number is its index.
+
+Images and categories refer to tags by number, so a tag's number
+must never change while the tags are in memory. So a deleted tag
+isn't taken out of the list, which would renumber every tag after it:
+its place is left as a tombstone, None, and its number is never
+used again. The tombstones go away when the tags are written out,
+since Tags files and tag stores refer to tags by name.
+
+A dict from names to numbers is kept alongside, so looking up,
+renaming and deleting a tag all take constant time, and a version
+number that goes up whenever the list changes, so things built from
+it (like Tagger's trigram index) can tell when to rebuild.
+"""
+
+
+class TagList(list):
+    """A list of tag names, with deleted tags left as None,
+       that can find a tag's number from its name without searching.
+       Tag names are unique: a tag renamed to the name of another
+       takes over that name.
+    """
+
+    def __init__(self, names=()):
+        super().__init__(names)
+        self.version = 0
+        self._reindex()
+
+    def _reindex(self):
+        self.version += 1
+        # { name: tag number }
+        self.numbers = {}
+        for tagno, name in enumerate(self):
+            if name is not None:
+                self.numbers.setdefault(name, tagno)
+
+    def __contains__(self, name):
+        return name in self.numbers
+
+    def index(self, name, *args):
+        """The number of the tag called name. Raises ValueError if
+           there's no such tag, like list.index().
+        """
+        try:
+            tagno = self.numbers[name]
+        except (KeyError, TypeError):
+            raise ValueError("%r is not a tag" % (name,))
+        if args:
+            return super().index(name, *args)
+        return tagno
+
+    def append(self, name):
+        if name is not None:
+            self.numbers[name] = len(self)
+        super().append(name)
+        self.version += 1
+
+    def extend(self, names):
+        for name in names:
+            self.append(name)
+
+    def __iadd__(self, names):
+        self.extend(names)
+        return self
+
+    def __setitem__(self, tagno, name):
+        if isinstance(tagno, slice):
+            super().__setitem__(tagno, name)
+            self._reindex()
+            return
+        old = self[tagno]
+        super().__setitem__(tagno, name)
+        self.version += 1
+        if old is not None and self.numbers.get(old) == tagno % len(self):
+            del self.numbers[old]
+        if name is not None:
+            self.numbers[name] = tagno % len(self)
+
+    def remove(self, name):
+        """Delete a tag, leaving a tombstone so no other tag's
+           number changes.
+        """
+        self[self.index(name)] = None
+
+    def __delitem__(self, tagno):
+        if isinstance(tagno, slice):
+            super().__delitem__(tagno)
+            self._reindex()
+        else:
+            self[tagno] = None
+
+    def pop(self, tagno=-1):
+        """Take a tag off the list. Only the last tag can come off
+           without renumbering others.
+        """
+        last = tagno % len(self) == len(self) - 1 if self else True
+        name = super().pop(tagno)
+        self.version += 1
+        if not last:
+            self._reindex()
+        elif name is not None and self.numbers.get(name) == len(self):
+            del self.numbers[name]
+        return name
+
+    # Anything else that moves tags around renumbers them,
+    # so the names have to be indexed again.
+
+    def insert(self, tagno, name):
+        super().insert(tagno, name)
+        self._reindex()
+
+    def clear(self):
+        super().clear()
+        self.numbers = {}
+        self.version += 1
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._reindex()
+
+    def reverse(self):
+        super().reverse()
+        self._reindex()
+
+    def names(self):
+        """The names of the tags that haven't been deleted."""
+        return [ name for name in self if name is not None ]
+
+    def copy(self):
+        return TagList(self)
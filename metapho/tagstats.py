@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+Tag statistics: how many images have each tag, which tags go
+together, and how tags are spread over directories or years.
+
+The tags are put in a sparse image x tag incidence matrix, in
+NumPy arrays (compressed rows: for each image, the tag numbers of its
+tags), so everything after building it is vectorized rather than
+a Python loop over images. That needs numpy, which is optional.
+
+    metapho-stats [-r] [-S tagstore] [--tag TAG] [--by dir|year] dir ...
+    metapho-stats --benchmark N
+"""
+
+import itertools
+import time
+import sys, os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import imagelist
+from .tagger import Tagger, SavedImage
+from .metacache import CACHEFILE
+
+
+class TagMatrix:
+    """Which of a set of images have which tags.
+       For image i, its tag numbers (indices into tag_list) are
+       tagnos[rowstart[i]:rowstart[i+1]].
+    """
+
+    def __init__(self, filenames, tag_list, rowstart, tagnos):
+        self.filenames = filenames
+        self.tag_list = tag_list
+        self.rowstart = rowstart
+        self.tagnos = tagnos
+
+        # The image each entry in tagnos belongs to
+        self.entry_image = np.repeat(np.arange(len(filenames)),
+                                     np.diff(rowstart))
+
+    @classmethod
+    def from_tagger(cls, tagger, images=None):
+        """Build the matrix from tagger's tags on images
+           (default: the tagged images in the imagelist).
+        """
+        if images is None:
+            images = [ img for img in imagelist.image_list() if img.tags ]
+        ntags = np.fromiter((len(img.tags) for img in images),
+                            dtype=np.int64, count=len(images))
+        rowstart = np.zeros(len(images) + 1, dtype=np.int64)
+        np.cumsum(ntags, out=rowstart[1:])
+        tagnos = np.fromiter(itertools.chain.from_iterable(
+                                 img.tags for img in images),
+                             dtype=np.int32, count=rowstart[-1])
+        return cls([ img.filename for img in images ], list(tagger.tag_list),
+                   rowstart, tagnos)
+
+    def tag_counts(self):
+        """The number of images with each tag, indexed by tag number."""
+        return np.bincount(self.tagnos, minlength=len(self.tag_list))
+
+    def images_with(self, tagno):
+        """A boolean array saying which images have tag number tagno."""
+        has = np.zeros(len(self.filenames), dtype=bool)
+        has[self.entry_image[self.tagnos == tagno]] = True
+        return has
+
+    def cooccurring(self, tagno):
+        """For each tag, how many images have both it and tagno."""
+        has = self.images_with(tagno)
+        return np.bincount(self.tagnos[has[self.entry_image]],
+                           minlength=len(self.tag_list))
+
+    def cooccurrence(self, n=None):
+        """Which pairs of tags are on the same images, as arrays
+           (first tag numbers, second tag numbers, image counts),
+           the first tag number less than the second in each pair,
+           most common pairs first; only the first n if n is given.
+           Only pairs some image has are counted, so this takes space
+           for the pairs on the images, not for every pair of tags.
+           How many images have each tag is tag_counts().
+        """
+        ntags = len(self.tag_list)
+
+        # Pair each entry with the one d places after it in the same row:
+        # d only has to go up to the most tags any one image has.
+        # Each pair is numbered low tag * ntags + high tag.
+        rowlen = np.diff(self.rowstart)
+        rowend = self.rowstart[1:][self.entry_image]
+        position = np.arange(len(self.tagnos))
+        pairs = [ np.zeros(0, dtype=np.int64) ]
+        for d in range(1, int(rowlen.max(initial=0))):
+            first = position[position + d < rowend]
+            if not len(first):
+                break
+            a = self.tagnos[first].astype(np.int64)
+            b = self.tagnos[first + d].astype(np.int64)
+            pairs.append(np.minimum(a, b) * ntags + np.maximum(a, b))
+
+        pairs, counts = np.unique(np.concatenate(pairs), return_counts=True)
+        order = np.argsort(-counts, kind='stable')[:n]
+        pairs = pairs[order]
+        return pairs // ntags, pairs % ntags, counts[order]
+
+    def histogram(self, groups):
+        """Count tags per group: groups gives each image's group as
+           a number from 0 (see group_by_dir() and group_by_year()).
+           Returns arrays (group numbers, tag numbers, image counts)
+           for the tags used in each group, in order of group and then
+           tag number. Like cooccurrence(), this only takes space for
+           the tags each group has, not for every group and tag.
+        """
+        ntags = len(self.tag_list)
+        cells = groups[self.entry_image].astype(np.int64) * ntags \
+            + self.tagnos
+        cells, counts = np.unique(cells, return_counts=True)
+        return cells // ntags, cells % ntags, counts
+
+    def group_by_dir(self):
+        """Returns (directory names, each image's directory number)."""
+        dirs = np.array([ os.path.dirname(f) for f in self.filenames ])
+        names, groups = np.unique(dirs, return_inverse=True)
+        return list(names), groups.ravel()
+
+    def group_by_year(self, cachefile=CACHEFILE):
+        """Returns (years, each image's year number), using the year
+           each image was taken, from the metadata cache.
+        """
+        from .bursts import capture_times
+
+        times = capture_times(self.filenames, cachefile)
+        years = np.array([ time.localtime(times[f]).tm_year
+                           if f in times else 0 for f in self.filenames ])
+        names, groups = np.unique(years, return_inverse=True)
+        return [ str(y) if y else "unknown" for y in names ], groups.ravel()
+
+
+def top(counts, names, n):
+    """[ (name, count) ] for the n biggest nonzero counts,
+       leaving out deleted tags, whose names are None.
+    """
+    rows = []
+    for i in np.argsort(-counts, kind='stable'):
+        if len(rows) >= n or not counts[i]:
+            break
+        if names[i] is not None:
+            rows.append((names[i], int(counts[i])))
+    return rows
+
+
+def print_table(rows):
+    for name, count in rows:
+        print("%8d  %s" % (count, name))
+
+
+def benchmark(nimages, ntags=2000, maxtags=8, ndirs=5000):
+    """Time building the matrix and computing statistics for nimages
+       made-up images, against the same counts done in Python loops.
+    """
+    rng = np.random.default_rng(0)
+    tagger = Tagger()
+    tagger.tag_list = [ "tag%d" % i for i in range(ntags) ]
+
+    # Popular tags are much more popular than others
+    weights = 1. / np.arange(1, ntags + 1)
+    weights /= weights.sum()
+    ntagged = rng.integers(1, maxtags + 1, nimages)
+    alltags = rng.choice(ntags, int(ntagged.sum()), p=weights).tolist()
+    images = []
+    start = 0
+    for i, n in enumerate(ntagged.tolist()):
+        images.append(SavedImage("/photos/dir%d/img%d.jpg" % (i % ndirs, i),
+                                 list(set(alltags[start:start + n]))))
+        start += n
+
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        print("%-30s %8.3f sec" % (name, time.perf_counter() - t0))
+        return result
+
+    print("%d images, %d tags" % (nimages, ntags))
+    matrix = timed("Build matrix", lambda: TagMatrix.from_tagger(tagger,
+                                                                 images))
+    counts = timed("Tag counts", matrix.tag_counts)
+    timed("Co-occurrence with tag0", lambda: matrix.cooccurring(0))
+    first, second, paircounts = timed("Full co-occurrence",
+                                      matrix.cooccurrence)
+    names, groups = timed("Group by directory", matrix.group_by_dir)
+    timed("Per-directory histogram", lambda: matrix.histogram(groups))
+
+    def python_counts():
+        counts = [0] * ntags
+        for img in images:
+            for tagno in img.tags:
+                counts[tagno] += 1
+        return counts
+
+    def python_cooccurrence():
+        cooc = {}
+        for img in images:
+            for a, b in itertools.combinations(sorted(img.tags), 2):
+                cooc[a, b] = cooc.get((a, b), 0) + 1
+        return cooc
+
+    pycounts = timed("Tag counts, Python", python_counts)
+    pycooc = timed("Full co-occurrence, Python", python_cooccurrence)
+    assert pycounts == counts.tolist()
+    assert pycooc == dict(zip(zip(first.tolist(), second.tolist()),
+                              paircounts.tolist()))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tag statistics")
+    parser.add_argument('-r', '--recursive', action="store_true",
+                        help="Include Tags files in subdirectories")
+    parser.add_argument('-S', dest='tagstore', metavar='TAGSTORE',
+                        help="Read tags from an SQLite tag store "
+                             "instead of Tags files")
+    parser.add_argument('-n', '--top', type=int, default=20,
+                        help="How many tags to show (default 20)")
+    parser.add_argument('--tag', help="Show the tags that go with this one")
+    parser.add_argument('--by', choices=('dir', 'year'),
+                        help="Count tags per directory or per year taken")
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help="Time the statistics on N made-up images")
+    parser.add_argument('dirs', nargs='*', default=['.'],
+                        help="Directories with Tags files (default .)")
+    args = parser.parse_args()
+
+    if not np:
+        print("metapho-stats needs numpy", file=sys.stderr)
+        sys.exit(1)
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+
+    tagger = Tagger()
+    if args.tagstore:
+        from .tagstore import TagStore
+        store = TagStore(args.tagstore)
+        store.load(tagger)
+        store.close()
+        roots = tuple(os.path.abspath(d) + os.sep for d in args.dirs)
+        images = [ img for img in imagelist.image_list()
+                   if img.tags and img.filename.startswith(roots) ]
+    else:
+        for d in args.dirs:
+            tagger.read_tags(d, recursive=args.recursive)
+        images = None
+
+    matrix = TagMatrix.from_tagger(tagger, images)
+    print("%d tagged images, %d tags" % (len(matrix.filenames),
+                                         len(matrix.tag_list)))
+    print()
+    print_table(top(matrix.tag_counts(), matrix.tag_list, args.top))
+
+    if args.tag:
+        if args.tag not in matrix.tag_list:
+            print("No tag", args.tag, file=sys.stderr)
+            sys.exit(1)
+        tagno = matrix.tag_list.index(args.tag)
+        counts = matrix.cooccurring(tagno)
+        counts[tagno] = 0
+        print()
+        print("Tags on images tagged %s:" % args.tag)
+        print_table(top(counts, matrix.tag_list, args.top))
+
+    if args.by:
+        if args.by == 'dir':
+            names, groups = matrix.group_by_dir()
+        else:
+            names, groups = matrix.group_by_year()
+        group, tagnos, counts = matrix.histogram(groups)
+        bounds = np.searchsorted(group, np.arange(len(names) + 1))
+        for i, name in enumerate(names):
+            rows = slice(bounds[i], bounds[i + 1])
+            print()
+            print("%s:" % name)
+            print_table(top(counts[rows],
+                            [ matrix.tag_list[t] for t in tagnos[rows] ],
+                            args.top))
+
+
+if __name__ == '__main__':
+    main()
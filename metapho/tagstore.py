@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+An SQLite database of tags, as an alternative to Tags files for
+archives too big to reparse every time: a Tagger whose tagstore is set
+reads and writes its tags there instead, and fotogr -S searches it
+with one SQL query.
+
+Tags files can be imported into a store and exported back again
+without losing anything a Tagger would write: the same tags on the
+same images in the same categories, written to the same Tags files.
+
+    metapho-tagstore import [-r] tags.sqlite dir ...
+    metapho-tagstore export tags.sqlite [dir ...]
+"""
+
+import sqlite3
+import sys, os
+
+from . import imagelist
+from .metapho import MetaphoImage
+from .tagger import Tagger, commonprefix, tags_lock, write_atomically
+
+
+# Bump this if the database layout changes. Unlike the caches,
+# a store can't just be thrown away and rebuilt.
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL);
+
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    dir_id INTEGER NOT NULL REFERENCES dirs(id));
+CREATE INDEX IF NOT EXISTS images_by_dir ON images (dir_id);
+
+-- Categories and tags come back in the order of their ids
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL);
+
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL);
+
+-- A tag may be in several categories
+CREATE TABLE IF NOT EXISTS category_tags (
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    tag_id INTEGER NOT NULL REFERENCES tags(id),
+    position INTEGER NOT NULL,
+    PRIMARY KEY (category_id, tag_id)) WITHOUT ROWID;
+
+-- Indexed both ways: image -> tags and tag -> images
+CREATE TABLE IF NOT EXISTS image_tags (
+    image_id INTEGER NOT NULL REFERENCES images(id),
+    tag_id INTEGER NOT NULL REFERENCES tags(id),
+    PRIMARY KEY (image_id, tag_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS image_tags_by_tag ON image_tags (tag_id, image_id);
+
+-- Which Tags file each image's tags were read from, for exporting
+CREATE TABLE IF NOT EXISTS tagfiles (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL);
+
+CREATE TABLE IF NOT EXISTS tagfile_images (
+    tagfile_id INTEGER NOT NULL REFERENCES tagfiles(id),
+    image_id INTEGER NOT NULL REFERENCES images(id),
+    PRIMARY KEY (tagfile_id, image_id)) WITHOUT ROWID;
+'''
+
+
+class TagStore:
+    """A tag database. Like the metadata cache, a TagStore can only
+       be used from the thread that created it.
+       Raises ValueError if dbfile is from a newer version of metapho.
+    """
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        dbdir = os.path.dirname(os.path.abspath(dbfile))
+        os.makedirs(dbdir, exist_ok=True)
+        self.db = sqlite3.connect(dbfile, timeout=30)
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            self.db.close()
+            raise ValueError("%s is tag store version %d, not %d"
+                             % (dbfile, version, SCHEMA_VERSION))
+        self.db.executescript(SCHEMA)
+        self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def row_id(self, table, path_or_name, column='path'):
+        """The id of the row in table with the given path or name,
+           adding one if there isn't one yet.
+        """
+        self.db.execute('INSERT OR IGNORE INTO %s (%s) VALUES (?)'
+                        % (table, column), (path_or_name,))
+        return self.db.execute('SELECT id FROM %s WHERE %s = ?'
+                               % (table, column),
+                               (path_or_name,)).fetchone()[0]
+
+    def image_id(self, path):
+        self.db.execute('INSERT OR IGNORE INTO images (path, dir_id) '
+                        'VALUES (?, ?)',
+                        (path, self.row_id('dirs', os.path.dirname(path))))
+        return self.db.execute('SELECT id FROM images WHERE path = ?',
+                               (path,)).fetchone()[0]
+
+    def save(self, tagger, images):
+        """Store the tags for images (MetaphoImages or anything else
+           with a filename and a list of tags indexing tagger.tag_list),
+           replacing whatever the store had for them, along with
+           tagger's categories, which replace the store's, and which
+           Tags file each image came from. tagger should have loaded
+           the store's categories first.
+           Images with no tags that aren't in the store are left out.
+        """
+        with self.db:
+            catids = { cat: self.row_id('categories', cat, 'name')
+                       for cat in tagger.categories }
+
+            # tagger has every category in the store (see load()), so
+            # the categories are replaced, not added to: a tag moved to
+            # another category, or a deleted category, doesn't come back.
+            self.db.execute('DELETE FROM category_tags')
+            self.db.execute('DELETE FROM categories WHERE id NOT IN (%s)'
+                            % ', '.join('?' * len(catids)),
+                            list(catids.values()))
+
+            tagids = {}
+            for cat, tagnos in tagger.categories.items():
+                for position, tagno in enumerate(tagnos):
+                    if tagno not in tagids:
+                        tagids[tagno] = self.row_id('tags',
+                                                    tagger.tag_list[tagno],
+                                                    'name')
+                    self.db.execute('INSERT OR REPLACE INTO category_tags '
+                                    '(category_id, tag_id, position) '
+                                    'VALUES (?, ?, ?)',
+                                    (catids[cat], tagids[tagno], position))
+
+            image_tagfiles = {}
+            for tagfile, filenames in tagger.tagfile_images.items():
+                for filename in filenames:
+                    image_tagfiles.setdefault(filename, []).append(tagfile)
+
+            for img in images:
+                row = self.db.execute('SELECT id FROM images WHERE path = ?',
+                                      (img.filename,)).fetchone()
+                if row:
+                    imgid = row[0]
+                    self.db.execute('DELETE FROM image_tags '
+                                    'WHERE image_id = ?', (imgid,))
+                    self.db.execute('DELETE FROM tagfile_images '
+                                    'WHERE image_id = ?', (imgid,))
+                elif img.tags:
+                    imgid = self.image_id(img.filename)
+                else:
+                    continue
+                self.db.executemany('INSERT OR IGNORE INTO image_tags '
+                                    '(image_id, tag_id) VALUES (?, ?)',
+                                    [ (imgid, tagids[t]) for t in img.tags
+                                      if t in tagids ])
+                self.db.executemany('INSERT INTO tagfile_images '
+                                    '(tagfile_id, image_id) VALUES (?, ?)',
+                                    [ (self.row_id('tagfiles', tagfile), imgid)
+                                      for tagfile in image_tagfiles.get(
+                                          img.filename, ()) ])
+
+            # Like a Tags file, the store has no room for tags
+            # that aren't on any image (for instance, after a rename).
+            self.db.execute('DELETE FROM category_tags WHERE tag_id NOT IN '
+                            '(SELECT tag_id FROM image_tags)')
+            self.db.execute('DELETE FROM tags WHERE id NOT IN '
+                            '(SELECT tag_id FROM image_tags)')
+
+    def load(self, tagger, images=None):
+        """Read tags into tagger for images, a list of MetaphoImages,
+           or, if images is None, for everything in the store,
+           adding those images to the imagelist as non-displayed images.
+        """
+        tagnos = {}
+        for cat, tagid, name in self.db.execute(
+                'SELECT categories.name, tags.id, tags.name '
+                'FROM categories LEFT JOIN category_tags '
+                '    ON category_tags.category_id = categories.id '
+                'LEFT JOIN tags ON tags.id = category_tags.tag_id '
+                'ORDER BY categories.id, category_tags.position'):
+            if cat not in tagger.categories:
+                tagger.categories[cat] = []
+            if name is not None:
+                tagnos[tagid] = tagger.tag_number(name, cat)
+
+        if images is None:
+            byname = {}
+            for (path,) in self.db.execute('SELECT path FROM images '
+                                           'ORDER BY path'):
+                byname[path] = MetaphoImage(path, displayed=False)
+            imagelist.add_images(list(byname.values()))
+        else:
+            byname = { img.filename: img for img in images }
+
+        # Look the images up through a temporary table,
+        # since there may be too many to list in a query.
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS wanted '
+                        '(path TEXT PRIMARY KEY)')
+        self.db.execute('DELETE FROM wanted')
+        self.db.executemany('INSERT OR IGNORE INTO wanted VALUES (?)',
+                            [ (path,) for path in byname ])
+
+        for path, tagid in self.db.execute(
+                'SELECT images.path, image_tags.tag_id FROM wanted '
+                'JOIN images ON images.path = wanted.path '
+                'JOIN image_tags ON image_tags.image_id = images.id'):
+            img = byname[path]
+            if tagnos[tagid] not in img.tags:
+                img.tags.append(tagnos[tagid])
+
+        for tagfile, path in self.db.execute(
+                'SELECT tagfiles.path, images.path FROM wanted '
+                'JOIN images ON images.path = wanted.path '
+                'JOIN tagfile_images ON tagfile_images.image_id = images.id '
+                'JOIN tagfiles ON tagfiles.id = tagfile_images.tagfile_id'):
+            tagger.tagfile_images.setdefault(tagfile, set()).add(path)
+
+        self.db.execute('DELETE FROM wanted')
+        self.db.commit()
+
+    def search(self, where, params, roots=None):
+        """Return the paths of images matching an SQL condition on
+           the images table (see fotogr's Query.sql()), limited to
+           images under the given root directories, if any.
+        """
+        sql, params = self.search_sql(where, params, roots)
+        return [ row[0] for row in self.db.execute(sql, params) ]
+
+    def search_sql(self, where, params, roots=None):
+        """The query search() runs, and its parameters."""
+        params = list(params)
+        if roots:
+            inroots = []
+            for root in roots:
+                root = os.path.abspath(root)
+                inroots.append('path = ? OR substr(path, 1, ?) = ?')
+                params += [ root, len(root) + 1, root + os.sep ]
+            where = ('(%s) AND images.dir_id IN (SELECT id FROM dirs WHERE %s)'
+                     % (where, ' OR '.join(inroots)))
+        return 'SELECT images.path FROM images WHERE ' + where, params
+
+
+def import_tags(store, dirs, recursive=True):
+    """Read the Tags files in dirs (and their subdirectories,
+       if recursive) into store.
+       Returns the number of Tags files read.
+    """
+    imagelist.clear_images()
+    tagger = Tagger()
+    # Start with the categories already in the store, so they're kept
+    store.load(tagger, [])
+    for d in dirs:
+        tagger.read_tags(d, recursive=recursive)
+    store.save(tagger, imagelist.image_list())
+    return len(tagger.all_tags_files)
+
+
+def export_tags(store, dirs=None):
+    """Write the tags in store back out to Tags files: the ones each
+       image's tags were imported from, or for images tagged since,
+       the one in the image's directory or the directory common to them.
+       If dirs is given, only write Tags files under those directories.
+       Returns the list of Tags files that changed.
+    """
+    imagelist.clear_images()
+    tagger = Tagger()
+    store.load(tagger)
+    images = imagelist.image_list()
+    if not images:
+        return []
+    tagger.commondir = commonprefix([ os.path.dirname(img.filename)
+                                      for img in images ])
+    roots = [ os.path.abspath(d) + os.sep for d in dirs or () ]
+
+    written = []
+    for tagfile, (contents, filenames) in tagger.tagfile_contents().items():
+        if roots and not any(tagfile.startswith(r) for r in roots):
+            continue
+        with tags_lock(os.path.dirname(tagfile), exclusive=True):
+            try:
+                with open(tagfile) as fp:
+                    if fp.read() == contents:
+                        continue
+            except FileNotFoundError:
+                pass
+            write_atomically(tagfile, contents, backup=tagfile + ".bak")
+        written.append(tagfile)
+    return written
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Copy tags between Tags files and an SQLite tag store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importer = subparsers.add_parser('import',
+                                     help="Read Tags files into the store")
+    importer.add_argument('-r', '--recursive', action="store_true",
+                          help="Include Tags files in subdirectories")
+    importer.add_argument('dbfile', help="The tag store")
+    importer.add_argument('dirs', nargs='+', help="Directories with Tags")
+
+    exporter = subparsers.add_parser('export',
+                                     help="Write the store out to Tags files")
+    exporter.add_argument('dbfile', help="The tag store")
+    exporter.add_argument('dirs', nargs='*',
+                          help="Only write Tags files under these directories")
+    args = parser.parse_args()
+
+    try:
+        store = TagStore(args.dbfile)
+    except (ValueError, sqlite3.Error) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == 'import':
+        ntagfiles = import_tags(store, args.dirs, args.recursive)
+        print("Imported %d Tags files into %s" % (ntagfiles, args.dbfile))
+    else:
+        for tagfile in export_tags(store, args.dirs):
+            print("Wrote", tagfile)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import sqlite3
 import sys, os
 
 import tkinter as tk
@@ -7,6 +8,8 @@ from PIL import Image as PILImage
 from PIL import ImageTk, ExifTags, UnidentifiedImageError
 
 from metapho import MetaphoImage
+from metapho.metacache import MetadataCache, exif_dict
+from metapho.exifreader import read_exif
 
 
 # The numeric key where EXIF orientation is stored.
@@ -17,6 +20,58 @@ EXIF_ORIENTATION_KEY = None
 # This is where VERBOSE lives, since the PhoImage is used by all other classes.
 VERBOSE = False
 
+# The metadata cache, opened when first needed; False if it can't be.
+_metadata_cache = None
+
+
+def metadata_cache():
+    """The MetadataCache for the Tk thread, or False."""
+    global _metadata_cache
+    if _metadata_cache is None:
+        try:
+            _metadata_cache = MetadataCache()
+        except (sqlite3.Error, OSError) as e:
+            print("Can't open the metadata cache:", e, file=sys.stderr)
+            _metadata_cache = False
+    return _metadata_cache
+
+
+# Rotations for the EXIF orientation values that pho handles
+ORIENTATION_ROTATIONS = { 3: 180, 6: -90, 8: 90 }
+
+
+def orientation_key():
+    """Return the numeric EXIF key for orientation, or -1."""
+    global EXIF_ORIENTATION_KEY
+
+    # EXIF_ORIENTATION_KEY is currently 274, but don't count on that.
+    if EXIF_ORIENTATION_KEY is None:
+        key = -1
+        for k in ExifTags.TAGS.keys():
+            if ExifTags.TAGS[k] == 'Orientation':
+                key = k
+                break
+        EXIF_ORIENTATION_KEY = key
+    return EXIF_ORIENTATION_KEY
+
+
+def probe_image(path):
+    """Read just the header of an image file, without decoding it.
+       Safe to call from any thread.
+       Returns ((width, height), exif_rotation) with the size as stored
+       (not rotated), or None if it isn't a readable image.
+    """
+    try:
+        with PILImage.open(path) as im:
+            size = im.size
+            try:
+                orientation = im.getexif().get(orientation_key())
+            except Exception:
+                orientation = None
+    except Exception:
+        return None
+    return size, ORIENTATION_ROTATIONS.get(orientation, 0)
+
 
 class tkPhoImage (MetaphoImage):
     """An image object that saves an original PILImage object
@@ -29,6 +84,11 @@ class tkPhoImage (MetaphoImage):
 
     INVALID = "Invalid Image"
 
+    # Until an image is loaded, it's no bigger than a MetaphoImage;
+    # and unload() puts it back that way.
+    __slots__ = ( 'exif_rotation', 'exif_checked', 'orig_img', 'display_img',
+                  'probed_size' )
+
     def __init__(self, filename):
         MetaphoImage.__init__(self, filename)
 
@@ -39,6 +99,11 @@ class tkPhoImage (MetaphoImage):
         # but it doesn't handle EXIF
         self.exif_rotation = 0
 
+        # Has the EXIF rotation been applied to self.rot yet?
+        # Only do that the first time the image is loaded,
+        # so a reload doesn't undo the user's rotations.
+        self.exif_checked = False
+
         # The original image as loaded from the file path.
         # This is never rotated.
         self.orig_img = None
@@ -46,8 +111,9 @@ class tkPhoImage (MetaphoImage):
         # Image as currently displayed: rotated and scaled
         self.display_img = None
 
-        # If the image couldn't be loaded, an error string is here:
-        errstr = None
+        # The size of the image on disk, if known without loading it:
+        # see probe_image().
+        self.probed_size = None
 
     def __repr__(self):
         extra = ''
@@ -63,7 +129,9 @@ class tkPhoImage (MetaphoImage):
     def get_size(self):
         if self.display_img:
             return self.display_img.size
-        return self.orig_img.size
+        if self.orig_img:
+            return self.orig_img.size
+        return self.probed_size
 
     size = property(get_size)
     # End Properties
@@ -77,7 +145,9 @@ class tkPhoImage (MetaphoImage):
             return
         try:
             self.orig_img = PILImage.open(self.relpath)
-            self.rot = self.get_exif_rotation()
+            if not self.exif_checked:
+                self.rot = self.get_exif_rotation()
+                self.exif_checked = True
             self.display_img = None
 
         except Exception as e:
@@ -85,6 +155,30 @@ class tkPhoImage (MetaphoImage):
             self.display_img = None
             raise e
 
+    def set_probe_result(self, result):
+        """Apply the result of probe_image() for this image:
+           mark it invalid if it's not a readable image, otherwise
+           remember its size and, if it hasn't been loaded yet,
+           its EXIF rotation.
+        """
+        if not result:
+            self.invalid = True
+            return
+        self.probed_size, rotation = result
+        if not self.exif_checked:
+            self.exif_rotation = rotation
+            self.rot = rotation
+            self.exif_checked = True
+
+    def unload(self):
+        """Free the image data, keeping only the filename, tags
+           and rotation. It will be reloaded if needed.
+        """
+        if self.orig_img:
+            self.orig_img.close()
+        self.orig_img = None
+        self.display_img = None
+
     def rotate(self, degrees):
         if VERBOSE:
             print("Rotating", degrees, "starting from", self.rot,
@@ -108,73 +202,46 @@ class tkPhoImage (MetaphoImage):
             # self.display_img = None
 
     def get_exif(self):
+        """Return a dictionary of EXIF tags for this image,
+           from the metadata cache if possible: see metacache.exif_dict().
+        """
+        cache = metadata_cache()
+        if cache:
+            try:
+                metadata = cache.get(self.filename)
+                if metadata:
+                    return metadata['exif']
+            except sqlite3.Error as e:
+                print("Metadata cache error:", e, file=sys.stderr)
+
+        # Without the cache, read the header directly if possible,
+        # rather than opening the image.
+        if not self.orig_img:
+            exif = read_exif(self.filename)
+            if exif is not None:
+                return exif
         try:
             if not self.orig_img:
                 self.load()
-            # Somewhere I saw a recommendation to call _getexif() rather
-            # than getexif(). Tiff images have getexif() but not _getexif();
-            # but they don't have exif anyway, so I guess that doesn't matter.
-            # Failure here will trigger the except and bail out of showing exif.
-            items = self.orig_img._getexif().items()
-            exif = {
-                ExifTags.TAGS[k]: v
-                for k, v in items
-                if k in ExifTags.TAGS
-            }
-            # Decode the GPS info, if any
-            gpsinfo = {}
-            try:
-                for key in exif['GPSInfo'].keys():
-                    decode = ExifTags.GPSTAGS.get(key, key)
-                    gpsinfo[decode] = exif['GPSInfo'][key]
-            except:
-                if VERBOSE:
-                    print("No GPS info")
-            if (gpsinfo and
-                'GPSLatitude' in gpsinfo and 'GPSLongitude' in gpsinfo):
-                # Now should have 'GPSLatitude', 'GPSLatitudeRef',
-                # 'GPSLongitude', 'GPSLongitudeRef'
-                # lat/lon are triples like (36.0, 16.0, 12.97)
-                # Turn those into more easily read decimal degrees.
-                latitude = (float(gpsinfo['GPSLatitude'][0])
-                            + float(gpsinfo['GPSLatitude'][1]) / 60.
-                            + float(gpsinfo['GPSLatitude'][2]) / 3600.)
-                if gpsinfo['GPSLatitudeRef'] == 'S':
-                    latitude = -latitude
-                longitude = (float(gpsinfo['GPSLongitude'][0])
-                    + float(gpsinfo['GPSLongitude'][1]) / 60.
-                    + float(gpsinfo['GPSLongitude'][2]) / 3600.)
-                if gpsinfo['GPSLongitudeRef'] == 'W':
-                    longitude = -longitude
-                exif['GPS coordinates'] = '%.6f, %.6f' % (latitude, longitude)
-            return exif
+            return exif_dict(self.orig_img)
         except Exception as e:
             print("Exception getting exif for", self.relpath,
                   ":", e, file=sys.stderr)
             return {}
 
     def get_exif_rotation(self):
-        global EXIF_ORIENTATION_KEY
-
-        # EXIF_ORIENTATION_KEY is currently 274, but don't count on that.
-        if EXIF_ORIENTATION_KEY is None:
-            EXIF_ORIENTATION_KEY = -1
-            for k in ExifTags.TAGS.keys():
-                if ExifTags.TAGS[k] == 'Orientation':
-                    EXIF_ORIENTATION_KEY = k
-                    break
-        if EXIF_ORIENTATION_KEY < 0:
+        if orientation_key() < 0:
             print("Internal error: can't read any EXIF")
             self.exif_rotation = 0
             return 0
 
         exif = self.orig_img.getexif()
         try:
-            if exif[EXIF_ORIENTATION_KEY] == 3:
+            if exif[orientation_key()] == 3:
                 self.exif_rotation = 180
-            elif exif[EXIF_ORIENTATION_KEY] == 6:
+            elif exif[orientation_key()] == 6:
                 self.exif_rotation = -90
-            elif exif[EXIF_ORIENTATION_KEY] == 8:
+            elif exif[orientation_key()] == 8:
                 self.exif_rotation = 90
             if VERBOSE:
                 print("EXIF rotation is", self.exif_rotation)
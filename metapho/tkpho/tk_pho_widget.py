@@ -9,9 +9,10 @@
 
 
 from metapho import MetaphoImage, imagelist
+from metapho.dirwalk import iter_image_files
 
 # This works when running the installed app, but not when running ./tkPhoWidget
-from .tk_pho_image import tkPhoImage
+from .tk_pho_image import tkPhoImage, probe_image
 # But to get VERBOSE, we need to refer to it explicitly as tk_pho_image.VERBOSE
 from . import tk_pho_image
 
@@ -19,11 +20,34 @@ import tkinter as tk
 from PIL import Image as PILImage
 from PIL import ImageTk, ExifTags, UnidentifiedImageError
 
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import queue
 import sys, os
 
 
 FRAC_OF_SCREEN = .85
 
+# How often to check for more images from a background directory walk
+WALK_POLL_MSEC = 50
+
+# Send images from the walk in batches no larger than this
+WALK_MAX_BATCH = 256
+
+# Threads for checking image headers in the background, and how many
+# images each task checks. Most of the time goes to waiting on the disk.
+PROBE_THREADS = 4
+PROBE_CHUNK = 32
+
+
+def probe_images(paths):
+    return [ probe_image(path) for path in paths ]
+
+# How many recently viewed images to keep loaded.
+# Older ones are unloaded, so memory use doesn't grow
+# with the number of images viewed.
+CACHE_SIZE = 5
+
 
 def get_screen_size(root):
     return root.winfo_screenwidth(), root.winfo_screenheight()
@@ -77,20 +101,170 @@ class tkPhoWidget (tk.Label):
 
         self.configure(background='black')
 
+        # Images that are currently loaded, oldest first
+        self.loaded = []
+
+        # Checking that images are valid, in the background:
+        # the widget's own thread pool, made when first needed
+        # and shut down by stop_probes()
+        self.probe_pool = None
+        self.probe_results = queue.Queue()
+        self.probes_pending = 0
+
         # Trying to treat metapho.g_image_list like a global
         # doesn't work; need to make sure the g_image_list used is
         # the one from base metapho, not a new one created here.
         if img_list:
-            imagelist.add_images([ tkPhoImage(f) for f in img_list ])
+            imgs = [ tkPhoImage(f) for f in img_list ]
+            imagelist.add_images(imgs)
+            self.probe(imgs)
 
     def current_image(self):
         """Returns a tkPhoImage"""
         return imagelist.current_image()
 
+    def keep_loaded(self, img):
+        """Note that img has been loaded, unloading the image
+           least recently loaded if that leaves too many.
+        """
+        for i, loaded in enumerate(self.loaded):
+            if loaded is img:
+                del self.loaded[i]
+                break
+        self.loaded.append(img)
+        while len(self.loaded) > CACHE_SIZE:
+            oldimg = self.loaded.pop(0)
+            if tk_pho_image.VERBOSE:
+                print("Unloading", oldimg.relpath)
+            oldimg.unload()
+
+    def probe(self, imgs):
+        """Check the headers of imgs in a background thread pool,
+           without decoding them, so invalid images can be skipped
+           before the user gets to them, and sizes and EXIF rotations
+           are known in advance. Results are applied in the Tk thread
+           by apply_probe_results().
+        """
+        imgs = [ img for img in imgs
+                 if type(img) is tkPhoImage and not img.invalid ]
+        if not imgs:
+            return
+        if not self.probe_pool:
+            self.probe_pool = ThreadPoolExecutor(max_workers=PROBE_THREADS)
+
+        # Probes still running when stop_probes() is called
+        # report to the old queue, which nothing reads any more.
+        results = self.probe_results
+
+        def done(future, chunk):
+            if not future.cancelled():
+                results.put((chunk, future.result()))
+
+        if not self.probes_pending:
+            self.after(WALK_POLL_MSEC, self.apply_probe_results)
+        for i in range(0, len(imgs), PROBE_CHUNK):
+            chunk = imgs[i:i+PROBE_CHUNK]
+            self.probes_pending += 1
+            future = self.probe_pool.submit(probe_images,
+                                            [ img.relpath for img in chunk ])
+            future.add_done_callback(lambda f, chunk=chunk: done(f, chunk))
+
+    def stop_probes(self):
+        """Shut down the probe threads, dropping any probes that
+           haven't started, so they don't outlive the widget or the
+           images they were checking. Call it before replacing the
+           image list; probe() starts new threads when needed.
+        """
+        if self.probe_pool:
+            if sys.version_info >= (3, 9):
+                self.probe_pool.shutdown(wait=False, cancel_futures=True)
+            else:
+                self.probe_pool.shutdown(wait=False)
+            self.probe_pool = None
+        self.probes_pending = 0
+        self.probe_results = queue.Queue()
+
+    def destroy(self):
+        self.stop_probes()
+        super().destroy()
+
+    def apply_probe_results(self):
+        while True:
+            try:
+                chunk, results = self.probe_results.get_nowait()
+            except queue.Empty:
+                break
+            self.probes_pending -= 1
+            for img, result in zip(chunk, results):
+                # Don't second-guess an image that's already loaded
+                if not img.orig_img:
+                    img.set_probe_result(result)
+                    if img.invalid and tk_pho_image.VERBOSE:
+                        print("Probe: %s isn't a valid image" % img.relpath)
+
+        if self.probes_pending:
+            self.after(WALK_POLL_MSEC, self.apply_probe_results)
+
+    def add_images_in_background(self, paths, recursive=False, natural=False,
+                                 on_first_image=None, on_done=None):
+        """Expand paths (files and directories, see iter_image_files())
+           in a background thread, adding images to the imagelist as
+           they're found. If no image is showing yet, show the first one
+           as soon as it's found, then call on_first_image().
+           Call on_done() when the walk is finished.
+        """
+        found = queue.Queue()
+
+        def walk():
+            # Send the first image right away, then bigger batches
+            batch = []
+            batchsize = 1
+            for f in iter_image_files(paths, recursive, natural):
+                batch.append(f)
+                if len(batch) >= batchsize:
+                    found.put(batch)
+                    batch = []
+                    batchsize = min(batchsize * 2, WALK_MAX_BATCH)
+            found.put(batch)
+            found.put(None)
+
+        def add_found():
+            done = False
+            while True:
+                try:
+                    batch = found.get_nowait()
+                except queue.Empty:
+                    break
+                if batch is None:
+                    done = True
+                    break
+                imgs = [ tkPhoImage(f) for f in batch ]
+                imagelist.add_images(imgs)
+                self.probe(imgs)
+
+            if imagelist.current_imageno() < 0 and imagelist.num_images():
+                try:
+                    self.next_image()
+                    if on_first_image:
+                        on_first_image()
+                except IndexError:
+                    # Nothing valid yet
+                    imagelist.set_current_imageno(-1)
+
+            if not done:
+                self.after(WALK_POLL_MSEC, add_found)
+            elif on_done:
+                on_done()
+
+        threading.Thread(target=walk, daemon=True).start()
+        self.after(WALK_POLL_MSEC, add_found)
+
     def add_image(self, imgpath):
         """Add an image to the image list.
         """
-        imagelist.add_images(tkPhoImage(imgpath))
+        img = tkPhoImage(imgpath)
+        imagelist.add_images(img)
+        self.probe([ img ])
 
     def get_widget_size(self):
         return (self.winfo_width(),
@@ -472,6 +646,7 @@ class tkPhoWidget (tk.Label):
                 continue
 
             # Whew, load() worked okay, the image is valid
+            self.keep_loaded(imagelist.current_image())
             if tk_pho_image.VERBOSE:
                 print("tkPhoWidget.next_image, to",
                       imagelist.current_imageno(),
@@ -497,6 +672,11 @@ class tkPhoWidget (tk.Label):
         if not imagelist.image_list():
             raise FileNotFoundError("No image list!")
 
+        if imagelist.current_imageno() >= 0:
+            start_image = imagelist.current_image()
+        else:
+            start_image = imagelist.get_image(0)
+
         while True:
             try:
                 imagelist.retreat()
@@ -504,12 +684,16 @@ class tkPhoWidget (tk.Label):
                 imagelist.set_current_imageno(-1)
 
             if imagelist.current_imageno() < 0:
-                imagelist.set_current_imageno(0)
+                # Stay where we were, in case everything before it
+                # was invalid.
+                imagelist.set_current_image(start_image)
                 if tk_pho_image.VERBOSE:
                     print("Can't look before first image")
                 return
 
             # Is the current image valid?
+            if imagelist.current_image().invalid:
+                continue
             try:
                 imagelist.current_image().load()
             except (FileNotFoundError, UnidentifiedImageError) as e:
@@ -528,6 +712,7 @@ class tkPhoWidget (tk.Label):
                 continue
 
             # Whew, load() worked okay, the image is valid
+            self.keep_loaded(imagelist.current_image())
             if tk_pho_image.VERBOSE:
                 print("  to", imagelist.current_imageno(),
                       "->", imagelist.current_image())
@@ -605,6 +790,7 @@ class SimpleImageViewerWindow:
     def quit_handler(self, event):
         if tk_pho_image.VERBOSE:
             print("Bye")
+        self.viewer.stop_probes()
         sys.exit(0)
 
 
@@ -10,6 +10,9 @@ This also contains main() for the Tk version of metapho.
 import metapho
 from metapho import MetaphoImage
 from metapho import imagelist
+from metapho.dirwalk import iter_image_files
+from metapho.bursts import capture_times, sort_by_taken, find_bursts
+from metapho.suggest import TagSuggester, neighbors
 
 from . import tk_pho_image    # For VERBOSE
 from .tk_pho_image import tkPhoImage
@@ -20,22 +23,64 @@ from .tkdialogs import InfoDialog, message_dialog, askyesno_with_bindings, \
 
 import tkinter as tk
 from tkinter import messagebox
+from tkinter import simpledialog
 
+import threading
 import os, sys
 
 from string import ascii_lowercase, ascii_uppercase
 from functools import partial
 
 
+# How often to save tags in the background, in seconds. 0 means never.
+AUTOSAVE_SECONDS = 60
+
+# How often to check whether a background save has finished
+AUTOSAVE_POLL_MSEC = 100
+
+# How many suggested tags to highlight. 0 means none.
+NUM_SUGGESTIONS = 3
+
+# How long a find string has to be before allowing for a typo in it:
+# one typo in a shorter string matches most tags.
+MIN_FUZZY_FIND = 5
+
+
 class TkTagViewer(metapho.Tagger):
     """The main tk metapho window, working as a metapho Tagger"""
 
     PADDING = 1
 
-    def __init__(self, img_list, force_write=False):
+    def __init__(self, img_list, force_write=False, bursts=None,
+                 autosave=AUTOSAVE_SECONDS, tagstore=None,
+                 suggestions=NUM_SUGGESTIONS):
 
         metapho.Tagger.__init__(self)
 
+        # Keep tags in an SQLite tag store rather than Tags files
+        self.tagstore = tagstore
+
+        # Background saving, see autosave().
+        # While a save is running, autosave_thread is the thread doing it
+        # and autosave_pending is (snapshot, journal size) for merging.
+        self.autosave_secs = autosave
+        self.autosave_thread = None
+        self.autosave_pending = None
+        self.autosave_error = None
+
+        # Highlight the tags each image most likely wants, see
+        # show_suggestions(). suggested is the entry numbers highlighted.
+        self.num_suggestions = suggestions
+        self.suggested = []
+
+        # Bursts of images that can be tagged together, from find_bursts():
+        # { absolute path: set of absolute paths in its burst }
+        self.burst_of = {}
+        for burst in bursts or []:
+            burst = set(os.path.abspath(f) for f in burst)
+            for f in burst:
+                self.burst_of[f] = burst
+
         self.last_image_shown = None
 
         self.root = tk.Tk()
@@ -56,6 +101,8 @@ class TkTagViewer(metapho.Tagger):
         # bg color for tags that are set on this image
         self.active_bg_color = "#f7ffff"
         self.highlight_bg_color = "#fff0f0"
+        # bg color for suggested tags
+        self.suggest_bg_color = "#fff8c8"
 
         # Bindings that should always be active in the main window.
         self.global_bindings = {
@@ -87,6 +134,9 @@ class TkTagViewer(metapho.Tagger):
             '<Key-End>':           partial(self.goto_image, -1),
             '<Control-Key-d>':     self.delete_image,
             '<Control-Key-u>':     self.clear_tag_buttons,
+            '<Control-Key-b>':     self.tag_burst,
+            '<Control-Key-a>':     self.apply_tags_to_range,
+            '<Control-Key-g>':     self.accept_suggestions,
             '<Control-Key-i>':     self.show_info,
             '<Key-slash>':         self.focus_find,
         }
@@ -230,6 +280,9 @@ class TkTagViewer(metapho.Tagger):
             print("No categories after reading Tags file")
             self.categories["Tags"] = list(self.tag_list)
 
+        if self.num_suggestions:
+            self.suggester = TagSuggester(imagelist.image_list())
+
         # Now we should have categories.
         # set current category to the first one
         self.current_category = next(iter(self.categories))
@@ -264,6 +317,9 @@ class TkTagViewer(metapho.Tagger):
         self.update_tag_entries()
         self.update_window_from_image(allow_category_change=True)
 
+        if self.autosave_secs:
+            self.root.after(int(self.autosave_secs * 1000), self.autosave)
+
     def update_tag_entries(self):
         """Populate the entry widgets to show names of tags
            in the current category.
@@ -389,12 +445,156 @@ class TkTagViewer(metapho.Tagger):
 
         self.update_window_from_image(allow_category_change=True)
 
+    def tag_burst(self, event=None):
+        """Give every image in the current image's burst the same tags
+           as the current image, then skip to the end of the burst.
+        """
+        img = imagelist.current_image()
+        burst = self.burst_of.get(img.filename)
+        if not burst:
+            flash_message("Not part of a burst", self.root)
+            return
+
+        self.focus_none()
+        self.update_image_from_window()
+
+        last = imagelist.current_imageno()
+        others = []
+        for i, other in enumerate(imagelist.image_list()):
+            if other.filename in burst:
+                others.append(other)
+                last = i
+        self.set_tags(img.tags, others)
+
+        # next_image() will go on from the last image in the burst
+        imagelist.set_current_imageno(last)
+        self.next_image()
+
+    def apply_tags_to_range(self, event=None):
+        """Ask for a range of images, or "dir" for all the images in
+           the current image's directory, and add the current image's
+           tags to all of them.
+        """
+        self.focus_none()
+        self.update_image_from_window()
+
+        img = imagelist.current_image()
+        if not img.tags:
+            flash_message("No tags to apply", self.root)
+            return
+
+        rangestr = simpledialog.askstring(
+            "Apply tags",
+            "Add this image's tags to images (e.g. 12-40),\n"
+            "or 'dir' for all images in this directory:",
+            parent=self.root)
+        if not rangestr:
+            return
+        images = self.images_in_range(rangestr, img)
+        if images is None:
+            flash_message("Can't parse '%s'" % rangestr, self.root)
+            return
+
+        for tag in img.tags:
+            self.tag_images(tag, images)
+        flash_message("Tagged %d images" % len(images), self.root)
+
+    @staticmethod
+    def images_in_range(rangestr, img):
+        """Return the displayed images indicated by rangestr,
+           which may be a single image number or a range like "12-40",
+           numbered as in the title starting from 1; or "dir",
+           meaning all images in the same directory as img.
+           Returns None if rangestr can't be parsed.
+        """
+        rangestr = rangestr.strip()
+        if rangestr == 'dir':
+            imgdir = os.path.dirname(img.filename)
+            return [ im for im in imagelist.image_list()
+                     if im.displayed
+                     and os.path.dirname(im.filename) == imgdir ]
+
+        try:
+            first, _, last = rangestr.partition('-')
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            return None
+        if first < 1 or last < first:
+            return None
+        return [ im for im in imagelist.image_list()[first-1:last]
+                 if im.displayed ]
+
+    def autosave(self):
+        """Save tags in a background thread if anything has changed,
+           so a crash loses at most a minute or so of tagging.
+           Only copying the tags happens here in the Tk thread;
+           writing the Tags files happens in the other thread.
+        """
+        self.root.after(int(self.autosave_secs * 1000), self.autosave)
+        if self.autosave_thread or not self.changed or not self.tag_list:
+            return
+
+        # Make sure the current image's tags are up to date
+        self.update_image_from_window()
+
+        snap, images = self.snapshot()
+        self.autosave_pending = (snap, self.journal_size())
+        self.changed = False
+
+        def save():
+            try:
+                snap.save_tagfiles(images)
+            except Exception as e:
+                self.autosave_error = e
+
+        self.autosave_thread = threading.Thread(target=save, daemon=True)
+        self.autosave_thread.start()
+        self.set_title()
+        self.root.after(AUTOSAVE_POLL_MSEC, self.check_autosave)
+
+    def check_autosave(self):
+        """Poll from the Tk event loop until the autosave thread is done."""
+        if not self.autosave_thread:
+            return
+        if self.autosave_thread.is_alive():
+            self.root.after(AUTOSAVE_POLL_MSEC, self.check_autosave)
+            return
+        self.finish_autosave()
+        self.set_title()
+
+    def finish_autosave(self):
+        """Wait for the autosave thread, then keep track of what it saved."""
+        self.autosave_thread.join()
+        self.autosave_thread = None
+        snap, journal_size = self.autosave_pending
+        self.autosave_pending = None
+        # If the save didn't finish, the changes stay in the journal
+        # and are tried again next time.
+        if not self.merge_snapshot(snap, journal_size):
+            print("Autosave failed:", self.autosave_error or "unknown error",
+                  file=sys.stderr)
+            self.autosave_error = None
+            return
+
+        # Show any tags merged in from another session's changes
+        if snap.merged_records:
+            self.update_tag_entries()
+            self.update_window_from_image()
+
     def set_title(self):
         img = imagelist.current_image()
-        self.root.title("%s (%d of %d)" % (
-            os.path.basename(img.filename),
-            imagelist.current_imageno() + 1,
-            metapho.num_displayed_images()))
+        title = "%s (%d of %d)" % (os.path.basename(img.filename),
+                                   imagelist.current_imageno() + 1,
+                                   metapho.num_displayed_images())
+        if img.filename in self.burst_of:
+            title += " burst of %d" % len(self.burst_of[img.filename])
+        # Show whether there's anything unsaved
+        if self.autosave_thread:
+            title += " (saving)"
+        elif self.changed:
+            title += " *"
+        self.root.title(title)
 
     @staticmethod
     def letter2index(letter):
@@ -577,6 +777,8 @@ class TkTagViewer(metapho.Tagger):
         self.enable_entry(buttonno, not self.tag_button_set(buttonno))
 
         self.changed = True
+        self.set_title()
+        self.show_suggestions()
 
     def entryerase(self, event):
         event.widget.delete(0, tk.END)
@@ -590,12 +792,17 @@ class TkTagViewer(metapho.Tagger):
     def quit(self, event=None):
         print(len(imagelist.image_list()), "images")
         if self.tag_list:
-            print(len(self.tag_list), "tags:", ', '.join(self.tag_list))
+            print(len(self.tag_list), "tags:",
+                  ', '.join(self.tag_list.names()))
         if (len(self.categories) > 1 or
             (len(self.categories) == 1 and
              next(iter(self.categories)) != 'Tags')):
             print("categories:", ' '.join([key for key in self.categories]))
 
+        # Let any background save finish first
+        if self.autosave_thread:
+            self.finish_autosave()
+
         # Write tags to disk, if they changed
         self.write_tag_file()
 
@@ -711,7 +918,7 @@ class TkTagViewer(metapho.Tagger):
                 if tk_pho_image.VERBOSE:
                     print("Copying tags from last image shown:",
                           self.last_image_shown.tags)
-                img.tags = list(self.last_image_shown.tags)
+                self.set_tags(self.last_image_shown.tags, [ img ])
             elif tk_pho_image.VERBOSE:
                 print("No self.last_image_shown")
         elif allow_category_change and \
@@ -734,13 +941,14 @@ class TkTagViewer(metapho.Tagger):
             else:  # triggered if all for iterations completed, no break
                 if tk_pho_image.VERBOSE:
                     print(img, "has tags, but none in any category")
-                img.tags = self.last_image_shown.tags
+                self.set_tags(self.last_image_shown.tags, [ img ])
 
         self.clear_tag_buttons()
         for i, b in enumerate(self.buttons):
             tagname = self.entries[i].get()
             tagno = self.tagname_to_tagno(tagname)
             self.enable_entry(i, tagno in img.tags)
+        self.show_suggestions()
 
         if self.pho_win:
             self.pho_win.goto_imageno(imagelist.current_imageno())
@@ -749,6 +957,51 @@ class TkTagViewer(metapho.Tagger):
         if self.infobox and self.infobox.state() == 'normal':
             self.infobox.update_msg(self.pho_widget.current_image(), self)
 
+    def window_tags(self, img):
+        """The tags img has according to the window: its tags
+           outside the current category, plus the buttons that are set.
+        """
+        catags = self.categories[self.current_category]
+        tags = [ tagno for tagno in img.tags if tagno not in catags ]
+        for i, tagno in enumerate(catags[:len(self.buttons)]):
+            if self.tag_button_set(i):
+                tags.append(tagno)
+        return tags
+
+    def show_suggestions(self):
+        """Highlight the tags in the current category that
+           the current image most likely wants but doesn't have yet.
+        """
+        for i in self.suggested:
+            if not self.tag_button_set(i):
+                self.enable_entry(i, False)
+        self.suggested = []
+        if not self.suggester:
+            return
+
+        img = imagelist.current_image()
+        catags = self.categories[self.current_category][:len(self.buttons)]
+        nearby = neighbors(imagelist.image_list(), imagelist.current_imageno())
+        for tagno in self.suggester.suggest(img, nearby,
+                                            tags=self.window_tags(img),
+                                            n=self.num_suggestions,
+                                            within=catags):
+            i = catags.index(tagno)
+            self.buttons[i].config(bg=self.suggest_bg_color)
+            self.entries[i].config(bg=self.suggest_bg_color)
+            self.suggested.append(i)
+
+    def accept_suggestions(self, event=None):
+        """Set all the highlighted suggested tags."""
+        if not self.suggested:
+            flash_message("No suggestions", self.root)
+            return
+        for i in self.suggested:
+            self.enable_entry(i, True)
+        self.suggested = []
+        self.changed = True
+        self.set_title()
+
     def update_image_from_window(self):
         """Update tags in the current category according to
            the state of the buttons.
@@ -798,13 +1051,11 @@ class TkTagViewer(metapho.Tagger):
 
             # add or remove the tag, as appropriate
             if self.tag_button_set(b) and tagindex not in img.tags:
-                img.tags.append(tagindex)
-                self.changed = True
+                self.tag_images(tagindex, [ img ])
                 if tk_pho_image.VERBOSE:
                     print("Adding tag", i, tagindex, "->", tagname)
             elif not self.tag_button_set(b) and tagindex in img.tags:
-                self.changed = True
-                img.tags.remove(tagindex)
+                self.untag_images(tagindex, [ img ])
                 if tk_pho_image.VERBOSE:
                     print("Removing tag", i, tagindex, "->", tagname)
 
@@ -833,8 +1084,20 @@ class TkTagViewer(metapho.Tagger):
         # print("update_find:", findstr)
         if len(findstr) < 3:
             return
+
+        # Look up matching tags in the tagger's trigram index.
+        # If nothing matches exactly, allow for a typo,
+        # if the string is long enough for that to mean anything.
+        matches = set(self.match_tag(findstr))
+        if not matches and len(findstr) >= MIN_FUZZY_FIND:
+            matches = set(self.match_tag(findstr, maxdist=1))
+
         for i, ent in enumerate(self.entries):
-            if findstr in ent.get():
+            tagname = ent.get()
+            # New tags that haven't been added to the tag list yet
+            # aren't in the index. Like the index, ignore case.
+            if tagname in matches or (findstr.lower() in tagname.lower()
+                                      and tagname not in self.tag_list):
                 ent.config(bg=self.highlight_bg_color)
             else:
                 # Set the entry to the same background color as
@@ -907,13 +1170,37 @@ class TkTagViewer(metapho.Tagger):
 
 def main():
     def Usage():
-        print("Usage: %s [-v] [--force] image1.jpg image2.jpg ..."
+        print("Usage: %s [-v] [--force] [-r] [-n] [--sort=taken] [--bursts=N]"
+              " [--autosave=SECS] [--tagstore=FILE] [--suggest=N]"
+              " image1.jpg dir ..."
               % os.path.basename(sys.argv[0]))
         print("  -v:      Verbose mode (print out chatty information)")
         print("  --force: Force update of Tags file even if nothing has changed")
+        print("  -r:      Include images in subdirectories of directories")
+        print("  -n:      Sort images in directories naturally (img9, img10)")
+        print("  --sort=taken: Show images in the order they were taken")
+        print("  --bursts=N:   Sort by time taken, and group images taken")
+        print("                within N seconds of each other as bursts")
+        print("                that can be tagged together with Ctrl-B")
+        print("  --autosave=SECS: Save changed tags in the background every")
+        print("                SECS seconds (default %d; 0 never autosaves)"
+              % AUTOSAVE_SECONDS)
+        print("  --tagstore=FILE: Read and save tags in an SQLite tag store")
+        print("                instead of Tags files (see metapho-tagstore)")
+        print("  --suggest=N:  Highlight the N tags each image most likely")
+        print("                wants (default %d; 0 turns it off);"
+              % NUM_SUGGESTIONS)
+        print("                Ctrl-G sets them")
         sys.exit(1)
 
     force = False
+    recursive = False
+    natural = False
+    sort_taken = False
+    burst_gap = None
+    autosave = AUTOSAVE_SECONDS
+    tagstore = None
+    suggestions = NUM_SUGGESTIONS
     args = sys.argv[1:]
     # XXX possibly default to all images recursively under .?
     if not args:
@@ -925,6 +1212,37 @@ def main():
         elif args[0] == '--force':
             force = True
             args = args[1:]
+        elif args[0] == '-r' or args[0] == '--recursive':
+            recursive = True
+            args = args[1:]
+        elif args[0] == '-n' or args[0] == '--natural-sort':
+            natural = True
+            args = args[1:]
+        elif args[0] == '--sort=taken':
+            sort_taken = True
+            args = args[1:]
+        elif args[0].startswith('--bursts='):
+            try:
+                burst_gap = float(args[0][9:])
+            except ValueError:
+                Usage()
+            sort_taken = True
+            args = args[1:]
+        elif args[0].startswith('--autosave='):
+            try:
+                autosave = float(args[0][11:])
+            except ValueError:
+                Usage()
+            args = args[1:]
+        elif args[0].startswith('--tagstore='):
+            tagstore = args[0][11:]
+            args = args[1:]
+        elif args[0].startswith('--suggest='):
+            try:
+                suggestions = int(args[0][10:])
+            except ValueError:
+                Usage()
+            args = args[1:]
         elif args[0] == '-h' or args[0] == '--help':
             Usage()
         elif args[0][0] == '-':
@@ -933,7 +1251,24 @@ def main():
             # No more - args, just image names
             break
 
-    tagger = TkTagViewer(img_list=args, force_write=force)
+    # Tags have to be read for all the images before tagging starts,
+    # so directories can't be read in the background as in pho.
+    if any(os.path.isdir(f) for f in args):
+        args = list(iter_image_files(args, recursive, natural))
+        if not args:
+            print("No images found")
+            sys.exit(1)
+
+    bursts = None
+    if sort_taken:
+        times = capture_times(args)
+        args = sort_by_taken(args, times)
+        if burst_gap is not None:
+            bursts = find_bursts(args, times, burst_gap)
+
+    tagger = TkTagViewer(img_list=args, force_write=force, bursts=bursts,
+                         autosave=autosave, tagstore=tagstore,
+                         suggestions=suggestions)
 
     try:
         tagger.root.mainloop()
@@ -10,11 +10,18 @@ from .tk_pho_widget import tkPhoWidget
 
 import metapho
 from metapho import imagelist
+from metapho.fingerprint import FingerprintCache
+from metapho.dirwalk import iter_image_files
+from metapho.metacache import MetadataCache
+from metapho.bursts import capture_times, sort_by_taken
 
 import tkinter as tk
 from .tkdialogs import InfoDialog, message_dialog, askyesno_with_bindings
 
+import threading
+import sqlite3
 import random
+import time
 import sys, os
 
 
@@ -22,6 +29,16 @@ import sys, os
 # mark an image in pho.
 NUMCAT = 'Flags'
 
+# How often to check whether background tag reading is done
+POLL_MSEC = 100
+
+# Processes for reading metadata in the background: leave some CPU
+# for the viewer.
+METADATA_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# For measuring startup time
+START_TIME = time.perf_counter()
+
 
 class tkPhoWindow:
     """The main window for tk pho, which can also be used as
@@ -69,6 +86,9 @@ class tkPhoWindow:
         self.pho_widget = tkPhoWidget(self.root, img_list,
                                       size=self.fixed_size)
 
+        # If set, print startup timing and quit once tags are loaded
+        self.benchmark = False
+
         # Middlemouse drag is only needed when fullscreen AND fullsize
         self.dragging_from = None
 
@@ -128,27 +148,162 @@ class tkPhoWindow:
         # Exit on either q or Ctrl-q. tkPhoWidget sets the ctrl-q binding.
         self.root.bind('<Key-q>', self.quit)
 
-        self.tagger.read_all_tags_for_images()
+        # Reading tags and looking for tagged files that have moved
+        # can take a while, so do it in the background once
+        # the first image is showing.
+        self.tag_scan = None
+        self.moved_search = None
+        self.root.after_idle(self.start_tag_scan)
+
+        # Are images still being added from directories?
+        # If so, tags will be read once that's finished.
+        self.walking = False
+
+        if fullscreen:
+            self.go_fullscreen(True)
+
+    def start_tag_scan(self):
+        """Start a background thread reading the Tags files
+           for the images in the imagelist.
+           The tags are merged in by check_tag_scan(), in the Tk thread.
+        """
+        if self.walking:
+            return
+        filenames = [ img.filename for img in imagelist.image_list() ]
+        self.tag_scan = { "scan": None, "error": None }
+
+        def scan():
+            try:
+                self.tag_scan["scan"] = metapho.Tagger.scan_tags_for_images(
+                    filenames)
+            except Exception as e:
+                self.tag_scan["error"] = e
+
+        threading.Thread(target=scan, daemon=True).start()
+        self.root.after(POLL_MSEC, self.check_tag_scan)
+
+    def check_tag_scan(self):
+        if self.tag_scan["error"]:
+            print("Couldn't read tags:", self.tag_scan["error"],
+                  file=sys.stderr)
+            self.tag_scan = None
+            if self.benchmark:
+                self.quit()
+            return
+        if self.tag_scan["scan"] is None:
+            self.root.after(POLL_MSEC, self.check_tag_scan)
+            return
+
+        self.tagger.merge_tag_scan(self.tag_scan["scan"])
+        self.tag_scan = None
+        if self.benchmark or tk_pho_image.VERBOSE:
+            print("Tags loaded after %.3f sec"
+                  % (time.perf_counter() - START_TIME))
+        if self.benchmark:
+            self.quit()
+        self.update_infobox()
+
+        self.start_moved_file_search()
+        self.start_metadata_scan()
+
+    def start_metadata_scan(self):
+        """Fill the metadata cache for all the images in the background,
+           so the info dialog won't have to wait for EXIF to be read.
+        """
+        filenames = [ img.filename for img in imagelist.image_list() ]
 
-        # No need for all the images that got added because they had tags,
-        # that aren't in the explicit image list.
-        # They're all MetaphoImages rather than tkPhoImages.
-        noneed = [img for img in imagelist.img_list
-                  if type(img) is not tkPhoImage ]
-        for delimg in noneed:
-            imagelist.remove_image(delimg)
+        def scan():
+            try:
+                cache = MetadataCache()
+                cache.populate(filenames, workers=METADATA_WORKERS)
+                cache.close()
+            except (sqlite3.Error, OSError) as e:
+                print("Couldn't update the metadata cache:", e,
+                      file=sys.stderr)
 
-        nef = tkPhoImage.clean_up_nonexistent_files(self.tagger.commondir)
+        threading.Thread(target=scan, daemon=True).start()
+
+    def start_moved_file_search(self):
+        """Start a background thread looking for images that don't
+           exist on disk, in case they've moved since being tagged.
+           The thread only searches the filesystem: the results are
+           applied to the imagelist by check_moved_file_search(),
+           back in the Tk thread.
+        """
+        missing = tkPhoImage.nonexistent_images()
+        if not missing or not self.tagger.commondir:
+            return
+
+        self.moved_search = { "missing": missing, "moved": None,
+                              "error": None }
+
+        def search():
+            try:
+                fingerprints = FingerprintCache()
+                moved = tkPhoImage.find_moved_files(list(missing),
+                                                    self.tagger.commondir,
+                                                    fingerprints=fingerprints)
+            except Exception as e:
+                self.moved_search["error"] = e
+                return
+            try:
+                fingerprints.save()
+            except OSError as e:
+                print("Couldn't save fingerprints:", e, file=sys.stderr)
+            self.moved_search["moved"] = moved
+
+        threading.Thread(target=search, daemon=True).start()
+        self.root.after(POLL_MSEC, self.check_moved_file_search)
+
+    def check_moved_file_search(self):
+        if self.moved_search["error"]:
+            print("Couldn't look for moved files:",
+                  self.moved_search["error"], file=sys.stderr)
+            self.moved_search = None
+            return
+        if self.moved_search["moved"] is None:
+            self.root.after(POLL_MSEC, self.check_moved_file_search)
+            return
+
+        nef = tkPhoImage.apply_moved_files(self.moved_search["missing"],
+                                           self.moved_search["moved"])
+        self.moved_search = None
         if nef:
             print("Not found:", ' '.join(nef))
 
-        if fullscreen:
-            self.go_fullscreen(True)
+    def add_images_from(self, paths, recursive=False, natural=False):
+        """Add images from paths, which may include directories,
+           in the background: see tkPhoWidget.add_images_in_background.
+           Call before run().
+        """
+        self.walking = True
+        self.pho_widget.add_images_in_background(
+            paths, recursive=recursive, natural=natural,
+            on_first_image=self.first_image_shown,
+            on_done=self.walk_done)
+
+    def walk_done(self):
+        self.walking = False
+        if not imagelist.num_images():
+            print("No images found", file=sys.stderr)
+            self.quit()
+        self.start_tag_scan()
+
+    def first_image_shown(self):
+        self.update_title()
+        if self.benchmark:
+            # Make sure the image has actually been drawn
+            self.root.update()
+            print("First image shown after %.3f sec"
+                  % (time.perf_counter() - START_TIME))
 
     def run(self):
         try:
-            self.pho_widget.next_image()
-            self.update_title()
+            # If images are still coming from directories,
+            # the first one will be shown when it arrives.
+            if not self.walking or imagelist.num_images():
+                self.pho_widget.next_image()
+                self.first_image_shown()
         except Exception as e:
             print(e)
             sys.exit(1)
@@ -211,11 +366,9 @@ class tkPhoWindow:
             tagno = self.tagger.tag_list.index(digitstr)
             if tagno not in self.tagger.categories[NUMCAT]:
                 self.tagger.categories[NUMCAT].append(tagno)
+                self.tagger.mark_changed(tagnos=[ tagno ])
             # Toggle it in the image
-            if tagno in img.tags:
-                img.tags.remove(tagno)
-            else:
-                img.tags.append(tagno)
+            self.tagger.toggle_tag(tagno, img)
 
         except ValueError:
             self.tagger.add_tag(digitstr, img,
@@ -479,6 +632,10 @@ PHO_CMD : command to run when pressing g (default: gimp).
     parser.add_argument('-R', "--randomize", dest="randomize", default=False,
                         action="store_true",
                         help="Present images in random order")
+    parser.add_argument("--sort", dest="sort", default="args",
+                        choices=("args", "taken"),
+                        help="Show images in argument order (default), "
+                             "or in the order they were taken")
     parser.add_argument('-v', "--verbosehelp", dest="verbosehelp",
                         default=False,
                         action="store_true", help="Print verbose help")
@@ -486,7 +643,20 @@ PHO_CMD : command to run when pressing g (default: gimp).
                         help="Fixed window size, WIDTHxHEIGHT")
     parser.add_argument('-d', "--debug", dest="debug", default=False,
                         action="store_true", help="Print debugging messages")
-    parser.add_argument('images', nargs='+', help="Images to show")
+    parser.add_argument('-r', "--recursive", dest="recursive", default=False,
+                        action="store_true",
+                        help="Include images in subdirectories "
+                             "of directory arguments")
+    parser.add_argument('-n', "--natural-sort", dest="natural",
+                        default=False, action="store_true",
+                        help="Sort images in directories naturally, "
+                             "so img9 comes before img10")
+    parser.add_argument("--time-startup", dest="benchmark", default=False,
+                        action="store_true",
+                        help="Print how long it takes to show the first "
+                             "image and to load tags, then quit")
+    parser.add_argument('images', nargs='+',
+                        help="Images, or directories of images, to show")
 
     # Also look at PHO_ARGS environment variable
     try:
@@ -503,9 +673,27 @@ PHO_CMD : command to run when pressing g (default: gimp).
     if args.nopresentation:
         args.presentation = False
 
+    if args.randomize and args.sort != "args":
+        parser.error("Can't both randomize and sort")
+
+    # If there are directories, everything is added in the background
+    # (keeping the order of the arguments) so the first image can
+    # be shown while they're read -- unless it all has to be
+    # shuffled or sorted.
+    dirs = None
+    if any(os.path.isdir(f) for f in args.images):
+        if args.randomize or args.sort != "args":
+            args.images = list(iter_image_files(args.images, args.recursive,
+                                                args.natural))
+        else:
+            dirs = args.images
+            args.images = []
+
     if args.randomize:
         random.seed()
         random.shuffle(args.images)
+    elif args.sort == "taken":
+        args.images = sort_by_taken(args.images, capture_times(args.images))
 
     # The size argument is useful for things like presentations over Zoom.
     win_size = None
@@ -525,6 +713,10 @@ PHO_CMD : command to run when pressing g (default: gimp).
         pwin = tkPhoWindow(parent=None, img_list=args.images,
                            fixed_size=win_size,
                            fullscreen=args.presentation)
+        pwin.benchmark = args.benchmark
+        if dirs:
+            pwin.add_images_from(dirs, recursive=args.recursive,
+                                 natural=args.natural)
         pwin.run()
     except KeyboardInterrupt:
         print("Interrupt")
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# Copyright 2026 by Akkana Peck: share and enjoy under the GPL v2 or later.
+
+"""
+A trigram index over a set of strings, such as all the distinct tags
+in an archive, for fast substring, regexp and approximate matching.
+
+Every string is indexed under each three-character sequence it contains.
+A query first narrows the strings to candidates containing all the
+trigrams the query requires, then confirms each candidate with the
+full (and much slower) comparison.
+"""
+
+from collections import defaultdict
+import re
+
+
+def trigrams(s):
+    """Return the set of three-character substrings of s."""
+    return { s[i:i+3] for i in range(len(s) - 2) }
+
+
+# Characters that have a special meaning in a regexp.
+REGEX_SPECIALS = '.^$*+?{}[]\\|()'
+
+# Quantifiers that allow the preceding item to be absent.
+OPTIONAL_QUANTIFIERS = '*?{'
+
+
+def required_literals(pattern):
+    """Return a list of literal strings that any match of the regexp
+       pattern must contain, as far as can be told without a full parse.
+       An empty list means no narrowing is possible,
+       e.g. for alternations or groups.
+    """
+    # Anything with alternation or groups could have optional pieces
+    # anywhere: don't try to be clever.
+    if re.search(r'(?<!\\)[|()]', pattern):
+        return []
+
+    literals = []
+    run = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        nextc = pattern[i+1] if i + 1 < len(pattern) else ''
+
+        if c == '\\':
+            # An escaped punctuation character is a literal;
+            # anything else (\d, \w, \b ...) is a class or an anchor.
+            if nextc and not nextc.isalnum():
+                c = nextc
+                i += 1
+                nextc = pattern[i+1] if i + 1 < len(pattern) else ''
+            else:
+                literals.append(run)
+                run = ''
+                i += 2
+                continue
+
+        elif c == '[':
+            # Skip the whole character class
+            literals.append(run)
+            run = ''
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                return []
+            i = end + 1
+            continue
+
+        elif c == '{':
+            # Skip a repeat count like {2,3}
+            literals.append(run)
+            run = ''
+            end = pattern.find('}', i)
+            i = end + 1 if end > 0 else i + 1
+            continue
+
+        elif c in REGEX_SPECIALS:
+            literals.append(run)
+            run = ''
+            i += 1
+            continue
+
+        if nextc and nextc in OPTIONAL_QUANTIFIERS:
+            # This character may not be there at all.
+            literals.append(run)
+            run = ''
+        elif nextc == '+':
+            # It's there at least once, but may repeat.
+            literals.append(run + c)
+            run = ''
+        else:
+            run += c
+        i += 1
+
+    literals.append(run)
+    return [ lit for lit in literals if lit ]
+
+
+def substring_edit_distance(needle, haystack, maxdist=None):
+    """Return the smallest edit distance between needle and any
+       substring of haystack (Sellers' algorithm).
+       If maxdist is given, may stop early and return maxdist + 1
+       as soon as it's clear the distance will be larger than that.
+    """
+    # prev[j] is the distance between needle[:i] and the best
+    # substring of haystack ending at position j.
+    prev = [0] * (len(haystack) + 1)
+    for i in range(1, len(needle) + 1):
+        cur = [i] + [0] * len(haystack)
+        for j in range(1, len(haystack) + 1):
+            cost = 0 if needle[i-1] == haystack[j-1] else 1
+            cur[j] = min(prev[j-1] + cost,    # substitute or match
+                         prev[j] + 1,         # delete from needle
+                         cur[j-1] + 1)        # insert into needle
+        if maxdist is not None and min(cur) > maxdist:
+            return maxdist + 1
+        prev = cur
+    return min(prev)
+
+
+class TrigramIndex:
+    """Index a set of strings by their trigrams.
+       If ignorecase is true (the default), the index is built
+       from lowercased strings, but the original strings are returned.
+    """
+
+    def __init__(self, strings=(), ignorecase=True):
+        self.ignorecase = ignorecase
+
+        # { trigram: set of strings containing it }
+        self.postings = defaultdict(set)
+
+        self.strings = set()
+
+        for s in strings:
+            self.add(s)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, s):
+        return s in self.strings
+
+    def __iter__(self):
+        return iter(self.strings)
+
+    def key(self, s):
+        return s.lower() if self.ignorecase else s
+
+    def add(self, s):
+        if s in self.strings:
+            return
+        self.strings.add(s)
+        for gram in trigrams(self.key(s)):
+            self.postings[gram].add(s)
+
+    def discard(self, s):
+        if s not in self.strings:
+            return
+        self.strings.discard(s)
+        for gram in trigrams(self.key(s)):
+            self.postings[gram].discard(s)
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def candidates(self, literals):
+        """Return the set of strings that might contain all of the
+           given literal strings: everything, if none of the literals
+           is long enough to have trigrams.
+        """
+        grams = set()
+        for lit in literals:
+            grams |= trigrams(self.key(lit))
+        if not grams:
+            return set(self.strings)
+
+        # Intersect the smallest posting lists first
+        postings = sorted((self.postings.get(gram, set()) for gram in grams),
+                          key=len)
+        cands = set(postings[0])
+        for posting in postings[1:]:
+            if not cands:
+                break
+            cands &= posting
+        return cands
+
+    def search(self, substring):
+        """Return a list of indexed strings that contain substring."""
+        key = self.key(substring)
+        return [ s for s in self.candidates([substring])
+                 if key in self.key(s) ]
+
+    def regex_search(self, pattern, flags=0):
+        """Return a list of indexed strings where the regexp
+           pattern (a string or a compiled regexp) matches.
+        """
+        if type(pattern) is str:
+            pattern = re.compile(pattern, flags)
+        if (pattern.flags & re.IGNORECASE) and not self.ignorecase:
+            # The index is case sensitive, so it can't narrow this.
+            cands = self.strings
+        else:
+            cands = self.candidates(required_literals(pattern.pattern))
+        return [ s for s in cands if pattern.search(s) ]
+
+    def fuzzy_search(self, word, maxdist=1):
+        """Return a list of indexed strings that contain something
+           within an edit distance of maxdist from word,
+           e.g. "sqirrel" will find "gray squirrel".
+        """
+        key = self.key(word)
+        grams = trigrams(key)
+
+        # Each edit can destroy at most three of word's trigrams,
+        # so a match must still contain the rest of them.
+        needed = len(grams) - 3 * maxdist
+        if needed <= 0:
+            cands = self.strings
+        else:
+            counts = defaultdict(int)
+            for gram in grams:
+                for s in self.postings.get(gram, ()):
+                    counts[s] += 1
+            cands = [ s for s in counts if counts[s] >= needed ]
+
+        return [ s for s in cands
+                 if substring_edit_distance(key, self.key(s),
+                                            maxdist) <= maxdist ]
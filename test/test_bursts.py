@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Tests for sorting images by time taken and finding bursts
+
+import unittest
+
+import shutil
+import time
+import os
+
+import sys
+sys.path.insert(0, '..')
+
+from PIL import Image as PILImage
+
+from metapho.bursts import capture_times, sort_by_taken, find_bursts
+
+
+class BurstTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = 'test/burstdir'
+        os.mkdir(self.testdir)
+        self.cachefile = os.path.join(self.testdir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def path(self, name):
+        return os.path.join(self.testdir, name)
+
+    def test_bursts(self):
+        # Images without EXIF are sorted by mtime
+        base = 1700000000
+        for name, secs in (("a.jpg", 100), ("b.jpg", 0), ("c.jpg", 1),
+                           ("d.jpg", 2.5), ("e.jpg", 60)):
+            shutil.copy('test/files/1.jpg', self.path(name))
+            os.utime(self.path(name), (base + secs, base + secs))
+
+        # EXIF dates win over mtime, and sub-seconds count
+        taken = time.strftime("%Y:%m:%d %H:%M:%S", time.localtime(base + 61))
+        img = PILImage.new('RGB', (10, 10))
+        for name, subsec in (("y.jpg", "50"), ("x.jpg", "25")):
+            exif = PILImage.Exif()
+            exif[0x8769] = { 0x9003: taken, 0x9291: subsec }
+            img.save(self.path(name), exif=exif)
+
+        names = [ self.path(f) for f in ("a.jpg", "b.jpg", "c.jpg", "d.jpg",
+                                         "e.jpg", "x.jpg", "y.jpg",
+                                         "nonexistent.jpg") ]
+        times = capture_times(names, self.cachefile)
+        self.assertEqual(len(times), 7)
+
+        names = sort_by_taken(names, times)
+        self.assertEqual([ os.path.basename(f) for f in names ],
+                         [ "b.jpg", "c.jpg", "d.jpg", "e.jpg",
+                           "x.jpg", "y.jpg", "a.jpg", "nonexistent.jpg" ])
+
+        self.assertEqual([ [ os.path.basename(f) for f in burst ]
+                           for burst in find_bursts(names, times, 2) ],
+                         [ [ "b.jpg", "c.jpg", "d.jpg" ],
+                           [ "e.jpg", "x.jpg", "y.jpg" ] ])
+        self.assertEqual(len(find_bursts(names, times, 1)), 2)
+        self.assertEqual(find_bursts(names, times, .1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
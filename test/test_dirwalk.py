@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Tests for expanding directory arguments into image lists
+
+import unittest
+
+from pathlib import Path
+import shutil
+import os
+
+import sys
+sys.path.insert(0, '..')
+
+from metapho.dirwalk import iter_image_files, natural_sort_key
+
+
+class DirWalkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = Path('test/walkdir')
+        self.testdir.mkdir()
+        for f in ("img10.jpg", "img9.jpg", "Tags", "notes.txt",
+                  "sub/img1.jpg", "sub/deeper/img2.jpg",
+                  "web/small.jpg", "skipme/img3.jpg", "skipme/NoTags"):
+            path = self.testdir / f
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def relnames(self, files):
+        return [ os.path.relpath(f, self.testdir) for f in files ]
+
+    def test_natural_sort_key(self):
+        self.assertEqual(sorted(["img10.jpg", "IMG9.jpg", "img100.jpg"],
+                                key=natural_sort_key),
+                         ["IMG9.jpg", "img10.jpg", "img100.jpg"])
+
+    def test_walk(self):
+        self.assertEqual(self.relnames(iter_image_files([self.testdir])),
+                         [ "img10.jpg", "img9.jpg" ])
+
+        self.assertEqual(self.relnames(iter_image_files([self.testdir],
+                                                        natural=True)),
+                         [ "img9.jpg", "img10.jpg" ])
+
+        # Recursive, skipping ignored directories and those with NoTags;
+        # explicit files are passed through in order.
+        self.assertEqual(
+            self.relnames(iter_image_files(
+                [ self.testdir / "skipme/img3.jpg", self.testdir ],
+                recursive=True, natural=True)),
+            [ "skipme/img3.jpg", "img9.jpg", "img10.jpg",
+              "sub/img1.jpg", "sub/deeper/img2.jpg" ])
+
+    def test_symlink_loop(self):
+        # Links to directories aren't followed, so a link back up
+        # the tree doesn't list the same images over and over
+        os.symlink("..", self.testdir / "sub/loop")
+        os.symlink("deeper", self.testdir / "sub/link.jpg")
+        self.assertEqual(
+            self.relnames(iter_image_files([ self.testdir ], recursive=True,
+                                           natural=True)),
+            [ "img9.jpg", "img10.jpg", "sub/img1.jpg", "sub/deeper/img2.jpg" ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Tests for reading EXIF straight from image headers
+
+import unittest
+
+import shutil
+import os
+
+import sys
+sys.path.insert(0, '..')
+
+from PIL import Image as PILImage
+from PIL.TiffImagePlugin import IFDRational
+
+from metapho.exifreader import read_header, read_exif
+from metapho.metacache import exif_dict
+
+
+class ExifReaderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = 'test/exifdir'
+        os.mkdir(self.testdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def assertSameAsPIL(self, path):
+        with PILImage.open(path) as img:
+            self.assertEqual(read_header(path), (img.size, exif_dict(img)))
+
+    def test_same_as_pil(self):
+        self.assertSameAsPIL('test/files/portrait.jpg')
+        self.assertSameAsPIL('test/files/1.jpg')
+
+        img = PILImage.new('RGB', (30, 20))
+        exif = PILImage.Exif()
+        exif[0x010f] = 'Canon'
+        exif[0x0112] = 6
+        exif[0x8769] = { 0x9003: '2024:01:02 03:04:05',
+                         0x829a: IFDRational(1, 250) }
+        exif[0x8825] = { 1: 'N', 2: (IFDRational(36, 1), IFDRational(16, 1),
+                                     IFDRational(1297, 100)),
+                         3: 'W', 4: (IFDRational(106, 1), IFDRational(5, 1),
+                                     IFDRational(30, 1)) }
+        path = os.path.join(self.testdir, 'gps.jpg')
+        img.save(path, exif=exif)
+        self.assertSameAsPIL(path)
+
+        exif = read_exif(path)
+        self.assertEqual(exif['Orientation'], 6)
+        self.assertEqual(exif['DateTimeOriginal'], '2024:01:02 03:04:05')
+        self.assertEqual(exif['GPS coordinates'], '36.270269, -106.091667')
+
+    def test_not_jpeg(self):
+        self.assertIsNone(read_header('test/files/bigimg.png'))
+        self.assertIsNone(read_header('test/files/Tags'))
+        empty = os.path.join(self.testdir, 'empty.jpg')
+        open(empty, 'w').close()
+        self.assertIsNone(read_header(empty))
+
+
+if __name__ == '__main__':
+    unittest.main()
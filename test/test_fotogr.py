@@ -125,6 +125,56 @@ tag chickens : chicken.jpg
                                             [], False, False))
         self.assertEqual(r, [])
 
+    def test_expressions(self):
+        exprdir = os.path.join(TMPDIR, "expr")
+        os.mkdir(exprdir)
+        for d in ("2023-05", "2024-01"):
+            os.mkdir(os.path.join(exprdir, d))
+            for img in ("a.jpg", "b.jpg", "c.jpg", "d.jpg"):
+                TestFotogr.make_empty_file(os.path.join(exprdir, d, img))
+            with open(os.path.join(exprdir, d, "Tags"), "w") as tagfp:
+                print("""
+category Tags
+
+tag sunset : a.jpg
+tag dawn, clouds : b.jpg c.jpg
+tag blurry : c.jpg
+tag New Mexico : a.jpg d.jpg
+tag missing : gone.jpg
+""", file=tagfp)
+
+        def search(expr):
+            r = fotogr.search_expression([exprdir], expr)
+            return [ os.path.relpath(f, exprdir) for f in r ]
+
+        self.assertEqual(search("(sunset or dawn) and not blurry"),
+                         ['2023-05/a.jpg', '2023-05/b.jpg',
+                          '2024-01/a.jpg', '2024-01/b.jpg'])
+        self.assertEqual(search("(sunset or dawn) and not blurry "
+                                "and dir:2023*"),
+                         ['2023-05/a.jpg', '2023-05/b.jpg'])
+        # Adjacent terms are ANDed, quoted phrases are a single term
+        self.assertEqual(search('"new mexico" sunset dir:2024-01'),
+                         ['2024-01/a.jpg'])
+        self.assertEqual(search("not clouds and not sunset"),
+                         ['2023-05/d.jpg', '2024-01/d.jpg'])
+        # Directory names also act as tags
+        self.assertEqual(search("2024 and blurry"), ['2024-01/c.jpg'])
+        # Files that don't exist on disk never match
+        self.assertEqual(search("missing"), [])
+
+        self.assertEqual(
+            fotogr.search_expression([exprdir], "Dawn", ignorecase=False), [])
+
+        # Approximate matching
+        r = fotogr.search_expression([exprdir], "sunsett and dir:2023*",
+                                     maxdist=1)
+        self.assertEqual(r, [os.path.join(exprdir, '2023-05/a.jpg')])
+
+        for bad in ("(sunset or dawn", "sunset or", "sunset )", ""):
+            with self.assertRaises(fotogr.QuerySyntaxError):
+                fotogr.parse_query(bad)
+
 
 if __name__ == '__main__':
     unittest.main()
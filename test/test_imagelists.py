@@ -40,3 +40,41 @@ class ImgListTests(unittest.TestCase):
         # but metapho should at least know that Tags and Tags.bak
         # aren't images.
         self.assertEqual(imagelist.num_valid_images(), 5)
+
+    def test_unload(self):
+        """Unloading an image should free its data but keep its state."""
+        try:
+            from metapho.tkpho.tk_pho_image import tkPhoImage
+        except ImportError:
+            self.skipTest("No tkinter or PIL")
+
+        img = tkPhoImage("test/files/portrait.jpg")
+        img.load()
+        self.assertIsNotNone(img.orig_img)
+        img.rotate(90)
+        rot = img.rot
+
+        img.unload()
+        self.assertIsNone(img.orig_img)
+        self.assertIsNone(img.display_img)
+
+        img.load()
+        self.assertEqual(img.rot, rot)
+
+    def test_probe(self):
+        """Probing should find sizes and invalid files without decoding."""
+        try:
+            from metapho.tkpho.tk_pho_image import tkPhoImage, probe_image
+        except ImportError:
+            self.skipTest("No tkinter or PIL")
+
+        img = tkPhoImage("test/files/portrait.jpg")
+        img.set_probe_result(probe_image(img.relpath))
+        self.assertFalse(img.invalid)
+        img.load()
+        self.assertEqual(img.probed_size, img.orig_img.size)
+
+        for bad in ("test/files/Tags", "test/files", "test/files/nonexistent"):
+            img = tkPhoImage(bad)
+            img.set_probe_result(probe_image(bad))
+            self.assertTrue(img.invalid)
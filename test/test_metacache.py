@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Tests for the shared image metadata cache
+
+import unittest
+
+import shutil
+import os
+
+import sys
+sys.path.insert(0, '..')
+
+from metapho import metacache
+from metapho.metacache import MetadataCache
+
+
+class MetadataCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = os.path.abspath('test/metacachedir')
+        os.mkdir(self.testdir)
+        self.images = []
+        for f in ("1.jpg", "2.jpg", "portrait.jpg"):
+            path = os.path.join(self.testdir, f)
+            shutil.copy(os.path.join('test/files', f), path)
+            self.images.append(path)
+        self.cache = MetadataCache(os.path.join(self.testdir, "cache.sqlite"))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.testdir)
+
+    def test_metadata(self):
+        portrait = self.cache.get(self.images[2])
+        self.assertEqual((portrait['width'], portrait['height']), (480, 640))
+        self.assertEqual(portrait['orientation'], 1)
+        self.assertEqual(portrait['taken'], '2026:05:01 12:09:30')
+        self.assertEqual(portrait['exif']['DateTime'], '2026:05:01 12:09:30')
+        self.assertEqual(metacache.taken_or_mtime(portrait),
+                         '2026:05:01 12:09:30')
+
+        self.assertIsNone(self.cache.get(os.path.join(self.testdir, "no.jpg")))
+
+    def test_populate(self):
+        results, nread = self.cache.populate(self.images, workers=1)
+        self.assertEqual(nread, 3)
+        self.assertEqual(sorted(results), sorted(self.images))
+        self.assertEqual((results[self.images[0]]['width'],
+                          results[self.images[0]]['height']), (640, 480))
+
+        # A second run, even from another MetadataCache, reads nothing
+        other = MetadataCache(self.cache.cachefile)
+        self.assertEqual(other.populate(self.images)[1], 0)
+        other.close()
+
+        # Changing a file makes its entry stale
+        os.utime(self.images[1], (1600000000, 1600000000))
+        self.assertIsNone(self.cache.lookup(self.images[1],
+                                            os.stat(self.images[1])))
+        self.assertEqual(self.cache.populate(self.images)[1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
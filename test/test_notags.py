@@ -12,6 +12,10 @@ import sys
 sys.path.insert(0, '..')
 
 from metapho import MetaphoImage, Tagger, imagelist
+from metapho.dircache import DirStateCache
+from metapho.suggest import TagSuggester
+from metapho import fingerprint
+from metapho.fingerprint import FingerprintCache, full_fingerprint
 
 
 def sortlines(filecontents):
@@ -35,6 +39,10 @@ class NotagsTests(unittest.TestCase):
         self.testdir = Path('test/testdir')
         self.testdir.mkdir()
 
+        # Saving remembers fingerprints: keep them out of the real cache
+        self.fingerprint_cache = fingerprint.FINGERPRINT_CACHE
+        fingerprint.FINGERPRINT_CACHE = str(self.testdir / "fingerprints.json")
+
         adir = self.testdir / "dir1"
         adir.mkdir()
         afile = self.testdir / "dir1/img1.jpg"
@@ -97,6 +105,7 @@ class NotagsTests(unittest.TestCase):
     # executed after each test
     def tearDown(self):
         shutil.rmtree(self.testdir)
+        fingerprint.FINGERPRINT_CACHE = self.fingerprint_cache
 
 
     def test_notags(self):
@@ -180,6 +189,518 @@ tag ann : dir1/img1.jpg dir2/imgc.jpg
 tag phred : dir2/imgb.jpg
 tag tagged file : dir1/img1.jpg dir1/img2.jpg""")
 
+    def test_dircache(self):
+        """Test the incremental notags cache against the full scan,
+           and that it notices changes.
+        """
+        self.setUpMultilevel()
+        abstestdir = os.path.abspath(self.testdir)
+        # Keep the cache outside the tree being scanned
+        cachefile = os.path.join(os.path.abspath('test'),
+                                 'notags-cache.json')
+        self.addCleanup(os.unlink, cachefile)
+
+        tagger = Tagger()
+        tagger.read_tags(self.testdir)
+        nef = MetaphoImage.find_nonexistent_files()
+        utf, utd = tagger.find_untagged_files(self.testdir)
+
+        cache = DirStateCache(cachefile=cachefile)
+        cnef, cutf, cutd = cache.scan(self.testdir)
+        cache.save()
+        self.assertEqual(cnef, sorted(nef))
+        self.assertEqual(sorted(cutf), sorted(utf))
+        self.assertEqual(sorted(cutd), sorted(utd))
+        self.assertEqual(cache.stats["cached"], 0)
+
+        # Nothing changed: everything should come from the cache.
+        cache = DirStateCache(cachefile=cachefile)
+        self.assertEqual(cache.scan(self.testdir), (cnef, cutf, cutd))
+        self.assertEqual(cache.stats["recomputed"], 0)
+        cache.save()
+
+        # Add an image and tag one that wasn't tagged before.
+        # Sleep long enough that mtimes will differ even on
+        # filesystems with coarse timestamps.
+        import time
+        time.sleep(.01)
+        (self.testdir / "dir1/img7.jpg").touch()
+        (self.testdir / "dir2/Tags").write_text("tag phred: imgb.jpg")
+
+        cache = DirStateCache(cachefile=cachefile)
+        nef, utf, utd = cache.scan(self.testdir)
+        self.assertIn(os.path.join(abstestdir, 'dir1/img7.jpg'), utf)
+        self.assertNotIn(os.path.join(abstestdir, 'dir2'), utd)
+        self.assertIn(os.path.join(abstestdir, 'dir2/imga.jpg'), utf)
+        self.assertNotIn(os.path.join(abstestdir, 'dir2/imgb.jpg'), utf)
+        self.assertTrue(cache.stats["cached"] > 0)
+        self.assertTrue(cache.stats["recomputed"] >= 2)
+
+        # --full ignores what was cached.
+        cache = DirStateCache(cachefile=cachefile, full=True)
+        self.assertEqual(cache.scan(self.testdir), (nef, utf, utd))
+        self.assertEqual(cache.stats["cached"], 0)
+
+    def test_tag_scan(self):
+        """Test reading tags in the background with scan_tags_for_images
+           and merge_tag_scan, as tkpho does.
+        """
+        abstestdir = os.path.abspath(self.testdir)
+        imgnames = [ os.path.join(abstestdir, f)
+                     for f in ("dir1/img1.jpg", "dir1/img3.jpg",
+                               "dir2/imgb.jpg", "dir2/imgc.jpg") ]
+        imagelist.add_images([ MetaphoImage(f) for f in imgnames ])
+
+        (self.testdir / "dir2/Tags").write_text("tag phred: imgb.jpg")
+        (self.testdir / "Tags").write_text(
+            "category People\ntag ann: dir1/img1.jpg dir2/imgc.jpg")
+
+        scan = Tagger.scan_tags_for_images(imgnames)
+        # The scan shouldn't have touched the images
+        self.assertEqual([ im.tags for im in imagelist.image_list() ],
+                         [ [], [], [], [] ])
+
+        tagger = Tagger()
+        tagger.merge_tag_scan(scan)
+        self.assertEqual(tagger.commondir, abstestdir)
+        self.assertEqual(sortlines(str(tagger)), """category People
+category Tags
+tag ann : dir1/img1.jpg dir2/imgc.jpg
+tag phred : dir2/imgb.jpg
+tag tagged file : dir1/img1.jpg""")
+
+        # Files tagged but not in the imagelist aren't added
+        self.assertEqual(imagelist.num_images(), 4)
+
+    def test_bulk_tags(self):
+        """Test tagging and untagging many images at once."""
+        imgs = [ MetaphoImage(str(self.testdir / f))
+                 for f in ("dir1/img1.jpg", "dir1/img2.jpg",
+                           "dir2/imga.jpg", "dir2/imgb.jpg") ]
+        imagelist.add_images(imgs)
+
+        tagger = Tagger()
+        tagger.current_category = "Tags"
+        hike = tagger.tag_images("hike", imgs)
+        self.assertEqual(tagger.tag_images("dog", imgs[1:3], "Animals"), 1)
+        self.assertEqual(tagger.tag_list, [ "hike", "dog" ])
+        self.assertEqual(dict(tagger.categories),
+                         { "Tags": [ 0 ], "Animals": [ 1 ] })
+        # Tagging again doesn't duplicate anything
+        self.assertEqual(tagger.tag_images(hike, imgs), 0)
+        self.assertEqual([ im.tags for im in imgs ],
+                         [ [0], [0, 1], [0, 1], [0] ])
+
+        tagger.changed = False
+        self.assertEqual(tagger.untag_images("nosuchtag"), 0)
+        self.assertFalse(tagger.changed)
+        self.assertEqual(tagger.untag_images(
+            "hike", predicate=lambda im: "dir2" in im.filename), 2)
+        self.assertEqual(tagger.untag_images(1, imgs[:2]), 1)
+        self.assertTrue(tagger.changed)
+        self.assertEqual([ im.tags for im in imgs ],
+                         [ [0], [0], [1], [] ])
+
+    def test_write_tags(self):
+        """Test that saving only rewrites the Tags files that changed."""
+        abstestdir = os.path.abspath(self.testdir)
+        imgs = [ MetaphoImage(str(self.testdir / f))
+                 for f in ("dir1/img1.jpg", "dir1/img3.jpg",
+                           "dir2/imga.jpg") ]
+        imagelist.add_images(imgs)
+        (self.testdir / "Tags").write_text("tag old: dir2/imga.jpg")
+
+        tagger = Tagger()
+        tagger.read_all_tags_for_images()
+        self.assertEqual(tagger.commondir, abstestdir)
+        mtime = os.stat(self.testdir / "Tags").st_mtime_ns
+        tagger.fingerprint_cache = FingerprintCache(
+            cachefile=str(self.testdir / "saved-fingerprints.json"),
+            mode='quick')
+        def fingerprinted():
+            return sorted(os.path.relpath(path, abstestdir)
+                          for path in tagger.fingerprint_cache.paths)
+
+        # A new tag on an image in dir1 goes in dir1/Tags
+        tagger.add_tag("new", imgs[1])
+        tagger.write_tag_file()
+        self.assertEqual(sortlines((self.testdir / "dir1/Tags").read_text()),
+                         """category Tags
+tag new : img3.jpg
+tag tagged file : img1.jpg img2.jpg""")
+        self.assertEqual(os.stat(self.testdir / "Tags").st_mtime_ns, mtime)
+        self.assertTrue((self.testdir / "dir1/Tags.bak").exists())
+        self.assertFalse((self.testdir / "Tags.bak").exists())
+        self.assertFalse(tagger.changed)
+
+        # Only the images in the Tags file that was rewritten
+        # are fingerprinted
+        self.assertEqual(fingerprinted(), [ "dir1/img1.jpg", "dir1/img2.jpg",
+                                            "dir1/img3.jpg" ])
+        self.assertTrue((self.testdir / "saved-fingerprints.json").exists())
+
+        # Nothing changed: nothing is rewritten
+        mtime1 = os.stat(self.testdir / "dir1/Tags").st_mtime_ns
+        tagger.changed = True
+        tagger.write_tag_file()
+        self.assertEqual(os.stat(self.testdir / "dir1/Tags").st_mtime_ns,
+                         mtime1)
+
+        # Once saved, only Tags files with changes in them are looked at
+        self.assertEqual(tagger.tagfile_contents(changed_only=True), {})
+
+        # dir2 has no Tags file, so its new tags go in the top one
+        tagger.untag_images("old", [ imgs[2] ])
+        tagger.add_tag("newer", imgs[2])
+        self.assertEqual(list(tagger.tagfile_contents(changed_only=True)),
+                         [ os.path.join(abstestdir, "Tags") ])
+        tagger.write_tag_file()
+        self.assertEqual(sortlines((self.testdir / "Tags").read_text()),
+                         """category Tags
+tag newer : dir2/imga.jpg""")
+        self.assertEqual(os.stat(self.testdir / "dir1/Tags").st_mtime_ns,
+                         mtime1)
+        self.assertEqual(fingerprinted(), [ "dir1/img1.jpg", "dir1/img2.jpg",
+                                            "dir1/img3.jpg", "dir2/imga.jpg" ])
+
+        # Renaming or deleting a tag changes the files with images
+        # that have it
+        tagger.change_tag(tagger.categories["Tags"].index(
+            tagger.tag_list.index("new")), "renamed")
+        self.assertEqual(list(tagger.tagfile_contents(changed_only=True)),
+                         [ os.path.join(abstestdir, "dir1/Tags") ])
+        tagger.write_tag_file()
+        tagger.delete_tag("newer")
+        self.assertEqual(list(tagger.tagfile_contents(changed_only=True)),
+                         [ os.path.join(abstestdir, "Tags") ])
+        self.assertFalse((self.testdir / "Tags.tmp").exists())
+
+    def test_journal(self):
+        """Test that unsaved tag changes are replayed from the journal."""
+        def start_session():
+            imagelist.clear_images()
+            imgs = [ MetaphoImage(str(self.testdir / f))
+                     for f in ("dir1/img1.jpg", "dir1/img3.jpg",
+                               "dir2/imga.jpg") ]
+            imagelist.add_images(imgs)
+            tagger = Tagger()
+            tagger.read_all_tags_for_images()
+            return tagger, imgs
+
+        tagger, imgs = start_session()
+        tagger.add_tag("dog", imgs[1])
+        tagger.tag_images("hike", imgs)
+        tagger.untag_images("tagged file", [ imgs[0] ])
+        tagger.current_category = "Tags"
+        tagger.change_tag(tagger.categories["Tags"].index(
+            tagger.tagname_to_tagno("hike")), "walk")
+        journal = self.testdir / "Tags.journal"
+        self.assertEqual(len(journal.read_text().splitlines()), 4)
+
+        # While that session is running, another can't take its journal
+        other = start_session()[0]
+        self.assertIsNone(other.journal_path)
+        self.assertFalse(other.changed)
+
+        # "Crash" without saving, which releases the journal's lock,
+        # and start again
+        tagger.journal.close()
+        tagger, imgs = start_session()
+        self.assertTrue(tagger.changed)
+        tagdicts = [ sorted(tagger.tag_list[t] for t in img.tags)
+                     for img in imgs ]
+        self.assertEqual(tagdicts, [ [ "walk" ], [ "dog", "walk" ],
+                                     [ "walk" ] ])
+
+        tagger.write_tag_file()
+        self.assertFalse(journal.exists())
+        self.assertEqual(sortlines((self.testdir / "dir1/Tags").read_text()),
+                         """category Tags
+tag dog : img3.jpg
+tag tagged file : img2.jpg
+tag walk : img1.jpg img3.jpg""")
+
+    def test_delete_tag(self):
+        """Test that deleting a tag doesn't renumber the others."""
+        def start_session():
+            imagelist.clear_images()
+            imgs = [ MetaphoImage(str(self.testdir / f))
+                     for f in ("dir1/img1.jpg", "dir1/img3.jpg") ]
+            imagelist.add_images(imgs)
+            tagger = Tagger()
+            tagger.read_all_tags_for_images()
+            return tagger, imgs
+
+        tagger, imgs = start_session()
+        tagger.current_category = "Tags"
+        tagger.add_tag("dog", imgs[0])
+        tagger.add_tag("cat", imgs[1])
+        dog = tagger.tagname_to_tagno("dog")
+        cat = tagger.tagname_to_tagno("cat")
+
+        tagger.remove_tag("tagged file", imgs[0])
+        self.assertEqual(tagger.tag_list, [ None, "dog", "cat" ])
+        self.assertEqual(tagger.tag_list.index("cat"), cat)
+        self.assertEqual(tagger.tagname_to_tagno("tagged file"), -1)
+        self.assertEqual(tagger.categories["Tags"], [ dog, cat ])
+        self.assertEqual(imgs[1].tags, [ cat ])
+
+        # Renaming keeps the number, and deleted numbers aren't reused
+        tagger.change_tag(1, "kitten")
+        self.assertEqual(tagger.tagname_to_tagno("kitten"), cat)
+        self.assertEqual(tagger.tagname_to_tagno("cat"), -1)
+        self.assertEqual(tagger.tag_number("tagged file"), 3)
+
+        # The deleted tag isn't written, and a journal replay deletes it too
+        self.assertEqual(sortlines(tagger.tagfile_contents()[
+            os.path.abspath(self.testdir / "dir1/Tags")][0]),
+            """category Tags
+tag dog : img1.jpg
+tag kitten : img3.jpg""")
+        tagger.journal.close()
+        tagger, imgs = start_session()
+        self.assertNotIn("cat", tagger.tag_list)
+        # img1 still has the tombstone's number, from the Tags file
+        self.assertEqual([ [ tagger.tag_list[t]
+                             for t in tagger.tagdict_for_img(img)["Tags"] ]
+                           for img in imgs ], [ [ "dog" ], [ "kitten" ] ])
+        self.assertEqual(tagger.tag_list.names(), [ "dog", "kitten" ])
+        tagger.write_tag_file()
+        self.assertEqual(sortlines((self.testdir / "dir1/Tags").read_text()),
+                         """category Tags
+tag dog : img1.jpg
+tag kitten : img3.jpg""")
+
+    def test_categories(self):
+        """Test renaming and moving categories."""
+        imagelist.clear_images()
+        imgs = [ MetaphoImage(str(self.testdir / f))
+                 for f in ("dir1/img1.jpg", "dir1/img3.jpg") ]
+        imagelist.add_images(imgs)
+        tagger = Tagger()
+        tagger.read_all_tags_for_images()
+        tagger.tag_images("dog", imgs[1:], "Animals")
+        tagger.tag_images("New Mexico", imgs, "Places")
+        places = tagger.categories.category_id("Places")
+
+        tagger.rename_category("Places", "Where")
+        tagger.categories.move_to_end("Animals")
+        self.assertEqual(list(tagger.categories),
+                         [ "Tags", "Where", "Animals" ])
+        self.assertEqual(tagger.categories.category_name(places), "Where")
+        self.assertNotIn("Places", tagger.categories)
+        self.assertIn(tagger.tagname_to_tagno("New Mexico"),
+                      tagger.categories["Where"])
+        self.assertEqual(tagger.tagdict_for_img(imgs[1]),
+                         { "Animals": [ 1 ], "Where": [ 2 ] })
+        with self.assertRaises(ValueError):
+            tagger.rename_category("Where", "Tags")
+
+        tagger.categories.reorder([ "Animals", "Tags" ])
+        self.assertEqual(list(tagger.categories),
+                         [ "Animals", "Tags", "Where" ])
+
+        # Tags files list categories alphabetically, however they're ordered
+        self.assertEqual(
+            [ line for line in str(tagger).splitlines()
+              if line.startswith("category") ],
+            [ "category Animals", "category Tags", "category Where" ])
+
+    def test_snapshot(self):
+        """Test saving a snapshot of the tags while tagging goes on."""
+        imagelist.clear_images()
+        imgs = [ MetaphoImage(str(self.testdir / f))
+                 for f in ("dir1/img1.jpg", "dir1/img3.jpg") ]
+        imagelist.add_images(imgs)
+        tagger = Tagger()
+        tagger.read_all_tags_for_images()
+        journal = self.testdir / "dir1" / "Tags.journal"
+
+        tagger.add_tag("dog", imgs[1])
+        snap, images = tagger.snapshot()
+        size = tagger.journal_size()
+
+        # A change made while the snapshot is being saved
+        tagger.add_tag("cat", imgs[0])
+
+        snap.save_tagfiles(images)
+        tagger.merge_snapshot(snap, size)
+        self.assertEqual(sortlines((self.testdir / "dir1/Tags").read_text()),
+                         """category Tags
+tag dog : img3.jpg
+tag tagged file : img1.jpg img2.jpg""")
+
+        # Only the later change is left in the journal
+        records = journal.read_text().splitlines()
+        self.assertEqual(len(records), 1)
+        self.assertIn('"cat"', records[0])
+
+        tagger.write_tag_file()
+        self.assertFalse(journal.exists())
+        self.assertEqual(sortlines((self.testdir / "dir1/Tags").read_text()),
+                         """category Tags
+tag cat : img1.jpg
+tag dog : img3.jpg
+tag tagged file : img1.jpg img2.jpg""")
+
+    def test_snapshot_failed(self):
+        """Test that changes aren't lost when saving a snapshot fails."""
+        imagelist.clear_images()
+        imgs = [ MetaphoImage(str(self.testdir / f))
+                 for f in ("dir1/img1.jpg", "dir1/img3.jpg") ]
+        imagelist.add_images(imgs)
+        tagger = Tagger()
+        tagger.read_all_tags_for_images()
+        journal = self.testdir / "dir1" / "Tags.journal"
+
+        tagger.add_tag("dog", imgs[1])
+        snap, images = tagger.snapshot()
+        size = tagger.journal_size()
+        tagger.changed = False
+
+        def fail(*args, **kwargs):
+            raise ValueError("can't decode Tags")
+        snap.merge_tagfile = fail
+        with self.assertRaises(ValueError):
+            snap.save_tagfiles(images)
+
+        self.assertFalse(tagger.merge_snapshot(snap, size))
+        self.assertIn('"dog"', journal.read_text())
+        self.assertTrue(tagger.changed)
+        self.assertEqual(tagger.changed_images, { imgs[1].filename })
+
+        tagger.write_tag_file()
+        self.assertFalse(journal.exists())
+        self.assertIn("tag dog : img3.jpg",
+                      (self.testdir / "dir1/Tags").read_text())
+
+    def test_merge(self):
+        """Test saving over changes another program made to a Tags file."""
+        imagelist.clear_images()
+        imgs = [ MetaphoImage(str(self.testdir / f))
+                 for f in ("dir1/img1.jpg", "dir1/img3.jpg") ]
+        imagelist.add_images(imgs)
+        tagger = Tagger()
+        tagger.read_all_tags_for_images()
+        tagger.suggester = TagSuggester(imagelist.image_list())
+        tagger.add_tag("dog", imgs[1])
+        tagger.untag_images("tagged file", [ imgs[0] ])
+
+        # Meanwhile, another session adds and removes tags
+        tagfile = self.testdir / "dir1/Tags"
+        tagfile.write_text("""category Tags
+tag tagged file : img1.jpg
+tag cat : img2.jpg img3.jpg
+
+category Places
+tag home : img1.jpg
+""")
+        # Make sure the mtime changes, however coarse the filesystem's is
+        st = os.stat(tagfile)
+        os.utime(tagfile, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+        tagger.write_tag_file()
+        self.assertEqual(sortlines(tagfile.read_text()),
+                         """category Places
+category Tags
+tag cat : img2.jpg img3.jpg
+tag dog : img3.jpg
+tag home : img1.jpg""")
+        tagdicts = [ sorted(tagger.tag_list[t] for t in img.tags)
+                     for img in imgs ]
+        self.assertEqual(tagdicts, [ [ "home" ], [ "cat", "dog" ] ])
+
+        # The suggester counts the merged tags, including on img2,
+        # which the merge added to the imagelist
+        self.assertEqual(tagger.suggester.counted,
+                         TagSuggester(imagelist.image_list()).counted)
+
+        # Nobody changed it since, so there's nothing to merge
+        tagger.remove_tag(tagger.tagname_to_tagno("dog"), imgs[1])
+        tagger.write_tag_file()
+        self.assertNotIn("dog", tagfile.read_text())
+
+    def test_moved_files(self):
+        """Test finding tagged files that have moved to another directory.
+        """
+        self.setUpMultilevel()
+        abstestdir = os.path.abspath(self.testdir)
+
+        # Move a tagged file to another directory
+        os.rename(self.testdir / "dir1/img1.jpg",
+                  self.testdir / "dir3/subdir2/img1.jpg")
+
+        tagger = Tagger()
+        tagger.read_tags(self.testdir, recursive=True)
+
+        missing = MetaphoImage.find_nonexistent_files()
+        moved = MetaphoImage.find_moved_files(missing, abstestdir)
+        self.assertEqual(moved, {
+            os.path.join(abstestdir, 'dir1/img1.jpg'):
+                os.path.join(abstestdir, 'dir3/subdir2/img1.jpg') })
+
+        # With a limit of one directory, only dir1 gets searched.
+        self.assertEqual(MetaphoImage.find_moved_files(missing, abstestdir,
+                                                       maxdirs=1), {})
+
+        removed = MetaphoImage.clean_up_nonexistent_files(abstestdir)
+        self.assertEqual(removed, {'img5.jpg', 'img6.jpg'})
+        self.assertEqual(MetaphoImage.find_nonexistent_files(), [])
+        self.assertIn(os.path.join(abstestdir, 'dir3/subdir2/img1.jpg'),
+                      [ im.filename for im in imagelist.image_list() ])
+
+    def test_fingerprint_moves(self):
+        """Test finding moved files by content, even if they've been
+           renamed or share a name with other files.
+        """
+        self.setUpMultilevel()
+        abstestdir = os.path.abspath(self.testdir)
+        cachefile = os.path.join(os.path.abspath('test'),
+                                 'fingerprint-cache.json')
+        self.addCleanup(lambda: os.path.exists(cachefile)
+                        and os.unlink(cachefile))
+
+        (self.testdir / "dir1/img1.jpg").write_bytes(b'one' * 50000)
+        (self.testdir / "dir3/subdir1/imga.jpg").write_bytes(b'a' * 10)
+        (self.testdir / "dir3/subdir2/imga.jpg").write_bytes(b'b' * 10)
+        oldpaths = [ os.path.join(abstestdir, p)
+                     for p in ('dir1/img1.jpg', 'dir3/subdir1/imga.jpg') ]
+
+        fingerprints = FingerprintCache(cachefile=cachefile, mode='quick')
+        fingerprints.remember(oldpaths)
+        fingerprints.save()
+
+        # Rename one file, and move another next to a different file
+        # of the same name.
+        os.rename(oldpaths[0], self.testdir / "dir2/renamed.jpg")
+        os.mkdir(self.testdir / "dir4")
+        os.rename(oldpaths[1], self.testdir / "dir4/imga.jpg")
+
+        fingerprints = FingerprintCache(cachefile=cachefile, mode='quick')
+        moved = MetaphoImage.find_moved_files(oldpaths, abstestdir,
+                                              fingerprints=fingerprints)
+        self.assertEqual(moved, {
+            oldpaths[0]: os.path.join(abstestdir, 'dir2/renamed.jpg'),
+            oldpaths[1]: os.path.join(abstestdir, 'dir4/imga.jpg') })
+
+        # Without fingerprints, only the name is known,
+        # so the nearest imga.jpg wins.
+        moved = MetaphoImage.find_moved_files(oldpaths, abstestdir)
+        self.assertEqual(moved, {
+            oldpaths[1]: os.path.join(abstestdir, 'dir3/subdir2/imga.jpg') })
+
+        # Full fingerprints are full hashes, whether or not they're
+        # computed in a process pool
+        newpath = os.path.join(abstestdir, 'dir2/renamed.jpg')
+        for workers in (1, None):
+            fingerprints = FingerprintCache(cachefile=cachefile + '.full',
+                                            mode='full')
+            fingerprints.remember([ newpath,
+                                    os.path.join(abstestdir, 'dir2/imga.jpg') ],
+                                  workers=workers)
+            self.assertEqual(fingerprints.lookup(newpath)[1],
+                             full_fingerprint(newpath))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Tests for photoshare
+
+import unittest
+
+import shutil
+import os
+
+from metapho.scripts import photoshare
+
+TMPDIR = '/tmp/test-photoshare'
+
+
+class TestPhotoshare(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(TMPDIR):
+            shutil.rmtree(TMPDIR)
+        os.mkdir(TMPDIR)
+        self.saved_sharefile = photoshare.SHAREFILE
+        self.saved_cache = photoshare.METADATA_CACHE
+        photoshare.SHAREFILE = os.path.join(TMPDIR, "sharephotos")
+        with open(photoshare.SHAREFILE, "w") as fp:
+            print("2024-01-02\timg_001.jpg lassen/img_002.jpg", file=fp)
+            print("2024-03-04\timg_003.jpg", file=fp)
+            print("2025-05-06\tyosemite/img_001.jpg", file=fp)
+
+    def tearDown(self):
+        photoshare.SHAREFILE = self.saved_sharefile
+        photoshare.METADATA_CACHE = self.saved_cache
+        shutil.rmtree(TMPDIR)
+
+    def test_sharefile_index(self):
+        shareindex = photoshare.index_sharefile(photoshare.read_in_sharefile())
+        self.assertEqual(shareindex, { "img_001.jpg": "2025-05-06",
+                                       "img_002.jpg": "2024-01-02",
+                                       "img_003.jpg": "2024-03-04" })
+
+        self.assertEqual(photoshare.search_in_sharefile("a/b/img_002.jpg",
+                                                        shareindex),
+                         "2024-01-02")
+        self.assertIsNone(photoshare.search_in_sharefile("img_004.jpg",
+                                                         shareindex))
+
+        shared, unshared = photoshare.find_shared_image_times(
+            [ "x/img_001.jpg", "img_004.jpg", "img_003.jpg" ])
+        self.assertEqual(shared, [ ("2025-05-06", "x/img_001.jpg"),
+                                   ("2024-03-04", "img_003.jpg") ])
+        self.assertEqual(unshared, [ "img_004.jpg" ])
+
+    def test_suggest(self):
+        photoshare.METADATA_CACHE = os.path.join(TMPDIR, "cache.sqlite")
+
+        # Two directories of images tagged share, with increasing mtimes
+        # in the order listed.
+        imgs = [ "a/img_010.jpg", "a/img_011.jpg", "a/img_012.jpg",
+                 "b/img_020.jpg", "b/img_021.jpg", "a/img_001.jpg" ]
+        for d in ("a", "b"):
+            os.mkdir(os.path.join(TMPDIR, d))
+            with open(os.path.join(TMPDIR, d, "Tags"), "w") as fp:
+                print("tag share : " + ' '.join([ os.path.basename(i)
+                                                  for i in imgs
+                                                  if i.startswith(d) ]),
+                      file=fp)
+        for i, img in enumerate(imgs):
+            path = os.path.join(TMPDIR, img)
+            with open(path, "w") as fp:
+                print(' ', file=fp)
+            os.utime(path, (1700000000 + i * 60, 1700000000 + i * 60))
+
+        def suggest(num, order):
+            return [ os.path.relpath(img, TMPDIR) for img in
+                     photoshare.suggest_images([TMPDIR], num, order=order) ]
+
+        # a/img_001.jpg was already shared
+        self.assertEqual(suggest(3, "taken"),
+                         [ "a/img_010.jpg", "a/img_011.jpg", "a/img_012.jpg" ])
+        self.assertEqual(suggest(4, "dirs"),
+                         [ "a/img_010.jpg", "b/img_020.jpg",
+                           "a/img_011.jpg", "b/img_021.jpg" ])
+
+        # Only changed images are re-read
+        paths = [ os.path.join(TMPDIR, img) for img in imgs ]
+        cache = photoshare.MetadataCache(photoshare.METADATA_CACHE)
+        metadata, nread = photoshare.update_metadata_cache(paths, cache)
+        self.assertEqual(len(metadata), len(imgs))
+        # a/img_001.jpg wasn't a candidate, so it hasn't been read yet
+        self.assertEqual(nread, 1)
+        self.assertEqual(photoshare.update_metadata_cache(paths, cache)[1], 0)
+        os.utime(paths[0], (1600000000, 1600000000))
+        self.assertEqual(photoshare.update_metadata_cache(paths, cache)[1], 1)
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
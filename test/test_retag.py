@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Tests for metapho-retag
+
+import unittest
+
+import shutil
+import os
+
+import sys
+sys.path.insert(0, '..')
+
+from metapho.scripts.retag import parse_rule, retag
+
+
+class RetagTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = os.path.abspath('test/retagdir')
+        for d in ("2023", "2024", "2024/sub", "other"):
+            os.makedirs(self.path(d))
+        for img in ("2023/a.jpg", "2023/b.jpg", "2023/c.jpg",
+                    "2024/a.jpg", "2024/b.jpg", "2024/sub/z.jpg",
+                    "other/x.jpg"):
+            open(self.path(img), 'w').close()
+        self.write("2023/Tags", """category Animals
+tag Sqirrel : a.jpg
+tag pup, puppy : b.jpg
+tag dog : c.jpg
+
+category Places
+tag sunrise : a.jpg c.jpg
+""")
+        self.write("2024/Tags", """category Animals
+tag squirrel : b.jpg sub/z.jpg
+tag Sqirrel : a.jpg
+""")
+        # Nothing here for the rules to change, and not metapho's format
+        self.write("other/Tags", "tag cat: x.jpg\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def path(self, name):
+        return os.path.join(self.testdir, name)
+
+    def write(self, name, contents):
+        with open(self.path(name), 'w') as fp:
+            fp.write(contents)
+
+    def read(self, name):
+        with open(self.path(name)) as fp:
+            return fp.read()
+
+    def test_parse_rule(self):
+        self.assertEqual(parse_rule("Sqirrel = squirrel", 'rename'),
+                         ([ "Sqirrel" ], [ "squirrel" ]))
+        self.assertEqual(parse_rule("pup,puppy=dog", 'merge'),
+                         ([ "pup", "puppy" ], [ "dog" ]))
+        self.assertEqual(parse_rule("sunrise=dawn, sun", 'split'),
+                         ([ "sunrise" ], [ "dawn", "sun" ]))
+        for rule, kind in (("squirrel", 'rename'), ("a,b=c", 'rename'),
+                           ("a=b,c", 'merge'), ("a=", 'split')):
+            with self.assertRaises(ValueError):
+                parse_rule(rule, kind)
+
+    def test_retag(self):
+        rules = [ parse_rule("Sqirrel=squirrel", 'rename'),
+                  parse_rule("pup,puppy=dog", 'merge'),
+                  parse_rule("sunrise=dawn,sun", 'split') ]
+        before = { d: self.read(d + "/Tags") for d in ("2023", "2024",
+                                                       "other") }
+
+        # A dry run says what would change, but changes nothing
+        for jobs in (1, 2):
+            results = retag([ self.testdir ], rules, dry_run=True, jobs=jobs)
+            self.assertEqual(sorted(results),
+                             [ (self.path("2023/Tags"), True, [ 1, 1, 2 ]),
+                               (self.path("2024/Tags"), True, [ 1, 0, 0 ]),
+                               (self.path("other/Tags"), False,
+                                [ 0, 0, 0 ]) ])
+        for d in before:
+            self.assertEqual(self.read(d + "/Tags"), before[d])
+
+        retag([ self.testdir ], rules, jobs=2)
+        self.assertEqual(self.read("2023/Tags"), """
+category Animals
+
+tag squirrel : a.jpg
+tag dog : b.jpg c.jpg
+
+category Places
+
+tag dawn : a.jpg c.jpg
+tag sun : a.jpg c.jpg
+""")
+        self.assertEqual(self.read("2024/Tags"), """
+category Animals
+
+tag squirrel : a.jpg b.jpg sub/z.jpg
+""")
+        self.assertEqual(self.read("2023/Tags.bak"), before["2023"])
+        self.assertEqual(self.read("other/Tags"), before["other"])
+        self.assertFalse(os.path.exists(self.path("other/Tags.bak")))
+
+        # Running it again has nothing left to do
+        self.assertFalse(any(changed for tagfile, changed, counts
+                             in retag([ self.testdir ], rules, jobs=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Tests for tag suggestions
+
+import unittest
+
+import sys
+sys.path.insert(0, '..')
+
+from metapho import imagelist, MetaphoImage, Tagger
+from metapho.suggest import TagSuggester, neighbors
+
+
+class SuggestTests(unittest.TestCase):
+
+    def setUp(self):
+        imagelist.clear_images()
+        self.images = [ MetaphoImage("/photos/%s/%d.jpg" % (d, i))
+                        for d in ("trip", "home") for i in range(6) ]
+        imagelist.add_images(self.images)
+        self.tagger = Tagger()
+        for tag, which in (("beach", (0, 1, 2, 3)),
+                           ("ocean", (0, 1, 2)),
+                           ("sunset", (3,)),
+                           ("cat", (6, 7, 8, 9)),
+                           ("sofa", (6, 7))):
+            self.tagger.tag_images(tag, [ self.images[i] for i in which ])
+
+    def tearDown(self):
+        imagelist.clear_images()
+
+    def tagnos(self, *names):
+        return [ self.tagger.tag_list.index(name) for name in names ]
+
+    def test_neighbors(self):
+        self.images[2].displayed = False
+        self.assertEqual(
+            [ (d, self.images.index(img))
+              for d, img in neighbors(self.images, 3, count=2) ],
+            [ (1, 1), (1, 4), (2, 0), (2, 5) ])
+        self.assertEqual(neighbors(self.images, 0, count=0), [])
+
+    def test_suggest(self):
+        suggester = TagSuggester(self.images)
+
+        # An untagged image just after one with beach and sunset:
+        # beach is also the most used in its directory, and ocean
+        # is used there too. cat and sofa, from another directory,
+        # aren't suggested at all.
+        img = self.images[4]
+        nearby = neighbors(self.images, 4, count=1)
+        self.assertEqual(suggester.suggest(img, nearby, n=5),
+                         self.tagnos("beach", "sunset", "ocean"))
+
+        # Once it has beach, that's not suggested again, and ocean,
+        # which usually goes with beach, is the best guess.
+        self.assertEqual(suggester.suggest(img, nearby, n=1,
+                                           tags=self.tagnos("beach")),
+                         self.tagnos("ocean"))
+        self.assertEqual(suggester.suggest(img, nearby, n=5,
+                                           within=self.tagnos("sunset",
+                                                              "cat")),
+                         self.tagnos("sunset"))
+
+        # An image with cat, at home, wants sofa
+        self.assertEqual(suggester.suggest(self.images[10], n=1,
+                                           tags=self.tagnos("cat")),
+                         self.tagnos("sofa"))
+
+    def test_update(self):
+        # The counts follow tag changes made through the tagger,
+        # and end up the same as counting from scratch
+        self.tagger.suggester = TagSuggester(self.images)
+        self.tagger.untag_images("ocean", self.images[:2])
+        self.tagger.tag_images("sofa", self.images[8:10])
+        self.tagger.set_tags(self.tagnos("cat", "ocean"), [ self.images[0] ])
+        self.tagger.tag_images("dog", [ self.images[11] ])
+
+        fresh = TagSuggester(self.images)
+        for attr in ("tag_counts", "cooccur", "dir_counts", "dir_images",
+                     "counted"):
+            self.assertEqual(getattr(self.tagger.suggester, attr),
+                             getattr(fresh, attr), attr)
+        cat, sofa, ocean = self.tagnos("cat", "sofa", "ocean")
+        self.assertEqual(self.tagger.suggester.tag_candidates(cat),
+                         [ (sofa, .8), (ocean, .2) ])
+
+        # A deleted tag isn't counted or suggested any more,
+        # though images still have its number
+        self.tagger.delete_tag("sofa")
+        self.assertIn(sofa, self.images[6].tags)
+        self.assertNotIn(sofa, self.tagger.suggester.tag_counts)
+        self.assertEqual(self.tagger.suggester.tag_candidates(cat),
+                         [ (ocean, .2) ])
+        self.assertNotIn(sofa, self.tagger.suggester.suggest(
+            self.images[11], neighbors(self.images, 11), n=5))
+
+        self.tagger.set_tags([], self.images)
+        self.assertEqual(self.tagger.suggester.counted, {})
+        self.assertFalse(self.tagger.suggester.tag_counts)
+        self.assertEqual(self.tagger.suggester.suggest(self.images[0]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Tests for tag statistics
+
+import unittest
+
+import sys
+sys.path.insert(0, '..')
+
+from metapho import Tagger, SavedImage
+from metapho.tagstats import np, TagMatrix, top
+
+
+@unittest.skipUnless(np, "tag statistics need numpy")
+class TagStatsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tagger = Tagger()
+        self.tagger.tag_list = [ "share", "sunset", "dog", "unused" ]
+        self.matrix = TagMatrix.from_tagger(self.tagger, [
+            SavedImage("/photos/2023/a.jpg", [ 0, 1 ]),
+            SavedImage("/photos/2023/b.jpg", [ 1, 2, 0 ]),
+            SavedImage("/photos/2024/c.jpg", [ 2 ]),
+            SavedImage("/photos/2024/d.jpg", []),
+            SavedImage("/photos/2024/e.jpg", [ 1 ]),
+        ])
+
+    def test_counts(self):
+        self.assertEqual(self.matrix.tag_counts().tolist(), [ 2, 3, 2, 0 ])
+        self.assertEqual(top(self.matrix.tag_counts(),
+                             self.matrix.tag_list, 2),
+                         [ ("sunset", 3), ("share", 2) ])
+        self.assertEqual(self.matrix.cooccurring(0).tolist(), [ 2, 2, 1, 0 ])
+
+        self.assertEqual([ a.tolist() for a in self.matrix.cooccurrence() ],
+                         [ [ 0, 0, 1 ], [ 1, 2, 2 ], [ 2, 1, 1 ] ])
+        self.assertEqual([ a.tolist() for a in self.matrix.cooccurrence(1) ],
+                         [ [ 0 ], [ 1 ], [ 2 ] ])
+
+        # Deleted tags aren't shown, though images may still have them
+        names = [ "share", None, "dog", "unused" ]
+        self.assertEqual(top(self.matrix.tag_counts(), names, 2),
+                         [ ("share", 2), ("dog", 2) ])
+
+    def test_histogram(self):
+        names, groups = self.matrix.group_by_dir()
+        self.assertEqual(names, [ "/photos/2023", "/photos/2024" ])
+        self.assertEqual([ a.tolist() for a in self.matrix.histogram(groups) ],
+                         [ [ 0, 0, 0, 1, 1 ],
+                           [ 0, 1, 2, 1, 2 ],
+                           [ 2, 2, 1, 1, 1 ] ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# Tests for the SQLite tag store
+
+import unittest
+
+import shutil
+import os
+
+import sys
+sys.path.insert(0, '..')
+
+from metapho import imagelist, MetaphoImage, Tagger, fingerprint
+from metapho.tagstore import TagStore, import_tags, export_tags
+from metapho.scripts import fotogr
+
+
+class TagStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        imagelist.clear_images()
+        self.testdir = os.path.abspath('test/tagstoredir')
+        for d in ("2023-05", "2024-01", "2024-01/sub"):
+            os.makedirs(self.path(d))
+
+        # Saving remembers fingerprints: keep them out of the real cache
+        self.fingerprint_cache = fingerprint.FINGERPRINT_CACHE
+        fingerprint.FINGERPRINT_CACHE = self.path("fingerprints.json")
+        for img in ("2023-05/a.jpg", "2023-05/b.jpg", "2023-05/c.jpg",
+                    "2024-01/a.jpg", "2024-01/b.jpg", "2024-01/sub/z.jpg"):
+            open(self.path(img), 'w').close()
+        with open(self.path("2023-05/Tags"), 'w') as fp:
+            fp.write("""category Tags
+tag sunset : a.jpg
+tag dawn, clouds : b.jpg c.jpg
+tag blurry : c.jpg
+
+category Places
+tag New Mexico : a.jpg
+tag has space : "c.jpg"
+""")
+        with open(self.path("2024-01/Tags"), 'w') as fp:
+            fp.write("""category Places
+tag New Mexico : a.jpg sub/z.jpg
+category Tags
+tag sunset : b.jpg
+""")
+        self.store = TagStore(self.path("tags.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.testdir)
+        imagelist.clear_images()
+        fingerprint.FINGERPRINT_CACHE = self.fingerprint_cache
+
+    def path(self, name):
+        return os.path.join(self.testdir, name)
+
+    def tagfile_contents(self):
+        imagelist.clear_images()
+        tagger = Tagger()
+        tagger.read_tags(self.testdir)
+        return { tagfile: contents for tagfile, (contents, filenames)
+                 in tagger.tagfile_contents().items() }
+
+    def test_round_trip(self):
+        before = self.tagfile_contents()
+        self.assertEqual(import_tags(self.store, [ self.testdir ]), 2)
+
+        # Exporting rewrites the files as metapho would write them,
+        # after which exporting again changes nothing
+        export_tags(self.store)
+        self.assertEqual(self.tagfile_contents(), before)
+        self.assertEqual(export_tags(self.store), [])
+
+        for tagfile in before:
+            os.unlink(tagfile)
+        self.assertEqual(sorted(export_tags(self.store)), sorted(before))
+        self.assertEqual(self.tagfile_contents(), before)
+
+    def test_tagger(self):
+        import_tags(self.store, [ self.testdir ])
+
+        # A Tagger using the store sees the same tags as from Tags files
+        imagelist.clear_images()
+        imgs = [ MetaphoImage(self.path(f))
+                 for f in ("2023-05/a.jpg", "2023-05/c.jpg") ]
+        imagelist.add_images(imgs)
+        tagger = Tagger()
+        tagger.tagstore = self.store.dbfile
+        tagger.read_all_tags_for_images()
+        self.assertEqual([ sorted(tagger.tag_list[t] for t in img.tags)
+                           for img in imgs ],
+                         [ [ "New Mexico", "sunset" ],
+                           [ "blurry", "clouds", "dawn", "has space" ] ])
+
+        tagger.add_tag("dog", imgs[0], "Animals")
+        tagger.untag_images("blurry", [ imgs[1] ])
+        tagger.write_tag_file()
+
+        r = fotogr.search_expression([ self.testdir ], "dog or blurry",
+                                     tagstore=self.store.dbfile)
+        self.assertEqual(r, [ self.path("2023-05/a.jpg") ])
+
+        export_tags(self.store, [ self.path("2023-05") ])
+        with open(self.path("2023-05/Tags")) as fp:
+            contents = fp.read()
+        self.assertIn("category Animals\n\ntag dog : a.jpg\n", contents)
+        self.assertNotIn("blurry", contents)
+
+        # Moving a tag to another category moves it in the store,
+        # and a category that's gone stays gone
+        imagelist.clear_images()
+        imagelist.add_images(imgs)
+        tagger = Tagger()
+        tagger.tagstore = self.store.dbfile
+        tagger.read_all_tags_for_images()
+        dog = tagger.tag_list.index("dog")
+        tagger.categories["Pets"] = [ dog ]
+        del tagger.categories["Animals"]
+        tagger.changed = True
+        tagger.write_tag_file()
+
+        imagelist.clear_images()
+        tagger = Tagger()
+        self.store.load(tagger)
+        self.assertEqual({ cat: [ tagger.tag_list[t] for t in tagnos ]
+                           for cat, tagnos in tagger.categories.items()
+                           if "dog" in tagger.tag_list
+                           and tagger.tag_list.index("dog") in tagnos },
+                         { "Pets": [ "dog" ] })
+        self.assertNotIn("Animals", tagger.categories)
+
+        # Importing more Tags files keeps the categories already there
+        os.makedirs(self.path("2025-02"))
+        open(self.path("2025-02/x.jpg"), 'w').close()
+        with open(self.path("2025-02/Tags"), 'w') as fp:
+            fp.write("category Weather\ntag rain : x.jpg\n")
+        import_tags(self.store, [ self.path("2025-02") ])
+        imagelist.clear_images()
+        tagger = Tagger()
+        self.store.load(tagger)
+        self.assertIn("Pets", tagger.categories)
+        self.assertEqual([ tagger.tag_list[t]
+                           for t in tagger.categories["Weather"] ], [ "rain" ])
+
+    def test_fotogr(self):
+        import_tags(self.store, [ self.testdir ])
+
+        for expr in ("(sunset or dawn) and not blurry",
+                     "sunset and dir:2024*",
+                     '"new mexico" and not dir:2023*',
+                     "not clouds", "2024", "sunsett"):
+            for maxdist in (0, 1):
+                self.assertEqual(
+                    fotogr.search_expression([ self.testdir ], expr,
+                                             maxdist=maxdist,
+                                             tagstore=self.store.dbfile),
+                    fotogr.search_expression([ self.testdir ], expr,
+                                             maxdist=maxdist),
+                    expr)
+
+        query = fotogr.patterns_query([ "dawn", "sunset" ], [], [ "clouds" ])
+        self.assertEqual(fotogr.search_tagstore(self.store.dbfile,
+                                                [ self.path("2023-05") ],
+                                                query),
+                         [ self.path("2023-05/a.jpg") ])
+
+
+if __name__ == '__main__':
+    unittest.main()
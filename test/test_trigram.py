@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Tests for metapho's trigram index
+
+import unittest
+import re
+
+from metapho.trigram import TrigramIndex, required_literals, \
+                            substring_edit_distance
+from metapho.taglist import TagList
+from metapho import Tagger
+
+
+TAGS = [ "Gray Squirrel", "squirrels", "sunset", "dawn", "ox",
+         "New Mexico", "Bruny Island", "Mexican jay" ]
+
+
+class TrigramTests(unittest.TestCase):
+
+    def test_search(self):
+        index = TrigramIndex(TAGS)
+        self.assertEqual(sorted(index.search("squirrel")),
+                         [ "Gray Squirrel", "squirrels" ])
+        self.assertEqual(sorted(index.search("mexic")),
+                         [ "Mexican jay", "New Mexico" ])
+        # Too short for trigrams: everything is a candidate
+        self.assertEqual(index.search("ox"), [ "ox" ])
+        self.assertEqual(index.search("zebra"), [])
+
+        index = TrigramIndex(TAGS, ignorecase=False)
+        self.assertEqual(index.search("squirrel"), [ "squirrels" ])
+
+        index.discard("squirrels")
+        self.assertEqual(index.search("squirrel"), [])
+        self.assertEqual(len(index), len(TAGS) - 1)
+
+    def test_regex(self):
+        self.assertEqual(required_literals("sq.*rel"), [ "sq", "rel" ])
+        self.assertEqual(required_literals("colou?r"), [ "colo", "r" ])
+        self.assertEqual(required_literals(r"a{2}bcd\.jpg"), [ "bcd.jpg" ])
+        self.assertEqual(required_literals("[abc]def+g"), [ "def", "g" ])
+        self.assertEqual(required_literals("sun|dawn"), [])
+
+        index = TrigramIndex(TAGS)
+        self.assertEqual(index.regex_search("s.*rrel$", re.IGNORECASE),
+                         [ "Gray Squirrel" ])
+        self.assertEqual(sorted(index.regex_search("^(sun|daw)")),
+                         [ "dawn", "sunset" ])
+
+    def test_fuzzy(self):
+        self.assertEqual(substring_edit_distance("sqirrel", "gray squirrel"),
+                         1)
+        self.assertEqual(substring_edit_distance("sunset", "sunset"), 0)
+
+        index = TrigramIndex(TAGS)
+        self.assertEqual(sorted(index.fuzzy_search("sqirrel", 1)),
+                         [ "Gray Squirrel", "squirrels" ])
+        self.assertEqual(index.fuzzy_search("bruni iland", 1), [])
+        self.assertEqual(index.fuzzy_search("bruni iland", 2),
+                         [ "Bruny Island" ])
+
+    def test_match_tag(self):
+        tagger = Tagger()
+        tagger.tag_list = list(TAGS)
+        self.assertEqual(tagger.match_tag("sunse"), [ "sunset" ])
+        tagger.tag_list.append("sunrise")
+        self.assertEqual(sorted(tagger.match_tag("^sun", regex=True)),
+                         [ "sunrise", "sunset" ])
+        self.assertEqual(tagger.match_tag("daan", maxdist=1), [ "dawn" ])
+
+        # A TagList says when it changes, so renaming or deleting
+        # a tag is noticed without comparing the whole list
+        tagger.tag_list = TagList(TAGS)
+        index = tagger.tag_trigrams()
+        self.assertIs(tagger.tag_trigrams(), index)
+        tagger.tag_list[tagger.tag_list.index("sunset")] = "Sundown"
+        self.assertEqual(tagger.match_tag("sund"), [ "Sundown" ])
+        tagger.delete_tag("Sundown")
+        self.assertEqual(tagger.match_tag("sund"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()